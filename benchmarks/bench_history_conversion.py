@@ -0,0 +1,121 @@
+"""
+历史转换基准：对比每轮全量转换与按频道增量转换（_convert_history 缓存）的开销。
+
+用法（仓库根目录）：
+    python benchmarks/bench_history_conversion.py [--turns 50] [--rounds 5]
+
+模拟一条已有 N 轮历史的投诉频道，单次回复内连续 5 个工具轮次，
+每轮追加 model(functionCall) + user(functionResponse) 两个回合后重新转换。
+"""
+import argparse
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cogs.ai_customer_service import AICustomerService  # noqa: E402
+
+
+class _Config:
+    def __init__(self, data: dict):
+        self.data = data
+
+    def get(self, key, default=None):
+        value = self.data
+        for k in key.split('.'):
+            if not isinstance(value, dict) or value.get(k) is None:
+                return default
+            value = value[k]
+        return value
+
+
+def _make_cog(blob_dir: str) -> AICustomerService:
+    bot = types.SimpleNamespace(
+        config_loader=_Config({'ai_customer_service': {'blob_store': {'dir': blob_dir}}}),
+        user=types.SimpleNamespace(id=1),
+        guilds=[],
+    )
+    return AICustomerService(bot)
+
+
+def _seed_history(cog: AICustomerService, turns: int) -> list:
+    digest = cog.blob_store.put(b'\x89PNG' + b'\0' * 4096)
+    history: list = []
+    for i in range(turns // 2):
+        history.append({
+            'role': 'user',
+            'parts': [
+                {'text': f'<odyxml:user name="u" id="1" time="t">\n第 {i} 条投诉内容 ' + '字' * 300},
+                {'inlineData': {'mimeType': 'image/png', '_blob': digest}},
+                {'text': '</odyxml:user>'},
+            ],
+        })
+        history.append({'role': 'model', 'parts': [{'text': '收到，' + '回复' * 200}]})
+    return history
+
+
+def _tool_round(i: int) -> list:
+    return [
+        {
+            'role': 'model',
+            'parts': [{'functionCall': {'name': 'fetch_messages', 'args': {'message_links': [f'l{i}']}}}],
+        },
+        {
+            'role': 'user',
+            'parts': [{
+                'functionResponse': {
+                    'name': 'fetch_messages',
+                    'response': {'content': {'messages': '上下文' * 2000}},
+                },
+            }],
+        },
+    ]
+
+
+def _run(cog: AICustomerService, kind: str, turns: int, rounds: int, cached: bool) -> list[float]:
+    convert = {
+        'openai': cog._gemini_contents_to_openai_messages,
+        'responses': cog._gemini_contents_to_responses_input,
+        'claude': cog._gemini_contents_to_claude_messages,
+    }[kind]
+    history = _seed_history(cog, turns)
+    channel_id = 42 if cached else None
+    cog._invalidate_conversion_cache()
+    timings: list[float] = []
+    for r in range(rounds):
+        t0 = time.perf_counter()
+        convert(history, channel_id)
+        timings.append((time.perf_counter() - t0) * 1000)
+        history.extend(_tool_round(r))
+    return timings
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--turns', type=int, default=50)
+    ap.add_argument('--rounds', type=int, default=5)
+    ap.add_argument('--repeat', type=int, default=20)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cog = _make_cog(tmp)
+        print(f'history={args.turns} turns, {args.rounds} tool rounds per reply, best of {args.repeat}')
+        print(f"{'provider':<10} {'mode':<12} " + ' '.join(f'r{i + 1:<7}' for i in range(args.rounds)) + ' total(ms)')
+        for kind in ('openai', 'responses', 'claude'):
+            for cached in (False, True):
+                best = None
+                for _ in range(args.repeat):
+                    t = _run(cog, kind, args.turns, args.rounds, cached)
+                    if best is None or sum(t) < sum(best):
+                        best = t
+                mode = 'incremental' if cached else 'full'
+                cells = ' '.join(f'{x:<8.3f}' for x in best)
+                print(f'{kind:<10} {mode:<12} {cells} {sum(best):.3f}')
+        print('conversion_stats:', cog.conversion_stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+图片转码基准：统计按字节/像素预算转码（utils.transcode_image）后的请求体积缩减与单图 CPU 耗时。
+
+用法（仓库根目录）：
+    python benchmarks/bench_image_transcode.py [--corpus DIR] [--max-kb 800] [--max-mp 2.5] [--min-psnr 32]
+
+不给 --corpus 时生成一组合成截图：纯色界面 + 文字、带渐变/噪点的照片类截图、长截图、带透明通道的 PNG。
+请求体积按 base64 计（发送给 API 时的实际大小）。
+"""
+import argparse
+import io
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from utils import normalize_image  # noqa: E402
+from utils.image_variants import _luma_psnr  # noqa: E402
+
+_MIME = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.webp': 'image/webp', '.gif': 'image/gif'}
+
+
+def _save(img: Image.Image, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **({'quality': 95} if fmt == 'JPEG' else {}))
+    return buf.getvalue()
+
+
+def _draw_text_lines(draw: ImageDraw.ImageDraw, w: int, h: int, top: int, rng: random.Random) -> None:
+    y = top
+    while y < h - 20:
+        x = 40
+        words = rng.randint(6, 14)
+        line = ' '.join(''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 9))) for _ in range(words))
+        draw.text((x, y), line, fill=(30, 30, 30))
+        y += 18
+
+
+def _ui_screenshot(w: int, h: int, seed: int) -> Image.Image:
+    rng = random.Random(seed)
+    img = Image.new('RGB', (w, h), (54, 57, 63))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, 240, h), fill=(47, 49, 54))
+    draw.rectangle((240, 0, w, 48), fill=(32, 34, 37))
+    for i in range(0, h, 64):
+        draw.ellipse((260, i + 8, 300, i + 48), fill=(88, 101, 242))
+        draw.rectangle((320, i + 12, w - 40, i + 50), fill=(64, 68, 75))
+    draw.rectangle((320, 60, w - 40, h - 60), fill=(242, 243, 245))
+    _draw_text_lines(draw, w, h - 60, 70, rng)
+    return img
+
+
+def _photo_screenshot(w: int, h: int, seed: int) -> Image.Image:
+    rng = random.Random(seed)
+    img = Image.linear_gradient('L').resize((w, h)).convert('RGB')
+    noise = Image.effect_noise((w, h), 40).convert('RGB')
+    img = Image.blend(img, noise, 0.35)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, h - 160, w, h), fill=(255, 255, 255))
+    _draw_text_lines(draw, w, h, h - 150, rng)
+    return img
+
+
+def _corpus_synthetic() -> list[tuple[str, bytes, str]]:
+    out = []
+    ui = _ui_screenshot(1920, 1080, 1)
+    out.append(('ui_1080p.png', _save(ui, 'PNG'), 'image/png'))
+    out.append(('ui_1440p.png', _save(_ui_screenshot(2560, 1440, 2), 'PNG'), 'image/png'))
+    out.append(('ui_long.png', _save(_ui_screenshot(1170, 6000, 3), 'PNG'), 'image/png'))
+    photo = _photo_screenshot(1920, 1080, 4)
+    out.append(('photo_1080p.png', _save(photo, 'PNG'), 'image/png'))
+    out.append(('photo_1080p.jpg', _save(photo, 'JPEG'), 'image/jpeg'))
+    out.append(('photo_4k.png', _save(_photo_screenshot(3840, 2160, 5), 'PNG'), 'image/png'))
+    alpha = ui.convert('RGBA')
+    alpha.putalpha(Image.linear_gradient('L').resize(ui.size))
+    out.append(('ui_alpha.png', _save(alpha, 'PNG'), 'image/png'))
+    out.append(('small_icon.png', _save(_ui_screenshot(400, 300, 6), 'PNG'), 'image/png'))
+    return out
+
+
+def _corpus_dir(path: str) -> list[tuple[str, bytes, str]]:
+    out = []
+    for p in sorted(Path(path).iterdir()):
+        mime = _MIME.get(p.suffix.lower())
+        if mime:
+            out.append((p.name, p.read_bytes(), mime))
+    return out
+
+
+def _b64_len(n: int) -> int:
+    return (n + 2) // 3 * 4
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--corpus', help='样本目录（png/jpg/webp/gif）；缺省使用合成截图')
+    ap.add_argument('--max-kb', type=int, default=800)
+    ap.add_argument('--max-mp', type=float, default=2.5)
+    ap.add_argument('--min-psnr', type=float, default=32.0)
+    ap.add_argument('--palette-colors', type=int, default=256)
+    ap.add_argument('--jpeg', action='store_true', help='有损档位用 JPEG 而非 WebP')
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    corpus = _corpus_dir(args.corpus) if args.corpus else _corpus_synthetic()
+    transcode = {
+        'max_bytes': args.max_kb * 1024,
+        'max_pixels': int(args.max_mp * 1_000_000),
+        'min_psnr': args.min_psnr,
+        'palette_colors': args.palette_colors,
+        'webp': not args.jpeg,
+    }
+    print(f"budget: {args.max_kb} KB, {args.max_mp} MP, PSNR >= {args.min_psnr} dB, best of {args.repeat}")
+    print(f"{'image':<18} {'size':>11} {'orig KB':>9} {'resize KB':>10} {'out KB':>8} {'mime':<11} {'PSNR':>6} {'cpu ms':>8}")
+    total_orig = total_base = total_out = 0
+    total_cpu = 0.0
+    for name, data, mime in corpus:
+        # 基线：只做像素上限缩放（原有行为）；对比：同一流程开启转码
+        base = normalize_image(data, mime, 7680, (2000,))
+        best = None
+        result = None
+        for _ in range(args.repeat):
+            t0 = time.process_time()
+            result = normalize_image(data, mime, 7680, (2000,), transcode)
+            dt = (time.process_time() - t0) * 1000
+            best = dt if best is None else min(best, dt)
+        src = Image.open(io.BytesIO(base['data'])).convert('RGB')
+        out = Image.open(io.BytesIO(result['data'])).convert('RGB')
+        if out.size != src.size:
+            src = src.resize(out.size, Image.LANCZOS)
+        psnr = _luma_psnr(src, out)
+        w, h = Image.open(io.BytesIO(data)).size
+        total_orig += _b64_len(len(data))
+        total_base += _b64_len(len(base['data']))
+        total_out += _b64_len(len(result['data']))
+        total_cpu += best
+        print(
+            f"{name:<18} {f'{w}x{h}':>11} {len(data) / 1024:>9.1f} {len(base['data']) / 1024:>10.1f} "
+            f"{len(result['data']) / 1024:>8.1f} {result['mime']:<11} {min(psnr, 99):>6.1f} {best:>8.1f}"
+        )
+    print(
+        f'request payload (base64): original {total_orig / 1024:.1f} KB, '
+        f'resize only {total_base / 1024:.1f} KB, transcoded {total_out / 1024:.1f} KB '
+        f'({(1 - total_out / max(1, total_base)) * 100:.1f}% smaller than resize only); '
+        f'cpu {total_cpu:.1f} ms total, {total_cpu / max(1, len(corpus)):.1f} ms/image'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+SSE 解析基准：对比旧的逐行解析（readline + decode/strip + json.loads + 字符串累加）
+与 utils.iter_sse（按块读取 + bytearray 切分 + loads_json + 列表拼接）每 1k 个事件的 CPU 耗时。
+
+用法（仓库根目录）：
+    python benchmarks/bench_sse_decode.py [--stream FILE ...] [--events 4000] [--chunk 4096] [--repeat 5]
+
+--stream 为录制的原始响应体（text/event-stream，文件名含 claude 时按 Messages API 事件解析，否则按 Gemini）；
+不给时生成与两个后端格式一致的合成流。两种解析都从真实的 aiohttp.StreamReader 读取，按 --chunk 大小喂入。
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiohttp  # noqa: E402
+
+from utils import iter_sse, loads_json  # noqa: E402
+from utils import sse as sse_module  # noqa: E402
+
+_WORDS = '我们已经收到您的投诉 处罚记录 管理员会尽快处理 请提供 截图 消息链接 the user reported spam in channel'.split()
+
+
+def _gemini_stream(n: int) -> bytes:
+    out = []
+    for i in range(n):
+        text = ' '.join(_WORDS[(i + k) % len(_WORDS)] for k in range(4))
+        ev = {
+            'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'index': 0}],
+            'usageMetadata': {'promptTokenCount': 1200, 'candidatesTokenCount': i, 'totalTokenCount': 1200 + i},
+            'modelVersion': 'gemini-model',
+            'responseId': 'resp-0001',
+        }
+        out.append(b'data: ' + json.dumps(ev, ensure_ascii=False).encode('utf-8') + b'\r\n\r\n')
+    return b''.join(out)
+
+
+def _claude_stream(n: int) -> bytes:
+    def ev(name: str, obj: dict) -> bytes:
+        return f'event: {name}\ndata: '.encode() + json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n\n'
+
+    out = [ev('message_start', {'type': 'message_start', 'message': {'usage': {'input_tokens': 1200, 'output_tokens': 1}}})]
+    out.append(ev('content_block_start', {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}))
+    for i in range(n - 4):
+        if i % 50 == 0:
+            out.append(ev('ping', {'type': 'ping'}))
+            continue
+        text = ' '.join(_WORDS[(i + k) % len(_WORDS)] for k in range(3))
+        out.append(ev('content_block_delta', {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': text}}))
+    out.append(ev('content_block_stop', {'type': 'content_block_stop', 'index': 0}))
+    out.append(ev('message_delta', {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'}, 'usage': {'output_tokens': n}}))
+    out.append(ev('message_stop', {'type': 'message_stop'}))
+    return b''.join(out)
+
+
+class _Protocol:
+    _reading_paused = False
+
+    def pause_reading(self, **_kwargs) -> None:
+        pass
+
+    def resume_reading(self, **_kwargs) -> None:
+        pass
+
+
+def _reader(body: bytes, chunk: int) -> aiohttp.StreamReader:
+    reader = aiohttp.StreamReader(_Protocol(), 2 ** 20, loop=asyncio.get_running_loop())
+    for i in range(0, len(body), chunk):
+        reader.feed_data(body[i:i + chunk])
+    reader.feed_eof()
+    return reader
+
+
+async def _old_gemini(reader: aiohttp.StreamReader) -> tuple[int, str]:
+    full_text = ''
+    events = 0
+    while True:
+        line_bytes = await reader.readline()
+        if not line_bytes:
+            break
+        line = line_bytes.decode('utf-8').strip()
+        if not line or not line.startswith('data: '):
+            continue
+        json_str = line[6:]
+        if json_str == '[DONE]':
+            break
+        try:
+            data = json.loads(json_str)
+        except json.JSONDecodeError:
+            continue
+        events += 1
+        for part in data.get('candidates', [{}])[0].get('content', {}).get('parts', []):
+            if 'text' in part:
+                full_text += part['text']
+    return events, full_text
+
+
+async def _new_gemini(reader: aiohttp.StreamReader) -> tuple[int, str]:
+    chunks: list[str] = []
+    events = 0
+    async for _event, raw in iter_sse(reader):
+        if raw == b'[DONE]':
+            break
+        try:
+            data = loads_json(raw)
+        except ValueError:
+            continue
+        events += 1
+        for part in data.get('candidates', [{}])[0].get('content', {}).get('parts', []):
+            if 'text' in part:
+                chunks.append(part['text'])
+    return events, ''.join(chunks)
+
+
+async def _old_claude(reader: aiohttp.StreamReader) -> tuple[int, str]:
+    full_text = ''
+    events = 0
+    current_event = None
+    while True:
+        line_bytes = await reader.readline()
+        if not line_bytes:
+            break
+        line = line_bytes.decode('utf-8', errors='replace').rstrip('\r\n')
+        if not line:
+            current_event = None
+            continue
+        if line.startswith(':'):
+            continue
+        if line.startswith('event: '):
+            current_event = line[7:].strip()
+            continue
+        if not line.startswith('data: '):
+            continue
+        try:
+            data = json.loads(line[6:])
+        except json.JSONDecodeError:
+            continue
+        events += 1
+        if (data.get('type') or current_event) == 'content_block_delta':
+            delta = data.get('delta') or {}
+            if delta.get('type') == 'text_delta':
+                full_text += delta.get('text', '')
+    return events, full_text
+
+
+async def _new_claude(reader: aiohttp.StreamReader) -> tuple[int, str]:
+    chunks: list[str] = []
+    events = 0
+    async for current_event, raw in iter_sse(reader):
+        try:
+            data = loads_json(raw)
+        except ValueError:
+            continue
+        events += 1
+        if (data.get('type') or current_event) == 'content_block_delta':
+            delta = data.get('delta') or {}
+            if delta.get('type') == 'text_delta':
+                chunks.append(delta.get('text', ''))
+    return events, ''.join(chunks)
+
+
+async def _measure(fn, body: bytes, chunk: int, repeat: int) -> tuple[float, int, str]:
+    best = None
+    result = (0, '')
+    for _ in range(repeat):
+        reader = _reader(body, chunk)
+        t0 = time.process_time()
+        result = await fn(reader)
+        dt = time.process_time() - t0
+        best = dt if best is None else min(best, dt)
+    return best, result[0], result[1]
+
+
+async def _run(args: argparse.Namespace) -> None:
+    if args.stream:
+        streams = [(Path(p).name, Path(p).read_bytes(), 'claude' in Path(p).name.lower()) for p in args.stream]
+    else:
+        streams = [
+            ('gemini (synthetic)', _gemini_stream(args.events), False),
+            ('claude (synthetic)', _claude_stream(args.events), True),
+        ]
+    orjson = sse_module._orjson
+    print(f"json backend: {'orjson' if orjson else 'json (stdlib)'}, chunk {args.chunk} B, best of {args.repeat}")
+    print(f"{'stream':<22} {'events':>7} {'KB':>8} {'old ms/1k':>10} {'new ms/1k':>10} {'stdlib ms/1k':>13} {'speedup':>8}")
+    for name, body, claude in streams:
+        old_fn, new_fn = (_old_claude, _new_claude) if claude else (_old_gemini, _new_gemini)
+        old_t, events, old_text = await _measure(old_fn, body, args.chunk, args.repeat)
+        new_t, new_events, new_text = await _measure(new_fn, body, args.chunk, args.repeat)
+        assert (events, old_text) == (new_events, new_text), f'{name}: 解析结果不一致'
+        # 新解析器不使用 orjson 时的耗时（只看切分与拼接本身的收益）
+        sse_module._orjson = None
+        try:
+            std_t, _, _ = await _measure(new_fn, body, args.chunk, args.repeat)
+        finally:
+            sse_module._orjson = orjson
+        per_k = 1000 / max(1, events) * 1000
+        print(
+            f"{name:<22} {events:>7} {len(body) / 1024:>8.1f} {old_t * per_k:>10.2f} {new_t * per_k:>10.2f} "
+            f"{std_t * per_k:>13.2f} {old_t / max(new_t, 1e-9):>7.2f}x"
+        )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--stream', nargs='*', help='录制的 SSE 响应体文件')
+    ap.add_argument('--events', type=int, default=4000)
+    ap.add_argument('--chunk', type=int, default=4096, help='每次喂入 StreamReader 的字节数（模拟网络分块）')
+    ap.add_argument('--repeat', type=int, default=5)
+    asyncio.run(_run(ap.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
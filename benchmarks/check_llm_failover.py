@@ -0,0 +1,199 @@
+"""
+故障切换检查：本地起两个模拟 Gemini 流式接口的桩服务（主实例 A、备用实例 B），
+让 AICustomerService._call_llm_stream 在各种故障下跑一遍，核对胜出实例、耗时与熔断状态。
+
+用法（仓库根目录）：
+    python benchmarks/check_llm_failover.py [--hedge-after 0.5] [--slow 2.0]
+
+场景：
+  hedge      A 首个事件迟迟不到：hedge_after 秒后对冲到 B，B 胜出
+  thinking   A 立即输出思考内容、正文较慢：视为首个 token 已到达，不对冲，A 胜出
+  429        A 限流：不等待 Retry-After，立即切换到 B，连续失败后 A 被熔断
+  open       A 熔断中：直接使用 B
+  probe      冷却结束：放行一次 A 的试探请求，成功即恢复
+  400        A 返回请求错误：不切换，直接报错
+  both500    两个实例都 5xx：报出最后一路的错误
+任一场景结果不符时以非零状态退出。
+"""
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiohttp import web  # noqa: E402
+
+from cogs.ai_customer_service import AICustomerService  # noqa: E402
+from utils import HTTPTransport  # noqa: E402
+
+
+class _Config:
+    def __init__(self, data: dict):
+        self.data = data
+
+    def get(self, key, default=None):
+        value = self.data
+        for k in key.split('.'):
+            if not isinstance(value, dict) or value.get(k) is None:
+                return default
+            value = value[k]
+        return value
+
+
+class _Message:
+    """代替 Discord 消息：只记录编辑内容"""
+
+    id = 1
+
+    def __init__(self):
+        self.edits: list[str] = []
+
+    async def edit(self, **kwargs):
+        self.edits.append(kwargs.get('content', ''))
+
+
+class _StubBackend:
+    """模拟 Gemini streamGenerateContent；mode 决定下一次请求的行为"""
+
+    def __init__(self, name: str, slow: float):
+        self.name = name
+        self.slow = slow
+        self.mode = 'ok'
+        self.hits = 0
+        self.runner: web.AppRunner | None = None
+        self.port = 0
+
+    @staticmethod
+    def _event(part: dict) -> bytes:
+        body = {'candidates': [{'content': {'parts': [part], 'role': 'model'}}]}
+        return b'data: ' + json.dumps(body, ensure_ascii=False).encode('utf-8') + b'\r\n\r\n'
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        self.hits += 1
+        mode = self.mode
+        if mode == '429':
+            return web.Response(status=429, headers={'Retry-After': '30'})
+        if mode == '500':
+            return web.Response(status=500, text='upstream error')
+        if mode == '400':
+            return web.Response(status=400, text='invalid request')
+        resp = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await resp.prepare(request)
+        try:
+            if mode == 'slow':
+                await asyncio.sleep(self.slow)
+            elif mode == 'thinking':
+                await resp.write(self._event({'text': '正在分析投诉内容', 'thought': True}))
+                await asyncio.sleep(self.slow)
+            for word in (f'来自 {self.name} 的回复', '。'):
+                await resp.write(self._event({'text': word}))
+                await asyncio.sleep(0.02)
+        except ConnectionResetError:
+            pass  # 落败的一路已被客户端取消
+        return resp
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post('/v1beta/models/{model}', self._handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+def _make_cog(blob_dir: str, a: _StubBackend, b: _StubBackend, hedge_after: float, cooldown: float):
+    conf = {
+        'ai_customer_service': {
+            'blob_store': {'dir': blob_dir},
+            'provider': 'gemini',
+            'gemini': {'api_key': 'stub', 'proxy_url': f'http://127.0.0.1:{a.port}'},
+            'providers': {
+                'backup': {'kind': 'gemini', 'api_key': 'stub', 'proxy_url': f'http://127.0.0.1:{b.port}'},
+            },
+            'failover': {
+                'enabled': True,
+                'providers': ['backup'],
+                'hedge_after_seconds': hedge_after,
+                'failure_threshold': 2,
+                'cooldown_seconds': cooldown,
+            },
+        },
+    }
+    bot = types.SimpleNamespace(
+        config_loader=_Config(conf),
+        user=types.SimpleNamespace(id=1),
+        guilds=[],
+        http_transport=HTTPTransport(keep_warm_interval=0),
+        get_channel=lambda _id: None,
+    )
+    return AICustomerService(bot)
+
+
+async def _run(args: argparse.Namespace) -> int:
+    a, b = _StubBackend('A', args.slow), _StubBackend('B', args.slow)
+    await a.start()
+    await b.start()
+    cooldown = 1.0
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        cog = _make_cog(tmp, a, b, args.hedge_after, cooldown)
+        await cog.cog_load()
+        cog.conversations[1] = [{'role': 'user', 'parts': [{'text': '我被误封了'}]}]
+        print(f"hedge_after {args.hedge_after}s, slow {args.slow}s, A=127.0.0.1:{a.port}, B=127.0.0.1:{b.port}")
+        print(f"{'scenario':<10} {'result':<8} {'winner':<7} {'time(s)':>8} {'hits A/B':>9}  breaker")
+
+        async def scenario(name: str, mode_a: str, mode_b: str, expect: str, pause: float = 0.0) -> None:
+            nonlocal failures
+            await asyncio.sleep(pause)
+            a.mode, b.mode = mode_a, mode_b
+            a.hits = b.hits = 0
+            t0 = time.monotonic()
+            try:
+                text = (await cog._call_llm_stream(1, _Message())).get('text') or ''
+                winner = 'A' if '来自 A' in text else 'B' if '来自 B' in text else '?'
+            except Exception:
+                winner = 'error'
+            elapsed = time.monotonic() - t0
+            ok = winner == expect
+            failures += not ok
+            tripped = ', '.join(f'{k} {v:.1f}s' for k, v in cog.circuit_breaker.open_remaining().items())
+            print(
+                f"{name:<10} {'ok' if ok else 'FAIL':<8} {winner:<7} {elapsed:>8.2f} {f'{a.hits}/{b.hits}':>9}  "
+                f"{tripped or '-'}" + ('' if ok else f'  (期望 {expect})')
+            )
+
+        await scenario('hedge', 'slow', 'ok', 'B')
+        await scenario('thinking', 'thinking', 'ok', 'A')
+        await scenario('429', '429', 'ok', 'B')
+        await scenario('429', '429', 'ok', 'B')
+        await scenario('open', 'ok', 'ok', 'B')
+        await scenario('probe', 'ok', 'ok', 'A', pause=cooldown + 0.1)
+        await scenario('400', '400', 'ok', 'error')
+        await scenario('both500', '500', '500', 'error')
+        print(f"failover stats: {cog.failover_stats}")
+        await cog.cog_unload()
+        await cog.bot.http_transport.close()
+    await a.stop()
+    await b.stop()
+    return 1 if failures else 0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--hedge-after', type=float, default=0.5, help='首个事件多少秒未到达时对冲')
+    ap.add_argument('--slow', type=float, default=2.0, help='慢实例首个正文事件的延迟（秒）')
+    sys.exit(asyncio.run(_run(ap.parse_args())))
+
+
+if __name__ == '__main__':
+    main()
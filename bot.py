@@ -8,7 +8,7 @@ import asyncio
 import sys
 from pathlib import Path
 from datetime import datetime
-from utils import ConfigLoader
+from utils import ConfigLoader, HTTPTransport
 
 
 class HumanoidBot(commands.Bot):
@@ -16,6 +16,15 @@ class HumanoidBot(commands.Bot):
     
     def __init__(self, config_loader: ConfigLoader):
         self.config_loader = config_loader
+        # 所有 Cog 共用的出站 HTTP 传输层（连接池参数修改后需重启生效）
+        self.http_transport = HTTPTransport(
+            limit=config_loader.get('http_transport.limit', 100),
+            limit_per_host=config_loader.get('http_transport.limit_per_host', 16),
+            dns_cache_ttl=config_loader.get('http_transport.dns_cache_ttl', 300),
+            keepalive_timeout=config_loader.get('http_transport.keepalive_timeout', 75),
+            keep_warm_interval=config_loader.get('http_transport.keep_warm_interval', 45),
+            warm_connections=config_loader.get('http_transport.warm_connections', 2),
+        )
         
         # 设置 Intents
         intents = discord.Intents.default()
@@ -80,9 +89,17 @@ class HumanoidBot(commands.Bot):
             activity=discord.Game(name="使用 /改改的名 修改频道")
         )
     
+    async def close(self):
+        """关闭 Bot：先卸载各 Cog，再关闭共用的 HTTP 连接池"""
+        await super().close()
+        await self.http_transport.close()
+    
     async def on_config_reload(self):
         """配置重载回调"""
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 配置已更新，通知所有模块...")
+        self.http_transport.keep_warm_interval = max(
+            0.0, float(self.config_loader.get('http_transport.keep_warm_interval', 45))
+        )
         
         # 通知所有 Cog 配置已更新
         for cog_name, cog in self.cogs.items():
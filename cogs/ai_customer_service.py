@@ -10,15 +10,67 @@ from typing import Any, Optional, Union
 from pathlib import Path
 import asyncio
 import aiohttp
+import bisect
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import json
 import base64
 import time
 import re
+from contextvars import ContextVar
+
+from utils import (
+    ClaudeMessagesProvider,
+    ClaudeOpenAIProvider,
+    GeminiProvider,
+    LLMProvider,
+    OpenAIResponsesProvider,
+    ProviderHTTPError,
+    AttachmentCache,
+    BlobStore,
+    CircuitBreaker,
+    ConversationStore,
+    InlineRef,
+    EditScheduler,
+    MessageRing,
+    PresetRenderError,
+    PresetVariable,
+    PresetVariableRegistry,
+    StreamLeg,
+    StreamRace,
+    dhash_distance,
+    dump_turn,
+    estimate_image_tokens,
+    estimate_text_tokens,
+    estimate_turn_tokens,
+    image_dhash,
+    images_match,
+    iter_blob_refs,
+    iter_sse,
+    loads_json,
+    normalize_image,
+    probe_image_size,
+    provider_family,
+    create_provider,
+    provider_kinds,
+    resize_image,
+)
 
 
 # send_to_admin 工具发往管理区/子区的正文前缀，用于恢复持久化按钮
 _ADMIN_TOOL_MESSAGE_HEADER = re.compile(r"^\*\*来自 <#(\d+)>：\*\*", re.MULTILINE)
 
+# 故障切换时各路请求各自使用的后端 kind（见 _call_llm_stream / llm_provider）
+_ACTIVE_PROVIDER_KIND: ContextVar[Optional[str]] = ContextVar('active_provider_kind', default=None)
+
+# 当前回复的图片统计（见 _generate_response）：工具往返、各路对冲请求与缓存前缀共用，回复完成后一次计入
+_IMAGE_REPLY_TALLY: ContextVar[Optional[dict[str, dict]]] = ContextVar('image_reply_tally', default=None)
+
+# 用户提及 <@id> / <@!id>
+_USER_MENTION_RE = re.compile(r"<@!?(\d+)>")
+
 # Discord 消息/子区链接：group1 guild, group2 channel_or_thread_id, group3 optional message_id
 _DISCORD_CHANNEL_LINK_RE = re.compile(
     r"https?://(?:discord(?:app)?\.com)/channels/(\d+)/(\d+)(?:/(\d+))?",
@@ -26,6 +78,10 @@ _DISCORD_CHANNEL_LINK_RE = re.compile(
 )
 
 
+class _AttachmentTooLarge(Exception):
+    """附件超过 max_attachment_size（响应头声明或流式读取中累计超限）"""
+
+
 def _admin_inject_button_custom_id(source_channel_id: int, admin_message_id: int) -> str:
     """持久化按钮 custom_id（单条管理消息唯一，便于重启后 edit + add_view）"""
     return f"humanoid_ai_inj_{source_channel_id}_{admin_message_id}"
@@ -151,18 +207,120 @@ class AICustomerService(commands.Cog, name="AI客服"):
         self.channel_complainants: dict[int, int] = {}  # channel_id -> 原始投诉人 user_id
         self.channel_threads: dict[int, discord.Thread] = {}  # channel_id -> 管理频道中的 thread
         self.session: Optional[aiohttp.ClientSession] = None
-        self._openai_client: Any = None  # openai.AsyncOpenAI，惰性初始化
+        self.channel_window_tokens: dict[int, int] = {}  # channel_id -> 当前历史窗口估算 token 数
+        self.channel_last_message_id: dict[int, int] = {}  # channel_id -> 已处理到的最新消息 ID
+        # 持久化状态（见 _store_flush）：频道 -> 已落盘的回合引用/seq/元数据；待写入的显式操作
+        self._store_synced: dict[int, dict[str, Any]] = {}
+        self._store_pending_ops: list[tuple] = []
+        self._store_task: Optional[asyncio.Task] = None
+        # 懒加载（restore.lazy）：尚未重建对话的频道 -> 本地状态库记录（无记录为 None）
+        self._dormant_channels: dict[int, Optional[dict[str, Any]]] = {}
+        self._hydration_tasks: dict[int, asyncio.Task] = {}
+        self._bound_admin_views: set[int] = set()  # 已 add_view 的管理消息 ID
+        # 滚动摘要（见 _trim_history）：后台任务、已完成待替换的结果、失败冷却
+        self._summary_tasks: dict[int, asyncio.Task] = {}
+        self._summary_ready: dict[int, tuple[str, Any]] = {}  # channel_id -> (摘要, 已折叠的最后一个回合)
+        self._summary_retry_at: dict[int, float] = {}
+        self.summary_stats: dict[str, int] = {
+            'runs': 0,
+            'failures': 0,
+            'turns_folded': 0,
+        }
+        # channel_id -> provider kind -> 只追加的历史转换缓存（见 _convert_history）
+        self._conversion_cache: dict[int, dict[str, dict[str, Any]]] = {}
+        self.conversion_stats: dict[str, int] = {
+            'rebuilds': 0,
+            'turns_converted': 0,
+            'turns_reused': 0,
+        }
+        # channel_id -> {实例名 -> Gemini cachedContents 句柄}（见 _gemini_context_cache_prepare）；
+        # 按实例分开：故障切换/对冲时各 Gemini 实例的缓存互不驱逐
+        self._gemini_context_caches: dict[int, dict[str, dict[str, Any]]] = {}
+        # 原图 blob 摘要 -> 按 Claude 像素上限处理后的 (摘要, mime)，避免每轮重复解码缩放
+        self._claude_image_variants: dict[str, tuple[str, str]] = {}
+        # 历史图片降级统计：每次回复中被缩小/改为占位的图片各计一次（见 _commit_image_tally）
+        self.image_history_stats: dict[str, int] = {
+            'downscaled': 0,
+            'stubbed': 0,
+        }
+        # channel_id -> 频道内已入库的规范图片 [(dHash, blob 摘要)]（见 _dedup_image_parts，按对话惰性重建）
+        self._image_phash_index: dict[int, list[tuple[Optional[str], str]]] = {}
+        # channel_id -> 重复图片省略统计（按回复累计，见 _commit_image_tally）
+        self.image_dedup_stats: dict[int, dict[str, int]] = {}
         self._restored_from_discord_once: bool = False
         self.load_config()
+        self.blob_store = BlobStore(self.blob_store_dir, self.blob_memory_budget)
+        # 附件 ID -> 已下载字节（存于 blob_store）；cache_max_mb 为 0 时不缓存。启用状态库时索引随之落盘
+        self.attachment_cache = AttachmentCache(
+            self.blob_store, self.attachment_cache_max_bytes or 1, persist=self.state_store_enabled,
+        )
+        self._summary_semaphore = asyncio.Semaphore(self.summary_concurrency)
+        # 附件下载并发上限：全局一个，频道各一个（见 _download_attachment）
+        self._download_semaphore = asyncio.Semaphore(self.attachment_max_concurrent)
+        self._channel_download_semaphores: dict[int, asyncio.Semaphore] = {}
+        # fetch_messages 工具与提及解析同时进行的 Discord REST 请求数（discord.py 自身按路由桶处理 429）
+        self._fetch_semaphore = asyncio.Semaphore(self.fetch_messages_concurrency)
+        # 网关事件维护的频道最近消息缓存：history() 读者先查这里，只有缺口才走 REST
+        self.message_ring = MessageRing(
+            self.message_cache_per_channel, self.message_cache_max_channels, self.message_cache_max_bytes,
+        )
+        # 四个后端共用的流式编辑合并器：流式循环只提交文本，Discord 编辑在后台按全局预算发出
+        self.edit_scheduler = EditScheduler(
+            self.stream_edit_per_second, self.stream_edit_min_interval, self.stream_edit_max_interval,
+        )
+        # 故障切换：各后端实例的连续失败计数与熔断状态（配置重载后保留）
+        self.circuit_breaker = CircuitBreaker(self.failover_failure_threshold, self.failover_cooldown)
+        self.failover_stats = {'requests': 0, 'hedged': 0, 'failovers': 0, 'backup_wins': 0}
+        self._attachment_downloads: dict[str, asyncio.Task] = {}  # 缓存键 -> 进行中的下载
+        # (频道ID, 消息ID | None) -> {'task': 预取任务, 'expire_at': monotonic 过期时刻}
+        self._link_prefetch: dict[tuple[int, Optional[int]], dict[str, Any]] = {}
+        self.link_prefetch_stats = {'started': 0, 'hits': 0}
+        # 管理预设 %变量%：按频道消息事件失效、后台重新渲染（见 _expand_preset_variables）
+        self.preset_variables = PresetVariableRegistry()
+        self.preset_variables.register(PresetVariable(
+            'fetch_punishments',
+            self._expand_fetch_punishments,
+            watches=lambda cid: cid == self.fetch_punishments_channel_id,
+            max_age=600,
+        ))
+        # (guild ID | None, 用户 ID) -> (标签, monotonic 过期时刻)
+        self._mention_labels: dict[tuple[Optional[int], int], tuple[str, float]] = {}
+        self._image_pool: Optional[ProcessPoolExecutor] = None  # 图片规格化进程池（见 _start_image_pool）
+        self._image_pool_workers = 0
+        self.conversation_store: Optional[ConversationStore] = (
+            ConversationStore(self.state_store_path) if self.state_store_enabled else None
+        )
 
     async def cog_load(self):
-        self.session = aiohttp.ClientSession()
-        await self._ensure_openai_client()
+        # 共用 Bot 的 HTTP 传输层（连接池与预热见 utils.http_transport），卸载时不关闭
+        self.session = self.bot.http_transport.session
+        await self._activate_providers()
+        self._start_image_pool()
+        if self.conversation_store is not None:
+            try:
+                rows = await asyncio.to_thread(self.conversation_store.load_attachments)
+                self.attachment_cache.load(rows)
+            except Exception as e:
+                print(
+                    f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                    f"[AI客服] 读取附件缓存索引失败: {e}"
+                )
+            self._store_task = asyncio.create_task(self._store_flush_loop())
 
     async def cog_unload(self):
-        if self.session and not self.session.closed:
-            await self.session.close()
-        await self._close_openai_client()
+        for cid in list(self._summary_tasks):
+            self._summary_forget(cid)
+        for cid in list(self._gemini_context_caches):
+            await self._gemini_context_cache_evict(cid)
+        if self._store_task is not None:
+            self._store_task.cancel()
+            self._store_task = None
+        if self.conversation_store is not None:
+            await self._store_flush()
+            await asyncio.to_thread(self.conversation_store.close)
+        self._shutdown_image_pool()
+        self.bot.http_transport.set_warm_targets('ai_customer_service', [])
+        await self._close_providers()
 
     # ── 配置管理 ──────────────────────────────────────────────
 
@@ -184,23 +342,33 @@ class AICustomerService(commands.Cog, name="AI客服"):
     def load_config(self):
         """加载配置"""
         cfg = self.config_loader
-        self.llm_provider = str(
-            cfg.get('ai_customer_service.provider', 'gemini')
-        ).strip().lower()
-        if self.llm_provider not in (
-            'gemini',
-            'claude_openai',
-            'claude_messages',
-            'openai_responses',
-        ):
-            self.llm_provider = 'gemini'
-
-        self.api_key = cfg.get('ai_customer_service.gemini.api_key', '')
-        self.proxy_url = cfg.get(
-            'ai_customer_service.gemini.proxy_url',
-            'https://generativelanguage.googleapis.com'
-        ).rstrip('/')
-        self.model = cfg.get('ai_customer_service.gemini.model', 'gemini-2.0-flash')
+        # LLM 后端实例（见 utils.llm_providers）；provider 可填 kind 或 providers 中的实例名
+        self.providers = self._load_providers(cfg, getattr(self, 'providers', None))
+        name = str(cfg.get('ai_customer_service.provider', 'gemini')).strip()
+        if name not in self.providers:
+            name = name.lower() if name.lower() in self.providers else 'gemini'
+        self.provider: LLMProvider = self.providers[name]
+        # 故障切换：主实例之后按顺序尝试的备用实例（见 _call_llm_stream）
+        self.failover_enabled = bool(cfg.get('ai_customer_service.failover.enabled', False))
+        self.failover_providers: list[LLMProvider] = []
+        for backup in cfg.get('ai_customer_service.failover.providers', []) or []:
+            prov = self.providers.get(str(backup))
+            if prov is None or prov is self.provider or prov in self.failover_providers:
+                print(
+                    f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                    f"[AI客服] failover.providers: 忽略「{backup}」（未定义或与主实例重复）"
+                )
+                continue
+            self.failover_providers.append(prov)
+        self.failover_hedge_after = max(
+            0.0, float(cfg.get('ai_customer_service.failover.hedge_after_seconds', 8))
+        )
+        self.failover_failure_threshold = max(
+            1, int(cfg.get('ai_customer_service.failover.failure_threshold', 3))
+        )
+        self.failover_cooldown = max(
+            0.0, float(cfg.get('ai_customer_service.failover.cooldown_seconds', 60))
+        )
         self.system_prompt = self._load_prompt_file(
             cfg.get('ai_customer_service.gemini.system_prompt_file', ''),
             fallback='你是一个友好的AI客服助手。',
@@ -216,78 +384,177 @@ class AICustomerService(commands.Cog, name="AI客服"):
             '你好！我是AI客服助手，有什么可以帮助你的吗？'
         )
         self.max_history = cfg.get('ai_customer_service.max_history', 50)
+        self.history_max_input_tokens = int(
+            cfg.get('ai_customer_service.history_window.max_input_tokens', 100_000) or 0
+        )
+        self.summary_enabled = bool(cfg.get('ai_customer_service.summary.enabled', False))
+        self.summary_trigger_tokens = max(
+            1000, int(cfg.get('ai_customer_service.summary.trigger_tokens', 32000))
+        )
+        self.summary_keep_tokens = min(
+            self.summary_trigger_tokens,
+            max(500, int(cfg.get('ai_customer_service.summary.keep_tokens', 12000))),
+        )
+        self.summary_model = str(cfg.get('ai_customer_service.summary.model', '') or '').strip()
+        self.summary_max_output_tokens = max(
+            128, int(cfg.get('ai_customer_service.summary.max_output_tokens', 1024))
+        )
+        self.summary_concurrency = max(
+            1, int(cfg.get('ai_customer_service.summary.concurrency', 2))
+        )
         self.max_attachment_size = cfg.get('ai_customer_service.max_attachment_size', 10 * 1024 * 1024)
-        self.allowed_role_ids = cfg.get('allowed_role_ids', [])
-
-        self.claude_openai_api_key = cfg.get(
-            'ai_customer_service.claude_openai.api_key', ''
+        self.attachment_download_timeout = max(
+            1.0, float(cfg.get('ai_customer_service.attachments.download_timeout_seconds', 30))
         )
-        _bu = cfg.get(
-            'ai_customer_service.claude_openai.base_url',
-            'https://api.anthropic.com/v1/',
+        self.attachment_max_concurrent = max(
+            1, int(cfg.get('ai_customer_service.attachments.max_concurrent_downloads', 8))
         )
-        self.claude_openai_base_url = _bu.rstrip('/') + '/'
-        self.claude_openai_model = cfg.get(
-            'ai_customer_service.claude_openai.model',
-            'claude-sonnet-4-20250514',
+        self.attachment_max_concurrent_per_channel = max(
+            1, int(cfg.get('ai_customer_service.attachments.max_concurrent_per_channel', 4))
         )
-        self.claude_openai_max_tokens = int(
-            cfg.get('ai_customer_service.claude_openai.max_tokens', 8192)
+        self.image_process_workers = max(
+            0, int(cfg.get('ai_customer_service.images.process_workers', 2))
         )
-        raw_thinking = cfg.get('ai_customer_service.claude_openai.thinking')
-        self.claude_openai_thinking: Optional[dict[str, Any]] = (
-            dict(raw_thinking) if isinstance(raw_thinking, dict) else None
+        self.message_cache_enabled = bool(
+            cfg.get('ai_customer_service.message_cache.enabled', True)
         )
-
-        # ─ OpenAI Responses API 配置 ─
-        self.openai_responses_api_key = cfg.get(
-            'ai_customer_service.openai_responses.api_key', ''
+        self.message_cache_per_channel = max(
+            1, int(cfg.get('ai_customer_service.message_cache.per_channel', 100))
         )
-        _or_bu = cfg.get(
-            'ai_customer_service.openai_responses.base_url',
-            'https://api.openai.com/v1/',
+        self.message_cache_max_channels = max(
+            1, int(cfg.get('ai_customer_service.message_cache.max_channels', 100))
         )
-        self.openai_responses_base_url = _or_bu.rstrip('/') + '/'
-        self.openai_responses_model = cfg.get(
-            'ai_customer_service.openai_responses.model',
-            'gpt-4.1',
+        self.message_cache_max_bytes = max(
+            1, int(float(cfg.get('ai_customer_service.message_cache.max_mb', 32)) * 1024 * 1024)
         )
-        self.openai_responses_max_output_tokens = int(
-            cfg.get('ai_customer_service.openai_responses.max_output_tokens', 8192)
+        self.fetch_messages_concurrency = max(
+            1, int(cfg.get('ai_customer_service.fetch_messages.max_concurrent_requests', 4))
         )
-        raw_or_reasoning = cfg.get('ai_customer_service.openai_responses.reasoning')
-        self.openai_responses_reasoning: Optional[dict[str, Any]] = (
-            dict(raw_or_reasoning) if isinstance(raw_or_reasoning, dict) else None
+        # 流式回复的消息编辑节奏（见 EditScheduler）
+        self.stream_edit_per_second = max(
+            0.1, float(cfg.get('ai_customer_service.stream_edit.edits_per_second', 5))
         )
-
-        # ─ Claude Messages（原生 /v1/messages）配置 ─
-        self.claude_messages_api_key = cfg.get(
-            'ai_customer_service.claude_messages.api_key', ''
+        self.stream_edit_min_interval = max(
+            0.0, float(cfg.get('ai_customer_service.stream_edit.min_interval', 1 / 3))
+        )
+        self.stream_edit_max_interval = max(
+            self.stream_edit_min_interval,
+            float(cfg.get('ai_customer_service.stream_edit.max_interval', 5)),
+        )
+        # 投诉人消息中的 Discord 链接在入库时后台预取（见 _start_link_prefetch）
+        self.link_prefetch_enabled = bool(
+            cfg.get('ai_customer_service.fetch_messages.prefetch.enabled', True)
+        )
+        self.link_prefetch_ttl = max(
+            1.0, float(cfg.get('ai_customer_service.fetch_messages.prefetch.ttl_seconds', 120))
+        )
+        self.link_prefetch_max_links = max(
+            1, int(cfg.get('ai_customer_service.fetch_messages.prefetch.max_links', 5))
+        )
+        self.link_prefetch_attach = bool(
+            cfg.get('ai_customer_service.fetch_messages.prefetch.attach', False)
+        )
+        self.link_prefetch_attach_wait = max(
+            0.0, float(cfg.get('ai_customer_service.fetch_messages.prefetch.attach_wait_seconds', 5))
+        )
+        # 历史图片按用户回合数逐档降级（见 _image_history_plan）；降级图在入库时生成
+        self.image_history_enabled = bool(
+            cfg.get('ai_customer_service.images.history.enabled', False)
+        )
+        self.image_history_full_turns = max(
+            0, int(cfg.get('ai_customer_service.images.history.full_turns', 8))
+        )
+        self.image_history_step_turns = max(
+            1, int(cfg.get('ai_customer_service.images.history.step_turns', 8))
+        )
+        self.image_history_dims: list[int] = sorted(
+            (int(d) for d in cfg.get('ai_customer_service.images.history.dims', [1024, 512]) or []
+             if int(d) > 0),
+            reverse=True,
+        )
+        self.image_history_max_bytes = int(
+            float(cfg.get('ai_customer_service.images.history.max_total_mb', 20)) * 1024 * 1024
+        )
+        # 频道内重复图片只发送第一张：字节完全相同，或 dHash 汉明距离不超过 max_distance 且逐块像素比较确认
+        self.image_dedup_enabled = bool(
+            cfg.get('ai_customer_service.images.dedup.enabled', False)
+        )
+        self.image_dedup_max_distance = max(
+            0, int(cfg.get('ai_customer_service.images.dedup.max_distance', 4))
+        )
+        # 出站图片按字节/像素预算转码；None 表示关闭
+        self.image_transcode: Optional[dict[str, Any]] = None
+        if cfg.get('ai_customer_service.images.transcode.enabled', False):
+            self.image_transcode = {
+                'max_bytes': max(
+                    16 * 1024,
+                    int(cfg.get('ai_customer_service.images.transcode.max_bytes', 800 * 1024)),
+                ),
+                'max_pixels': max(
+                    256 * 256,
+                    int(cfg.get('ai_customer_service.images.transcode.max_pixels', 2_500_000)),
+                ),
+                'min_psnr': float(cfg.get('ai_customer_service.images.transcode.min_psnr', 32.0)),
+                'palette_colors': max(
+                    0, min(256, int(cfg.get('ai_customer_service.images.transcode.palette_colors', 256)))
+                ),
+                'webp': bool(cfg.get('ai_customer_service.images.transcode.webp', True)),
+            }
+        self.attachment_cache_max_bytes = max(
+            0, int(float(cfg.get('ai_customer_service.attachments.cache_max_mb', 256)) * 1024 * 1024)
+        )
+        self.blob_store_dir = str(
+            cfg.get('ai_customer_service.blob_store.dir', 'data/blobs') or 'data/blobs'
         )
-        _cm_bu = cfg.get(
-            'ai_customer_service.claude_messages.base_url',
-            'https://api.anthropic.com/v1/',
+        self.blob_memory_budget = int(
+            float(cfg.get('ai_customer_service.blob_store.memory_budget_mb', 64)) * 1024 * 1024
         )
-        self.claude_messages_base_url = _cm_bu.rstrip('/') + '/'
-        self.claude_messages_model = cfg.get(
-            'ai_customer_service.claude_messages.model',
-            'claude-opus-4-7',
+        self.state_store_enabled = bool(
+            cfg.get('ai_customer_service.state_store.enabled', True)
         )
-        self.claude_messages_max_tokens = int(
-            cfg.get('ai_customer_service.claude_messages.max_tokens', 8192)
+        self.state_store_path = str(
+            cfg.get('ai_customer_service.state_store.path', 'data/conversations.sqlite3')
+            or 'data/conversations.sqlite3'
         )
-        self.claude_messages_interleaved_thinking = bool(
-            cfg.get('ai_customer_service.claude_messages.interleaved_thinking', False)
+        self.state_store_flush_interval = max(
+            0.2, float(cfg.get('ai_customer_service.state_store.flush_interval_seconds', 1.0))
         )
-        raw_cm_thinking = cfg.get('ai_customer_service.claude_messages.thinking')
-        self.claude_messages_thinking: Optional[dict[str, Any]] = (
-            dict(raw_cm_thinking) if isinstance(raw_cm_thinking, dict) else None
+        self.state_store_compact_interval = max(
+            60.0, float(cfg.get('ai_customer_service.state_store.compact_interval_minutes', 60)) * 60
+        )
+        self.restore_lazy = bool(cfg.get('ai_customer_service.restore.lazy', False))
+        self.restore_concurrency = max(
+            1, int(cfg.get('ai_customer_service.restore.concurrency', 4))
+        )
+        self.allowed_role_ids = cfg.get('allowed_role_ids', [])
+
+        self.gemini_context_cache_enabled = bool(
+            cfg.get('ai_customer_service.gemini.context_cache.enabled', False)
+        )
+        self.gemini_context_cache_ttl = max(
+            60, int(cfg.get('ai_customer_service.gemini.context_cache.ttl_seconds', 600))
+        )
+        self.gemini_context_cache_min_turns = max(
+            1, int(cfg.get('ai_customer_service.gemini.context_cache.min_cached_turns', 8))
+        )
+        self.gemini_context_cache_keep_tail = max(
+            1, int(cfg.get('ai_customer_service.gemini.context_cache.keep_tail_turns', 4))
+        )
+        self.gemini_context_cache_refresh_growth = max(
+            1, int(cfg.get('ai_customer_service.gemini.context_cache.refresh_growth_turns', 12))
         )
 
         self.debug_stream_full_log = bool(
             cfg.get('ai_customer_service.debug_stream_full_log', False)
         )
 
+        # 提及解析缓存（%fetch_punishments% 等）：ID -> 标签，查无此人的结果用较短 TTL
+        self.mention_cache_ttl = max(
+            0.0, float(cfg.get('ai_customer_service.mention_cache.ttl_seconds', 600))
+        )
+        self.mention_negative_ttl = max(
+            0.0, float(cfg.get('ai_customer_service.mention_cache.negative_ttl_seconds', 120))
+        )
         self.fetch_punishments_channel_id = int(
             cfg.get(
                 'ai_customer_service.send_to_admin_presets.fetch_punishments_channel_id',
@@ -311,60 +578,147 @@ class AICustomerService(commands.Cog, name="AI客服"):
 
     async def on_config_reload(self):
         """配置重载回调"""
+        retired = self.providers
         self.load_config()
-        await self._ensure_openai_client()
+        self.blob_store.memory_budget = self.blob_memory_budget
+        self.attachment_cache.set_max_bytes(self.attachment_cache_max_bytes or 1)
+        self._summary_semaphore = asyncio.Semaphore(self.summary_concurrency)
+        self._download_semaphore = asyncio.Semaphore(self.attachment_max_concurrent)
+        self._channel_download_semaphores.clear()
+        self._fetch_semaphore = asyncio.Semaphore(self.fetch_messages_concurrency)
+        self.edit_scheduler.edits_per_second = self.stream_edit_per_second
+        self.edit_scheduler.min_interval = self.stream_edit_min_interval
+        self.edit_scheduler.max_interval = self.stream_edit_max_interval
+        self.circuit_breaker.failure_threshold = self.failover_failure_threshold
+        self.circuit_breaker.cooldown = self.failover_cooldown
+        if self._image_pool_workers != self.image_process_workers:
+            self._shutdown_image_pool()
+            self._start_image_pool()
+        if (
+            self.message_ring.per_channel != self.message_cache_per_channel
+            or self.message_ring.max_channels != self.message_cache_max_channels
+        ):
+            self.message_ring = MessageRing(
+                self.message_cache_per_channel, self.message_cache_max_channels, self.message_cache_max_bytes,
+            )
+        elif not self.message_cache_enabled:
+            self.message_ring.clear()
+        else:
+            self.message_ring.set_max_bytes(self.message_cache_max_bytes)
+        self.preset_variables.invalidate()
+        self._invalidate_conversion_cache()
+        await self._activate_providers(retired)
+
+    def _prune_blob_store(self) -> None:
+        """频道关闭后清理不再被任何对话引用的附件 blob（后台线程执行）"""
+        live = set(
+            iter_blob_refs(t for conv in self.conversations.values() for t in conv)
+        )
+        live.update(iter_blob_refs(
+            t for stored in self._dormant_channels.values() if stored for t in stored['turns']
+        ))
+        self._claude_image_variants = {
+            k: v for k, v in self._claude_image_variants.items() if k in live
+        }
+        live.update(v[0] for v in self._claude_image_variants.values())
+        # 附件缓存保存的是下载的原始字节，回合引用的是规格化后的 blob，需单独保留
+        live.update(self.attachment_cache.digests())
 
-    def _llm_configured(self) -> bool:
-        if self.llm_provider == 'claude_openai':
-            return bool(self.claude_openai_api_key)
-        if self.llm_provider == 'openai_responses':
-            return bool(self.openai_responses_api_key)
-        if self.llm_provider == 'claude_messages':
-            return bool(self.claude_messages_api_key)
-        return bool(self.api_key)
-
-    async def _close_openai_client(self):
-        if self._openai_client is not None:
+        async def _run():
             try:
-                await self._openai_client.close()
-            except Exception:
-                pass
-            self._openai_client = None
-
-    async def _ensure_openai_client(self):
-        """按当前 provider 创建或关闭 AsyncOpenAI 客户端"""
-        await self._close_openai_client()
-        api_key = ''
-        base_url = ''
-        provider_label = self.llm_provider
-        if self.llm_provider == 'claude_openai':
-            api_key = self.claude_openai_api_key
-            base_url = self.claude_openai_base_url
-        elif self.llm_provider == 'openai_responses':
-            api_key = self.openai_responses_api_key
-            base_url = self.openai_responses_base_url
-        if not api_key:
-            return
-        try:
-            from openai import AsyncOpenAI
-        except ImportError as e:
-            print(
-                f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-                f"[AI客服] 未安装 openai 包，无法使用 {provider_label}: {e}"
-            )
-            return
-        self._openai_client = AsyncOpenAI(
-            api_key=api_key,
-            base_url=base_url,
+                removed = await asyncio.to_thread(self.blob_store.prune, live)
+                if removed:
+                    print(
+                        f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                        f"[AI客服] 已清理 {removed} 个无引用附件 blob"
+                    )
+            except Exception as e:
+                print(
+                    f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                    f"[AI客服] 清理附件 blob 失败: {e}"
+                )
+
+        asyncio.create_task(_run())
+
+    def _llm_configured(self) -> bool:
+        return self.provider.configured()
+
+    @property
+    def llm_provider(self) -> str:
+        """当前请求使用的后端 kind：故障切换时在各路请求内分别为该路实例的 kind"""
+        return _ACTIVE_PROVIDER_KIND.get() or self.provider.kind
+
+    def _active_providers(self) -> list[LLMProvider]:
+        """需要启动的实例：主实例，开启故障切换时加上备用实例"""
+        if not self.failover_enabled:
+            return [self.provider]
+        return [self.provider, *self.failover_providers]
+
+    def _load_providers(
+        self, cfg, previous: Optional[dict[str, LLMProvider]] = None,
+    ) -> dict[str, LLMProvider]:
+        """
+        内置实例：每种后端一个，名称即 kind，读取同名配置段；
+        providers 中的命名实例（需给出 kind）可与之并存，名称相同时覆盖内置实例。
+        配置重载时，配置未变的实例沿用 previous 中的旧实例（保留已创建的客户端与连接）。
+        """
+        providers: dict[str, LLMProvider] = {}
+        for kind in provider_kinds():
+            section = cfg.get(f'ai_customer_service.{kind}', {}) or {}
+            providers[kind] = create_provider(kind, kind, section if isinstance(section, dict) else {})
+        extra = cfg.get('ai_customer_service.providers', {}) or {}
+        if isinstance(extra, dict):
+            for name, conf in extra.items():
+                kind = str((conf or {}).get('kind', '')).strip().lower() if isinstance(conf, dict) else ''
+                if kind not in provider_kinds():
+                    print(
+                        f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                        f"[AI客服] providers.{name}: 未知的 kind「{kind}」，已忽略"
+                    )
+                    continue
+                providers[str(name)] = create_provider(kind, str(name), conf)
+        for name, prov in providers.items():
+            old = (previous or {}).get(name)
+            if old is not None and old.same_config(prov):
+                providers[name] = old
+        return providers
+
+    async def _activate_providers(self, retired: Optional[dict[str, LLMProvider]] = None) -> None:
+        """
+        启动主实例与备用实例（按需导入 SDK、创建客户端），关闭不再使用的旧实例；
+        并把它们的地址登记为 HTTP 传输层的预热目标（立即建立连接，空闲时保持）
+        """
+        transport = self.bot.http_transport
+        wanted = self._active_providers()
+        active = {id(p) for p in wanted}
+        for prov in list((retired or {}).values()) + list(self.providers.values()):
+            if id(prov) not in active and prov.started:
+                await prov.close()
+        for prov in wanted:
+            await prov.start(transport)
+            err = getattr(prov, 'start_error', None)
+            if err:
+                print(
+                    f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                    f"[AI客服] 无法使用 {prov.label}: {err}"
+                )
+        transport.set_warm_targets(
+            'ai_customer_service',
+            [(p.base_url, p.http_client) for p in wanted if p.configured()],
         )
 
-    def _claude_openai_extra_body(self) -> Optional[dict[str, Any]]:
+    async def _close_providers(self) -> None:
+        for prov in self.providers.values():
+            if prov.started:
+                await prov.close()
+
+    def _claude_openai_extra_body(self, provider: ClaudeOpenAIProvider) -> Optional[dict[str, Any]]:
         """
         Anthropic OpenAI 兼容层 extended thinking：
         extra_body['thinking'] = {'type': 'enabled', 'budget_tokens': n}
         配置见 ai_customer_service.claude_openai.thinking（enabled / effort / budget_tokens）。
         """
-        t = self.claude_openai_thinking
+        t = provider.thinking
         if not t:
             return None
         if not t.get('enabled'):
@@ -427,6 +781,14 @@ class AICustomerService(commands.Cog, name="AI客服"):
 
         self.processing_channels.add(channel_id)
         try:
+            await interaction.response.send_message(
+                f"✅ 已向 <#{channel_id}> 注入指令\n> {msg_text}",
+                ephemeral=True,
+            )
+
+            if not await self._ensure_hydrated(channel):
+                await interaction.followup.send("❌ 该频道历史加载失败，请稍后重试", ephemeral=True)
+                return
             if channel_id not in self.conversations:
                 self.conversations[channel_id] = []
             self.conversations[channel_id].append({
@@ -434,13 +796,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
                 "parts": [{"text": f"<odyxml:admin>{msg_text}</odyxml:admin>"}],
             })
 
-            await interaction.response.send_message(
-                f"✅ 已向 <#{channel_id}> 注入指令\n> {msg_text}",
-                ephemeral=True,
-            )
-
             mention_user = None
-            async for msg in channel.history(limit=50):
+            for msg in await self._recent_messages(channel, 50):
                 au = msg.author
                 if (
                     not msg.author.bot
@@ -546,37 +903,139 @@ class AICustomerService(commands.Cog, name="AI客服"):
                     lines.append(f'     {tag} (无可解析文本)')
         return '\n'.join(lines)
 
+    async def _fetch_history(self, ch: discord.abc.Messageable, **kwargs) -> list[discord.Message]:
+        """受 fetch_messages 并发上限约束的一次 history 调用，结果按时间升序"""
+        async with self._fetch_semaphore:
+            msgs = [m async for m in ch.history(**kwargs)]
+        msgs.sort(key=lambda m: m.id)
+        return msgs
+
+    async def _recent_messages(
+        self, ch: discord.abc.Messageable, limit: int,
+    ) -> list[discord.Message]:
+        """最近 limit 条消息（新→旧）：消息缓存足够时不走 REST，否则读取后回填缓存"""
+        cid = getattr(ch, 'id', None)
+        if self.message_cache_enabled and cid is not None:
+            cached = self.message_ring.latest(cid, limit)
+            if cached is not None:
+                return cached
+        msgs = await self._fetch_history(ch, limit=limit)
+        if self.message_cache_enabled and cid is not None:
+            self.message_ring.backfill(cid, msgs, exhausted=len(msgs) < limit)
+        return msgs[::-1]
+
+    async def _oldest_messages(
+        self, ch: discord.abc.Messageable, limit: int,
+    ) -> list[discord.Message]:
+        """最早 limit 条消息（旧→新）：消息缓存覆盖到频道开头时不走 REST"""
+        cid = getattr(ch, 'id', None)
+        if self.message_cache_enabled and cid is not None:
+            cached = self.message_ring.oldest(cid, limit)
+            if cached is not None:
+                return cached
+        msgs = await self._fetch_history(ch, limit=limit, oldest_first=True)
+        if self.message_cache_enabled and cid is not None and len(msgs) < limit:
+            # 不足 limit 条即整个频道
+            self.message_ring.backfill(cid, msgs, exhausted=True)
+        return msgs
+
     async def _fetch_messages_anchored(
         self,
         target_ch: discord.abc.Messageable,
-        msg_id: int,
-    ) -> tuple[str, list[discord.Message]]:
-        target_msg = await target_ch.fetch_message(msg_id)
-        msgs_before: list[discord.Message] = []
-        async for m in target_ch.history(limit=25, before=target_msg):
-            msgs_before.append(m)
-        msgs_before.reverse()
-        msgs_after: list[discord.Message] = []
-        async for m in target_ch.history(limit=25, after=target_msg):
-            msgs_after.append(m)
-        all_msgs = msgs_before + [target_msg] + msgs_after
-        text = '\n'.join(
-            self._format_single_message_for_fetch(m, highlight=(m.id == msg_id))
-            for m in all_msgs
-        )
-        return text, all_msgs
+        msg_ids: list[int],
+        span: int = 25,
+    ) -> dict[int, Union[tuple[str, list[discord.Message]], Exception]]:
+        """
+        同一频道内多个目标消息的前后各 span 条上下文：每个目标一次 history(around=) 调用，
+        目标落在已拉取的连续区间内时直接复用（后文不足时只向后补齐差额），
+        重叠的窗口合并为同一区间，同一条消息不重复拉取。
+        返回 {消息ID: (正文, 按时间升序的消息) 或异常}。
+        """
+        # 连续区间：{'msgs': 升序消息, 'end': 是否已到频道末尾}
+        ranges: list[dict[str, Any]] = []
+        out: dict[int, Union[tuple[str, list[discord.Message]], Exception]] = {}
+        cid = getattr(target_ch, 'id', None)
+        # 缓存下界之前已用 REST 补到的消息（升序，紧接缓存首条之前），供多个锚点共用
+        below: list[discord.Message] = []
+        for mid in sorted(set(msg_ids)):
+            try:
+                cached = (
+                    self.message_ring.window(cid, mid, span)
+                    if self.message_cache_enabled and cid is not None else None
+                )
+                if cached is not None:
+                    window, missing = cached
+                    if window is None:
+                        raise LookupError('消息不存在或已删除')
+                    if missing > 0:
+                        # 只为缓存下界之前的缺口走 REST
+                        if len(below) < missing:
+                            more = await self._fetch_history(
+                                target_ch,
+                                limit=missing - len(below),
+                                before=below[0] if below else window[0],
+                            )
+                            below[:0] = more
+                        window = below[-missing:] + window
+                    out[mid] = (
+                        '\n'.join(
+                            self._format_single_message_for_fetch(m, highlight=(m.id == mid))
+                            for m in window
+                        ),
+                        window,
+                    )
+                    continue
+                rng = next(
+                    (r for r in ranges if r['msgs'][0].id <= mid <= r['msgs'][-1].id), None,
+                )
+                if rng is None:
+                    got = await self._fetch_history(
+                        target_ch, limit=2 * span + 1, around=discord.Object(id=mid),
+                    )
+                    if not got:
+                        raise LookupError('消息不存在或已删除')
+                    end = sum(1 for m in got if m.id > mid) < span
+                    last = ranges[-1] if ranges else None
+                    if last is not None and got[0].id <= last['msgs'][-1].id:
+                        # 与上一区间重叠：并入同一区间
+                        tail = last['msgs'][-1].id
+                        last['msgs'].extend(m for m in got if m.id > tail)
+                        last['end'] = end
+                        rng = last
+                    else:
+                        rng = {'msgs': got, 'end': end}
+                        ranges.append(rng)
+                ids = [m.id for m in rng['msgs']]
+                idx = bisect.bisect_left(ids, mid)
+                if idx >= len(ids) or ids[idx] != mid:
+                    raise LookupError('消息不存在或已删除')
+                missing = idx + span - (len(ids) - 1)
+                if missing > 0 and not rng['end']:
+                    more = await self._fetch_history(
+                        target_ch, limit=missing, after=rng['msgs'][-1],
+                    )
+                    rng['msgs'].extend(more)
+                    rng['end'] = len(more) < missing
+                window = rng['msgs'][max(0, idx - span): idx + span + 1]
+                text = '\n'.join(
+                    self._format_single_message_for_fetch(m, highlight=(m.id == mid))
+                    for m in window
+                )
+                out[mid] = (text, window)
+            except Exception as e:
+                out[mid] = e
+        return out
 
     async def _fetch_forum_thread_without_message_id(
         self,
         thread: discord.Thread,
     ) -> tuple[str, list[discord.Message]]:
         """论坛帖：最早 25 条 + 最近 25 条（去重）。返回正文与按浏览顺序的消息列表（用于多模态图片）。"""
-        oldest: list[discord.Message] = []
-        async for m in thread.history(limit=25, oldest_first=True):
-            oldest.append(m)
-        newest: list[discord.Message] = []
-        async for m in thread.history(limit=25):
-            newest.append(m)
+        # 两端并发拉取（消息缓存命中的一端不走 REST）
+        oldest, newest = await asyncio.gather(
+            self._oldest_messages(thread, 25),
+            self._recent_messages(thread, 25),
+        )
         newest.reverse()
         seen: set[int] = set()
         ordered: list[discord.Message] = []
@@ -594,6 +1053,255 @@ class AICustomerService(commands.Cog, name="AI客服"):
                 parts.append(self._format_single_message_for_fetch(m))
         return '\n'.join(parts), ordered
 
+    async def _resolve_fetch_links(
+        self, triples: list[tuple[int, int, Optional[int]]],
+    ) -> list[tuple[Optional[list[discord.Message]], str]]:
+        """
+        并发解析一批链接：先并发取频道对象，再按频道并发拉取（同频道的锚点合并窗口）。
+        返回与 triples 一一对应的 (消息列表 | None, 段落正文)。
+        """
+        if not triples:
+            return []
+        ch_ids = list(dict.fromkeys(ch_id for _g, ch_id, _m in triples))
+
+        async def resolve_channel(ch_id: int):
+            target = self.bot.get_channel(ch_id)
+            if target:
+                return target
+            async with self._fetch_semaphore:
+                return await self.bot.fetch_channel(ch_id)
+
+        resolved = await asyncio.gather(
+            *(resolve_channel(c) for c in ch_ids), return_exceptions=True,
+        )
+        channels_by_id = {
+            c: r for c, r in zip(ch_ids, resolved)
+            if r is not None and not isinstance(r, BaseException)
+        }
+        anchors: dict[int, list[int]] = {}
+        forum_ids: list[int] = []
+        for _g, ch_id, msg_id in triples:
+            target_ch = channels_by_id.get(ch_id)
+            if target_ch is None:
+                continue
+            if msg_id is not None:
+                anchors.setdefault(ch_id, []).append(msg_id)
+            elif self._is_forum_post_thread(target_ch) and ch_id not in forum_ids:
+                forum_ids.append(ch_id)
+        anchored_jobs = [
+            self._fetch_messages_anchored(channels_by_id[c], mids)
+            for c, mids in anchors.items()
+        ]
+        forum_jobs = [
+            self._fetch_forum_thread_without_message_id(channels_by_id[c])
+            for c in forum_ids
+        ]
+        fetched = await asyncio.gather(
+            *anchored_jobs, *forum_jobs, return_exceptions=True,
+        )
+        anchored_results = dict(zip(anchors, fetched[:len(anchored_jobs)]))
+        forum_results = dict(zip(forum_ids, fetched[len(anchored_jobs):]))
+
+        out: list[tuple[Optional[list[discord.Message]], str]] = []
+        for _g_id, ch_id, msg_id in triples:
+            target_ch = channels_by_id.get(ch_id)
+            if target_ch is None:
+                out.append((None, "错误: 无法访问该频道或子区"))
+                continue
+
+            if msg_id is not None:
+                res = anchored_results.get(ch_id)
+                if isinstance(res, dict):
+                    res = res.get(msg_id)
+                if isinstance(res, tuple):
+                    body, msgs = res
+                    out.append((msgs, f"目标消息 {msg_id} 前后上下文:\n{body}"))
+                else:
+                    out.append((None, f"错误: 无法读取该消息或上下文 ({res})"))
+                continue
+
+            if self._is_forum_post_thread(target_ch):
+                res = forum_results.get(ch_id)
+                if isinstance(res, BaseException):
+                    out.append((None, f"错误: 论坛帖历史读取失败 ({res})"))
+                else:
+                    body, msgs = res
+                    out.append((msgs, f"论坛帖已按「最早25条 + 最近25条」拉取:\n{body}"))
+                continue
+
+            if isinstance(target_ch, discord.Thread):
+                out.append((None, "错误: 该子区非论坛公开帖，请使用带「消息ID」的完整链接"))
+                continue
+
+            out.append((None, "错误: 普通文字频道必须提供消息ID，无法在仅频道链接下读取历史"))
+        return out
+
+    async def _fetch_links_payload(
+        self,
+        triples: list[tuple[int, int, Optional[int]]],
+        channel_id: Optional[int],
+        max_images: int = 24,
+    ) -> dict[str, Any]:
+        """
+        fetch_messages 的结果：已预取的链接直接取用（仍在进行中则等待），其余链接并发拉取。
+        返回 {'messages': 文本, 'image_inline_parts'?: 图片 parts}。
+        """
+        pending = [self._prefetched_link((ch_id, msg_id)) for _g, ch_id, msg_id in triples]
+        hit_idx = [i for i, t in enumerate(pending) if t is not None]
+        miss_idx = [i for i, t in enumerate(pending) if t is None]
+        prefetched, fresh = await asyncio.gather(
+            # shield：本次调用被取消时不连带取消缓存中的预取任务
+            asyncio.gather(*(asyncio.shield(pending[i]) for i in hit_idx), return_exceptions=True),
+            self._resolve_fetch_links([triples[i] for i in miss_idx]),
+        )
+        # (消息列表 | None, 正文, 预取时已准备好的图片 parts | None, 预取时跳过的图片数)
+        results: list[Any] = [None] * len(triples)
+        for i, r in zip(miss_idx, fresh):
+            results[i] = (r[0], r[1], None, 0)
+        failed = []
+        for i, r in zip(hit_idx, prefetched):
+            if isinstance(r, BaseException):
+                failed.append(i)
+            else:
+                results[i] = r
+        if failed:
+            for i, r in zip(failed, await self._resolve_fetch_links([triples[i] for i in failed])):
+                results[i] = (r[0], r[1], None, 0)
+
+        sections: list[str] = []
+        collected_msgs: list[discord.Message] = []
+        collected_ids: set[int] = set()
+        image_parts: list[dict[str, Any]] = []
+        img_skipped = 0
+        for gi, ((_g_id, ch_id, _mid), (msgs, body, parts, skipped)) in enumerate(
+            zip(triples, results), 1,
+        ):
+            sections.append(f"--- 链接 {gi} (频道/子区 {ch_id}) ---\n{body}")
+            if parts is not None:
+                image_parts.extend(parts)
+                img_skipped += skipped
+                continue
+            for m in msgs or []:
+                if m.id not in collected_ids:
+                    collected_ids.add(m.id)
+                    collected_msgs.append(m)
+
+        out = '\n\n'.join(sections)
+        max_len = 120_000
+        if len(out) > max_len:
+            out = out[: max_len - 80] + '\n\n...(总输出过长已截断，请减少链接数量或缩短范围)'
+        if collected_msgs:
+            fresh_parts, fresh_skipped = await self._build_fetch_image_inline_gemini_parts(
+                collected_msgs, max_images=max_images,
+            )
+            image_parts.extend(fresh_parts)
+            img_skipped += fresh_skipped
+        # 合并去重并统一按上限截断；预取缓存中的 parts 会被多次使用，这里复制后再做频道内去重
+        seen_blobs: set[str] = set()
+        merged: list[dict[str, Any]] = []
+        for p in image_parts:
+            digest = p['inlineData'].get('_blob')
+            if digest in seen_blobs:
+                continue
+            seen_blobs.add(digest)
+            merged.append({'inlineData': dict(p['inlineData'])})
+        img_skipped += max(0, len(merged) - max_images)
+        merged = merged[:max_images]
+        await self._dedup_image_parts(channel_id, merged)
+        if img_skipped:
+            out = (
+                f"{out}\n\n（另有 {img_skipped} 张图片未加入多模态上下文：超过单工具上限或未下载）"
+            )
+        payload: dict[str, Any] = {'messages': out}
+        if merged:
+            payload['image_inline_parts'] = merged
+        return payload
+
+    def _prefetched_link(self, key: tuple[int, Optional[int]]) -> Optional[asyncio.Task]:
+        entry = self._link_prefetch.get(key)
+        if entry is None:
+            return None
+        if entry['expire_at'] <= time.monotonic() or entry['task'].cancelled():
+            self._link_prefetch.pop(key, None)
+            return None
+        self.link_prefetch_stats['hits'] += 1
+        return entry['task']
+
+    def _start_link_prefetch(self, text: str) -> None:
+        """
+        投诉人消息入库时解析其中的 Discord 链接，后台预取上下文与图片，
+        结果在 link_prefetch.ttl_seconds 内供 fetch_messages 直接使用。
+        """
+        if not self.link_prefetch_enabled or not text:
+            return
+        triples = self._parse_discord_links_from_text(text)
+        if not triples:
+            return
+        now = time.monotonic()
+        for key in [k for k, v in self._link_prefetch.items() if v['expire_at'] <= now]:
+            self._link_prefetch.pop(key, None)
+        todo = [
+            t for t in triples if (t[1], t[2]) not in self._link_prefetch
+        ][: self.link_prefetch_max_links]
+        if not todo:
+            return
+        batch = asyncio.ensure_future(self._resolve_fetch_links(todo))
+        for i, (_g, ch_id, msg_id) in enumerate(todo):
+            task = asyncio.create_task(self._prefetch_link(batch, i))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._link_prefetch[(ch_id, msg_id)] = {
+                'task': task,
+                'expire_at': now + self.link_prefetch_ttl,
+            }
+        self.link_prefetch_stats['started'] += len(todo)
+
+    async def _attach_prefetched_links(
+        self, channel_id: int, messages: list[discord.Message],
+    ) -> list[dict[str, Any]]:
+        """
+        fetch_messages.prefetch.attach：把本轮投诉人消息中链接的预取结果直接附在 user turn 后，
+        省去一轮工具调用。超过 attach_wait_seconds 仍未完成时不附加（预取继续，工具调用时再取用）。
+        """
+        triples: list[tuple[int, int, Optional[int]]] = []
+        for msg in messages:
+            for t in self._parse_discord_links_from_text(msg.content or ''):
+                if t not in triples:
+                    triples.append(t)
+        triples = [t for t in triples if (t[1], t[2]) in self._link_prefetch]
+        if not triples:
+            return []
+        task = asyncio.ensure_future(self._fetch_links_payload(triples, channel_id))
+        try:
+            payload = await asyncio.wait_for(
+                asyncio.shield(task), timeout=self.link_prefetch_attach_wait,
+            )
+        except asyncio.TimeoutError:
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            return []
+        except Exception as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [AI客服] 附加预取链接失败: {e}")
+            return []
+        parts: list[dict[str, Any]] = [{
+            "text": (
+                "<odyxml:prefetched_links>\n"
+                "（系统已自动读取投诉人消息中的 Discord 链接，无需再对这些链接调用 fetch_messages）\n"
+                f"{payload['messages']}\n"
+                "</odyxml:prefetched_links>"
+            )
+        }]
+        parts.extend(payload.get('image_inline_parts', []))
+        return parts
+
+    async def _prefetch_link(
+        self, batch: 'asyncio.Future', index: int,
+    ) -> tuple[Optional[list[discord.Message]], str, list[dict[str, Any]], int]:
+        msgs, body = (await asyncio.shield(batch))[index]
+        parts: list[dict[str, Any]] = []
+        skipped = 0
+        if msgs:
+            parts, skipped = await self._build_fetch_image_inline_gemini_parts(msgs)
+        return msgs, body, parts, skipped
+
     def _gather_fetch_image_urls(
         self,
         msgs: list[discord.Message],
@@ -631,8 +1339,12 @@ class AICustomerService(commands.Cog, name="AI客服"):
         msgs: list[discord.Message],
         *,
         max_images: int = 24,
+        channel_id: Optional[int] = None,
     ) -> tuple[list[dict[str, Any]], int]:
-        """下载图片为 Gemini inlineData parts；返回 (parts, 因张数上限跳过的剩余图数)。"""
+        """
+        下载图片为 Gemini inlineData parts；返回 (parts, 因张数上限跳过的剩余图数)。
+        给出 channel_id 时按该频道的图片哈希索引去重（与投诉人已发的图相同则请求时只发一次）。
+        """
         raw_urls = self._gather_fetch_image_urls(msgs)
         seen_u: set[str] = set()
         urls: list[tuple[str, str]] = []
@@ -641,77 +1353,173 @@ class AICustomerService(commands.Cog, name="AI客服"):
                 continue
             seen_u.add(u)
             urls.append((u, m))
-        out: list[dict[str, Any]] = []
         skipped = max(0, len(urls) - max_images)
-        for url, hint_mime in urls[:max_images]:
-            data, content_type = await self._download_attachment(url)
-            if not data or len(data) > self.max_attachment_size:
-                skipped += 1
-                continue
+
+        async def fetch_one(url: str, hint_mime: str) -> Optional[dict[str, Any]]:
+            try:
+                data, content_type = await self._download_attachment(url)
+            except _AttachmentTooLarge:
+                return None
+            if not data:
+                return None
             mime = (content_type or '').split(';')[0].strip().lower()
             if not mime.startswith('image/'):
                 mime = hint_mime if hint_mime.startswith('image/') else 'image/png'
-            data, mime = await self._maybe_resize_image_for_claude(data, mime)
-            b64 = base64.b64encode(data).decode('ascii')
-            out.append({
+            data, mime, extra = await self._prepare_image(data, mime)
+            digest = await asyncio.to_thread(self.blob_store.put, data)
+            return {
                 'inlineData': {
                     'mimeType': mime,
-                    'data': b64,
+                    '_blob': digest,
+                    '_size': len(data),
+                    **extra,
                 }
-            })
+            }
+
+        # 并发下载，结果按原顺序拼接
+        results = await asyncio.gather(*(fetch_one(u, m) for u, m in urls[:max_images]))
+        out: list[dict[str, Any]] = [r for r in results if r is not None]
+        skipped += sum(1 for r in results if r is None)
+        await self._dedup_image_parts(channel_id, out)
         return out, skipped
 
-    async def _format_user_mentions_in_text(
+    def _cached_mention_label(self, key: tuple[Optional[int], int]) -> Optional[str]:
+        entry = self._mention_labels.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            self._mention_labels.pop(key, None)
+            return None
+        return entry[0]
+
+    def _cache_mention_label(self, key: tuple[Optional[int], int], label: str, ttl: float) -> None:
+        now = time.monotonic()
+        if len(self._mention_labels) >= 4096:
+            for k in [k for k, v in self._mention_labels.items() if v[1] <= now]:
+                self._mention_labels.pop(k, None)
+            while len(self._mention_labels) >= 4096:
+                self._mention_labels.pop(next(iter(self._mention_labels)))
+        self._mention_labels[key] = (label, now + ttl)
+
+    async def _resolve_mention_labels(
         self,
-        text: str,
+        uids: list[int],
         guild: Optional[discord.Guild],
-    ) -> str:
-        """将 <@id> 转为 用户昵称（用户名）（数字id）"""
-        if not text:
-            return text
-        pattern = re.compile(r"<@!?(\d+)>")
+    ) -> dict[int, str]:
+        """
+        批量解析用户 ID -> 「昵称（用户名）（id）」：先查 TTL 缓存与成员缓存，
+        再按 100 个一批走网关成员查询（需 members intent），剩余的并发 REST 查询；
+        查无此人的结果同样缓存（negative_ttl_seconds）。
+        """
+        gid = guild.id if guild is not None else None
+        labels: dict[int, str] = {}
+        missing: list[int] = []
+        for uid in dict.fromkeys(uids):
+            label = self._cached_mention_label((gid, uid))
+            if label is not None:
+                labels[uid] = label
+                continue
+            member = guild.get_member(uid) if guild is not None else None
+            if member is not None:
+                labels[uid] = f"{member.display_name}（{member.name}）（{member.id}）"
+                self._cache_mention_label((gid, uid), labels[uid], self.mention_cache_ttl)
+            else:
+                missing.append(uid)
+        if not missing:
+            return labels
 
-        async def uid_to_label(uid: int) -> str:
-            if guild is not None:
-                member = guild.get_member(uid)
-                if member is None:
+        check_member = guild is not None
+        if guild is not None and self.bot.intents.members:
+            found: dict[int, discord.Member] = {}
+            try:
+                for i in range(0, len(missing), 100):
+                    batch = await guild.query_members(user_ids=missing[i:i + 100], cache=True)
+                    found.update((m.id, m) for m in batch)
+                # 网关查询没有返回的 ID 不是本服务器成员，无需再逐个 fetch_member
+                check_member = False
+            except Exception as e:
+                print(
+                    f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [AI客服] "
+                    f"网关成员查询失败，改用 REST: {e}"
+                )
+            for uid, member in found.items():
+                labels[uid] = f"{member.display_name}（{member.name}）（{member.id}）"
+                self._cache_mention_label((gid, uid), labels[uid], self.mention_cache_ttl)
+            missing = [uid for uid in missing if uid not in found]
+
+        async def resolve(uid: int) -> Optional[str]:
+            """返回标签；查无此人返回 None；其他错误抛出（不缓存）"""
+            async with self._fetch_semaphore:
+                if check_member:
                     try:
                         member = await guild.fetch_member(uid)
+                        return f"{member.display_name}（{member.name}）（{member.id}）"
                     except discord.NotFound:
-                        member = None
-                if member is not None:
-                    return f"{member.display_name}（{member.name}）（{member.id}）"
-            try:
-                user = await self.bot.fetch_user(uid)
+                        pass
+                try:
+                    user = await self.bot.fetch_user(uid)
+                except discord.NotFound:
+                    return None
                 return f"{user.display_name}（{user.name}）（{user.id}）"
-            except Exception:
-                return f"用户（?）（{uid}）"
 
-        chunks: list[str] = []
-        pos = 0
-        for m in pattern.finditer(text):
-            chunks.append(text[pos : m.start()])
-            chunks.append(await uid_to_label(int(m.group(1))))
-            pos = m.end()
-        chunks.append(text[pos:])
-        return "".join(chunks)
+        results = await asyncio.gather(*(resolve(uid) for uid in missing), return_exceptions=True)
+        for uid, res in zip(missing, results):
+            if isinstance(res, BaseException):
+                labels[uid] = f"用户（?）（{uid}）"
+            elif res is None:
+                labels[uid] = f"用户（?）（{uid}）"
+                self._cache_mention_label((gid, uid), labels[uid], self.mention_negative_ttl)
+            else:
+                labels[uid] = res
+                self._cache_mention_label((gid, uid), res, self.mention_cache_ttl)
+        return labels
+
+    async def _format_user_mentions_in_texts(
+        self,
+        texts: list[str],
+        guild: Optional[discord.Guild],
+    ) -> list[str]:
+        """将多段文本中的 <@id> 转为 用户昵称（用户名）（数字id）；所有 ID 去重后一次批量解析"""
+        uids = [int(m.group(1)) for t in texts for m in _USER_MENTION_RE.finditer(t or '')]
+        if not uids:
+            return list(texts)
+        labels = await self._resolve_mention_labels(uids, guild)
+        return [
+            _USER_MENTION_RE.sub(lambda m: labels[int(m.group(1))], t) if t else t
+            for t in texts
+        ]
+
+    async def _format_user_mentions_in_text(
+        self,
+        text: str,
+        guild: Optional[discord.Guild],
+    ) -> str:
+        """将 <@id> 转为 用户昵称（用户名）（数字id）"""
+        return (await self._format_user_mentions_in_texts([text], guild))[0]
 
     async def _expand_fetch_punishments(self) -> str:
-        """%fetch_punishments%：在最近 10 条消息中取含 embed 的条目并格式化"""
+        """
+        %fetch_punishments%：在最近 10 条消息中取含 embed 的条目并格式化；
+        频道未配置或无法读取时抛出 PresetRenderError（提示文字不入缓存）
+        """
         cid = self.fetch_punishments_channel_id
         if not cid:
-            return "（未配置 send_to_admin_presets.fetch_punishments_channel_id）"
+            raise PresetRenderError("（未配置 send_to_admin_presets.fetch_punishments_channel_id）")
         ch = self.bot.get_channel(cid)
         if ch is None:
             try:
                 ch = await self.bot.fetch_channel(cid)
             except Exception:
-                return "（无法访问处罚记录频道）"
+                raise PresetRenderError("（无法访问处罚记录频道）")
         if not isinstance(ch, discord.TextChannel):
-            return "（处罚记录频道不是文字频道）"
+            raise PresetRenderError("（处罚记录频道不是文字频道）")
         guild = ch.guild
         embed_msgs: list[discord.Message] = []
-        async for msg in ch.history(limit=10):
+        try:
+            recent = await self._recent_messages(ch, 10)
+        except discord.HTTPException as e:
+            raise PresetRenderError(f"（读取处罚记录频道失败: {e}）")
+        for msg in recent:
             if msg.embeds:
                 embed_msgs.append(msg)
         embed_msgs.reverse()
@@ -725,18 +1533,20 @@ class AICustomerService(commands.Cog, name="AI客服"):
             body = "\n".join(parts).strip()
             if not body:
                 body = "（空 embed）"
-            body = await self._format_user_mentions_in_text(body, guild)
-            blocks.append(f"消息链接：{msg.jump_url}\n处罚内容：{body}")
+            blocks.append(body)
         if not blocks:
             return "（近 10 条消息中无 embed）"
+        # 所有 embed 中的提及一次批量解析
+        bodies = await self._format_user_mentions_in_texts(blocks, guild)
+        blocks = [
+            f"消息链接：{msg.jump_url}\n处罚内容：{body}"
+            for msg, body in zip(embed_msgs, bodies)
+        ]
         return "\n\n".join(blocks)
 
     async def _expand_preset_variables(self, template: str) -> str:
-        out = template
-        if "%fetch_punishments%" in out:
-            repl = await self._expand_fetch_punishments()
-            out = out.replace("%fetch_punishments%", repl)
-        return out
+        """展开预设中的 %变量%；新增变量在 __init__ 中向 preset_variables 注册"""
+        return await self.preset_variables.expand(template)
 
     def _is_transient_bot_chunk(self, message: discord.Message) -> bool:
         """重建历史时忽略本 Bot 的中间状态占位消息"""
@@ -798,7 +1608,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
         只处理正文中来源频道 ID 与 expected_source_channel_id 一致的消息。
         """
         n = 0
-        async for msg in thread.history(limit=history_limit):
+        for msg in await self._recent_messages(thread, history_limit):
             if msg.author.id != self.bot.user.id:
                 continue
             if not self._message_has_send_inject_button(msg):
@@ -810,9 +1620,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
             if src_id != expected_source_channel_id:
                 continue
             try:
-                view = AdminInjectView(self, src_id, msg.id)
+                view = self._bind_admin_inject_view(src_id, msg.id)
                 await msg.edit(content=msg.content, view=view)
-                self.bot.add_view(view, message_id=msg.id)
                 n += 1
             except Exception as e:
                 print(
@@ -821,12 +1630,42 @@ class AICustomerService(commands.Cog, name="AI客服"):
                 )
         return n
 
+    async def _messages_after(
+        self,
+        channel: discord.abc.Messageable,
+        after: Optional[int],
+        before: Optional[int],
+        limit: int,
+    ) -> list[discord.Message]:
+        """
+        ID 在 (after, before) 内最早的 limit 条消息（旧→新）；after 为空表示从频道开头。
+        消息缓存能覆盖该范围时不走 REST。
+        """
+        cid = getattr(channel, 'id', None)
+        if self.message_cache_enabled and cid is not None:
+            cached = self.message_ring.since(cid, after)
+            if cached is not None:
+                if before:
+                    cached = [m for m in cached if m.id < before]
+                return cached[:limit]
+        return await self._fetch_history(
+            channel,
+            limit=limit,
+            after=discord.Object(id=after) if after else None,
+            before=discord.Object(id=before) if before else None,
+            oldest_first=True,
+        )
+
     async def _rebuild_conversation_from_history(
         self,
         channel: discord.TextChannel,
+        *,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
     ) -> tuple[list, Optional[int]]:
         """
-        从频道消息历史重建 Gemini contents（由旧到新）。
+        从频道消息历史重建 Gemini contents（由旧到新）；after/before 限定读取的消息 ID 范围
+        （before 用于懒加载：触发重建的那条消息随后会按正常流程处理）。
         返回 (对话列表, 投诉人 user_id 若可从历史中确定否则 None)。
         """
         complainant_id: Optional[int] = None
@@ -835,6 +1674,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
         # 多取一些消息：一轮对话可能含多条 Bot 分包
         msg_limit = max(150, self.max_history * 4)
         pending_bot_chunks: list[str] = []
+        user_slots: list[tuple[int, discord.Message]] = []
 
         def flush_bot():
             nonlocal pending_bot_chunks
@@ -845,7 +1685,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
             if merged:
                 conv.append({"role": "model", "parts": [{"text": merged}]})
 
-        async for msg in channel.history(limit=msg_limit, oldest_first=True):
+        for msg in await self._messages_after(channel, after, before, msg_limit):
+            self._advance_last_message_id(channel.id, msg.id)
             if msg.type not in (discord.MessageType.default, discord.MessageType.reply):
                 continue
             if msg.author.bot:
@@ -857,7 +1698,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
                         pending_bot_chunks.append(msg.content or "")
                 else:
                     flush_bot()
-                    conv.append(await self._build_user_message(msg))
+                    user_slots.append((len(conv), msg))
+                    conv.append(None)
                 continue
 
             flush_bot()
@@ -867,12 +1709,19 @@ class AICustomerService(commands.Cog, name="AI客服"):
                     pass
                 else:
                     complainant_id = msg.author.id
-            conv.append(await self._build_user_message(msg))
+            user_slots.append((len(conv), msg))
+            conv.append(None)
 
         flush_bot()
 
-        if len(conv) > self.max_history:
-            conv = conv[-self.max_history :]
+        # user 回合（含附件下载）最后并发构建，按占位顺序回填
+        built = await asyncio.gather(*(self._build_user_message(m) for _, m in user_slots))
+        for (idx, _), user_msg in zip(user_slots, built):
+            conv[idx] = user_msg
+
+        start, _ = self._history_window_start(conv)
+        if start:
+            conv = conv[start:]
 
         return conv, complainant_id
 
@@ -881,14 +1730,23 @@ class AICustomerService(commands.Cog, name="AI客服"):
         ch: discord.TextChannel,
         *,
         admin_parent: Optional[discord.abc.GuildChannel] = None,
+        stored: Optional[dict[str, Any]] = None,
+        before: Optional[int] = None,
     ) -> str:
         """
         从 Discord 恢复单个监控分类下的投诉文字频道（与启动时批量恢复同逻辑）：
         对话历史、投诉人、管理子区映射与注入按钮重绑。
+        stored 为本地状态库中的记录时，直接回放本地对话，只补齐其后的新消息。
         会加入 active_channels。
         """
-        conv, complainant_id = await self._rebuild_conversation_from_history(ch)
+        if stored is not None:
+            return await self._restore_one_from_store(
+                ch, stored, admin_parent=admin_parent, before=before,
+            )
+
+        conv, complainant_id = await self._rebuild_conversation_from_history(ch, before=before)
         self.conversations[ch.id] = conv
+        self._invalidate_conversion_cache(ch.id)
         self.active_channels.add(ch.id)
         if complainant_id is not None:
             self.channel_complainants[ch.id] = complainant_id
@@ -930,6 +1788,82 @@ class AICustomerService(commands.Cog, name="AI客服"):
         )
         return tip
 
+    async def _restore_one_from_store(
+        self,
+        ch: discord.TextChannel,
+        stored: dict[str, Any],
+        *,
+        admin_parent: Optional[discord.abc.GuildChannel] = None,
+        before: Optional[int] = None,
+    ) -> str:
+        """按本地状态库恢复频道：回放已落盘的回合，只向 Discord 拉取 last_message_id 之后的消息"""
+        conv = list(stored['turns'])
+        self._store_synced[ch.id] = {
+            'turns': list(conv),
+            'seqs': list(stored['seqs']),
+            'meta': None,
+        }
+        if stored.get('last_message_id'):
+            self.channel_last_message_id[ch.id] = max(
+                stored['last_message_id'], self.channel_last_message_id.get(ch.id, 0)
+            )
+        # 频道 ID 本身是创建时间的 snowflake：没有记录时等价于从头读取
+        newer, newer_complainant = await self._rebuild_conversation_from_history(
+            ch, after=stored.get('last_message_id') or ch.id, before=before,
+        )
+        conv.extend(newer)
+        self.conversations[ch.id] = conv
+        self._invalidate_conversion_cache(ch.id)
+        self._trim_history(ch.id)
+        self.active_channels.add(ch.id)
+        complainant_id = stored.get('complainant_id') or newer_complainant
+        if complainant_id is not None:
+            self.channel_complainants[ch.id] = complainant_id
+        else:
+            self.channel_complainants.pop(ch.id, None)
+
+        mapped: Optional[discord.Thread] = None
+        thread_id = stored.get('thread_id')
+        if thread_id:
+            mapped = self.bot.get_channel(thread_id)
+            if mapped is None:
+                try:
+                    mapped = await self.bot.fetch_channel(thread_id)
+                except Exception:
+                    mapped = None
+            if not isinstance(mapped, discord.Thread):
+                mapped = None
+        if mapped is None:
+            # 记录缺失或子区已不可访问：退回按名称扫描（并重新编辑按钮）
+            ap = admin_parent
+            if ap is None and self.admin_channel_id:
+                ap = self.bot.get_channel(self.admin_channel_id)
+            mapped = await self._find_admin_thread_by_channel_name(ap, ch.name) if ap else None
+            rebound = (
+                await self._reregister_admin_inject_views_in_thread(mapped, ch.id)
+                if mapped else 0
+            )
+        else:
+            # custom_id 由 (频道, 消息) 决定，直接 add_view 即可接管旧按钮，无需逐条编辑消息
+            for mid in stored.get('admin_message_ids') or []:
+                if mid not in self._bound_admin_views:
+                    self._bind_admin_inject_view(ch.id, mid, persist=False)
+            rebound = len(stored.get('admin_message_ids') or [])
+        if mapped:
+            self.channel_threads[ch.id] = mapped
+        else:
+            self.channel_threads.pop(ch.id, None)
+
+        tip = f"+管理子区 #{mapped.name}" if mapped else "（未匹配管理子区）"
+        if mapped and rebound:
+            tip += f"，已恢复 {rebound} 条「发送指令」按钮"
+        print(
+            f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+            f"[AI客服] 已从本地状态恢复 #{ch.name}（{len(conv)} 轮对话，"
+            f"补齐 {len(newer)} 轮新消息）{tip}",
+        )
+        return tip
+
     async def _restore_auto_reply_state(self):
         """启动时从 Discord 拉回分类下各频道消息与管理子区，修复内存中的对话与映射"""
         if not self.auto_reply_enabled or not self.auto_reply_category_ids:
@@ -956,34 +1890,302 @@ class AICustomerService(commands.Cog, name="AI客服"):
                 except Exception:
                     admin_parent = None
 
+        snapshot: dict[int, dict[str, Any]] = {}
+        if self.conversation_store is not None:
+            try:
+                snapshot = await asyncio.to_thread(self.conversation_store.load_all)
+            except Exception as e:
+                print(
+                    f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                    f"[AI客服] 读取本地状态库失败，改为全量从 Discord 恢复: {e}",
+                )
+                snapshot = {}
+
         print(
             f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-            "[AI客服] 开始从 Discord 恢复投诉频道状态…",
+            f"[AI客服] 开始恢复投诉频道状态（本地记录 {len(snapshot)} 个频道）…",
         )
 
-        restored = 0
+        # 先全部登记为待加载：恢复期间收到消息的频道会经 _ensure_hydrated 立即插队重建
+        queue: list[discord.TextChannel] = []
         for guild in self.bot.guilds:
             for cat_id in self.auto_reply_category_ids:
                 category = guild.get_channel(cat_id)
                 if category is None or not isinstance(category, discord.CategoryChannel):
                     continue
                 for ch in category.text_channels:
-                    try:
-                        await self._restore_one_complaint_channel(
-                            ch, admin_parent=admin_parent
-                        )
-                        restored += 1
-                    except Exception as e:
-                        print(
-                            f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-                            f"[AI客服] 恢复频道 #{getattr(ch, 'name', ch.id)} 失败: {e}",
-                        )
+                    stored = snapshot.get(ch.id)
+                    if stored is not None and not stored['active']:
+                        # 已结束或被手动关闭的频道保持关闭
+                        continue
+                    self._register_dormant_channel(ch.id, stored)
+                    queue.append(ch)
+
+        for cid in snapshot:
+            if self.bot.get_channel(cid) is None:
+                self._store_pending_ops.append(('delete_channel', cid))
+
+        if self.restore_lazy:
+            print(
+                f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                f"[AI客服] 已登记 {len(queue)} 个投诉频道"
+                "（懒加载：首条新消息或管理注入时再重建对话）",
+            )
+            return
+
+        # 最近活跃的工单优先：按最后消息 snowflake 倒序（无记录时用频道 ID，即创建时间）
+        def activity(ch: discord.TextChannel) -> int:
+            stored = snapshot.get(ch.id) or {}
+            return max(
+                stored.get('last_message_id') or 0,
+                getattr(ch, 'last_message_id', None) or 0,
+                ch.id,
+            )
+
+        queue.sort(key=activity, reverse=True)
+        total = len(queue)
+        done = 0
+        started = time.monotonic()
+        report_every = max(1, total // 10)
+
+        async def worker():
+            nonlocal done
+            while queue:
+                ch = queue.pop(0)
+                # 已被消息触发重建的频道直接跳过；正在重建的则共享同一任务
+                await self._ensure_hydrated(ch, admin_parent=admin_parent)
+                done += 1
+                if done % report_every == 0 and done < total:
+                    print(
+                        f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                        f"[AI客服] 恢复进度 {done}/{total}，已用时 {time.monotonic() - started:.1f}s",
+                    )
+
+        # 并发上限之外的限流由 discord.py 按路由 bucket 处理（各频道历史分属不同 bucket）
+        await asyncio.gather(*(worker() for _ in range(min(self.restore_concurrency, total))))
 
         print(
             f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-            f"[AI客服] 投诉频道状态恢复结束，共处理 {restored} 个文字频道",
+            f"[AI客服] 投诉频道状态恢复结束，共处理 {total} 个文字频道，"
+            f"并发 {self.restore_concurrency}，用时 {time.monotonic() - started:.1f}s",
+        )
+
+    # ── 懒加载 ────────────────────────────────────────────────
+
+    def _register_dormant_channel(
+        self, channel_id: int, stored: Optional[dict[str, Any]],
+    ) -> None:
+        """只登记索引（启用状态、投诉人、本地记录的管理按钮），不访问 Discord"""
+        self._dormant_channels[channel_id] = stored
+        self.active_channels.add(channel_id)
+        if stored is None:
+            return
+        if stored.get('complainant_id') is not None:
+            self.channel_complainants[channel_id] = stored['complainant_id']
+        if stored.get('last_message_id'):
+            self.channel_last_message_id[channel_id] = stored['last_message_id']
+        for mid in stored.get('admin_message_ids') or []:
+            self._bind_admin_inject_view(channel_id, mid, persist=False)
+
+    async def _ensure_hydrated(
+        self,
+        channel: discord.abc.GuildChannel,
+        *,
+        before: Optional[int] = None,
+        admin_parent: Optional[discord.abc.GuildChannel] = None,
+    ) -> bool:
+        """
+        待加载频道首次被触发时重建对话；同一频道的并发触发共享同一个重建任务。
+        重建失败时频道保持待加载，下次触发再重试；返回对话是否已就绪（False 时调用方不应写入对话）。
+        """
+        channel_id = channel.id
+        if channel_id not in self._dormant_channels:
+            return True
+        task = self._hydration_tasks.get(channel_id)
+        if task is None:
+            task = asyncio.create_task(self._hydrate_channel(channel, before, admin_parent))
+            self._hydration_tasks[channel_id] = task
+        await asyncio.shield(task)
+        return channel_id not in self._dormant_channels
+
+    async def _hydrate_channel(
+        self,
+        channel: discord.abc.GuildChannel,
+        before: Optional[int],
+        admin_parent: Optional[discord.abc.GuildChannel] = None,
+    ) -> None:
+        channel_id = channel.id
+        stored = self._dormant_channels.get(channel_id)
+        try:
+            await self._restore_one_complaint_channel(
+                channel,
+                admin_parent=admin_parent,
+                stored=stored,
+                before=before,
+            )
+            self._dormant_channels.pop(channel_id, None)
+        except Exception as e:
+            if channel_id in self.conversations:
+                # 对话已恢复，只是管理子区映射等后续步骤失败
+                self._dormant_channels.pop(channel_id, None)
+                print(
+                    f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                    f"[AI客服] 恢复 #{getattr(channel, 'name', channel_id)} 的管理子区失败: {e}",
+                )
+            else:
+                # 保持待加载：不以空上下文继续，下次触发时重新拉取（期间的消息仍在 Discord 历史里）
+                if stored and stored.get('last_message_id'):
+                    self.channel_last_message_id[channel_id] = stored['last_message_id']
+                else:
+                    self.channel_last_message_id.pop(channel_id, None)
+                self._store_synced.pop(channel_id, None)
+                print(
+                    f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                    f"[AI客服] 重建 #{getattr(channel, 'name', channel_id)} 失败，下次触发时重试: {e}",
+                )
+        finally:
+            self._hydration_tasks.pop(channel_id, None)
+
+    def _forget_dormant(self, channel_id: int) -> None:
+        self._dormant_channels.pop(channel_id, None)
+        task = self._hydration_tasks.pop(channel_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    def _bind_admin_inject_view(
+        self, source_channel_id: int, admin_message_id: int, *, persist: bool = True,
+    ) -> AdminInjectView:
+        """为管理消息注册持久化按钮 View；persist 时同时记入本地状态库，重启后无需扫描子区"""
+        view = AdminInjectView(self, source_channel_id, admin_message_id)
+        self.bot.add_view(view, message_id=admin_message_id)
+        self._bound_admin_views.add(admin_message_id)
+        if persist and self.conversation_store is not None:
+            self._store_pending_ops.append(
+                ('admin_message', source_channel_id, admin_message_id)
+            )
+        return view
+
+    # ── 状态持久化 ────────────────────────────────────────────
+
+    def _store_channel_meta(self, channel_id: int) -> tuple:
+        thread = self.channel_threads.get(channel_id)
+        return (
+            self.channel_complainants.get(channel_id),
+            thread.id if thread is not None else None,
+            channel_id in self.active_channels,
+            self.channel_last_message_id.get(channel_id),
         )
 
+    def _advance_last_message_id(self, channel_id: int, message_id: int) -> None:
+        """
+        消息已作为回合写入对话后才推进：重启时只向 Discord 补拉此 ID 之后的消息，
+        尚在队列中、正在生成或仅是「思考中」占位的消息不能越过
+        """
+        if message_id > self.channel_last_message_id.get(channel_id, 0):
+            self.channel_last_message_id[channel_id] = message_id
+
+    def _store_channel_ops(self, channel_id: int, conv: list) -> list[tuple]:
+        """
+        对比内存对话与上次落盘的回合（按对象身份），生成增量写操作：
+        裁剪/摘要替换对应删除头部，回滚对应删除尾部，新回合按 seq 追加（摘要插在头部用负向 seq）。
+        回合写入对话后视为不可变：原地修改已落盘的回合不会被检测到，需要修改时应换成新的 dict。
+        上次写入失败的频道（rewrite）先清空数据库中的回合再全量写入。
+        """
+        synced = self._store_synced.get(channel_id)
+        if synced is None:
+            synced = {'turns': [], 'seqs': [], 'meta': None}
+        old: list = synced['turns']
+        seqs: list[int] = synced['seqs']
+        ops: list[tuple] = []
+
+        meta = self._store_channel_meta(channel_id)
+        if meta != synced['meta']:
+            ops.append(('meta', channel_id, *meta))
+
+        pos = {id(t): i for i, t in enumerate(old)}
+        j = next((j for j, t in enumerate(conv) if id(t) in pos), None)
+        if j is None:
+            if old or synced.get('rewrite'):
+                ops.append(('clear_turns', channel_id))
+            new_seqs = list(range(len(conv)))
+            for seq, turn in zip(new_seqs, conv):
+                ops.append(('insert', channel_id, seq, dump_turn(turn)))
+        else:
+            k = pos[id(conv[j])]
+            m = 0
+            while j + m < len(conv) and k + m < len(old) and conv[j + m] is old[k + m]:
+                m += 1
+            if k > 0:
+                ops.append(('drop_before', channel_id, seqs[k]))
+            if k + m < len(old):
+                ops.append(('drop_after', channel_id, seqs[k + m - 1]))
+            head_seqs = [seqs[k] - j + i for i in range(j)]
+            tail_start = seqs[k + m - 1] + 1
+            tail_seqs = [tail_start + i for i in range(len(conv) - j - m)]
+            for seq, turn in zip(head_seqs, conv[:j]):
+                ops.append(('insert', channel_id, seq, dump_turn(turn)))
+            for seq, turn in zip(tail_seqs, conv[j + m:]):
+                ops.append(('insert', channel_id, seq, dump_turn(turn)))
+            new_seqs = head_seqs + seqs[k:k + m] + tail_seqs
+
+        if ops:
+            self._store_synced[channel_id] = {
+                'turns': list(conv),
+                'seqs': new_seqs,
+                'meta': meta,
+            }
+        return ops
+
+    def _store_forget(self, channel_id: int, *, keep_inactive: bool) -> None:
+        """频道结束/关闭时清空已落盘回合；keep_inactive 时保留一条停用记录，重启后不再自动开启"""
+        if self.conversation_store is None:
+            return
+        self._store_synced.pop(channel_id, None)
+        if keep_inactive:
+            self._store_pending_ops.append(('clear_turns', channel_id))
+            self._store_pending_ops.append(('meta', channel_id, None, None, False, None))
+        else:
+            self._store_pending_ops.append(('delete_channel', channel_id))
+
+    async def _store_flush(self) -> None:
+        """把所有频道自上次落盘以来的变化写入状态库（序列化在事件循环线程，写入在后台线程）"""
+        if self.conversation_store is None:
+            return
+        pending, self._store_pending_ops = self._store_pending_ops, []
+        pending.extend(self.attachment_cache.drain_changes())
+        ops = list(pending)
+        for channel_id, conv in list(self.conversations.items()):
+            ops.extend(self._store_channel_ops(channel_id, conv))
+        if not ops:
+            return
+        try:
+            await asyncio.to_thread(self.conversation_store.apply, ops)
+        except Exception as e:
+            # 整批已回滚：显式操作（关闭/删除频道、管理消息等）放回队列最前；
+            # 各频道下次先清空再全量重写，数据库中残留的旧回合（摘要头部的负 seq 等）不会在重启后被重放
+            self._store_pending_ops[:0] = pending
+            for channel_id in self.conversations:
+                self._store_synced[channel_id] = {'turns': [], 'seqs': [], 'meta': None, 'rewrite': True}
+            print(
+                f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                f"[AI客服] 写入本地状态库失败: {e}"
+            )
+
+    async def _store_flush_loop(self) -> None:
+        last_compact = time.monotonic()
+        while True:
+            await asyncio.sleep(self.state_store_flush_interval)
+            await self._store_flush()
+            if time.monotonic() - last_compact >= self.state_store_compact_interval:
+                last_compact = time.monotonic()
+                try:
+                    await asyncio.to_thread(self.conversation_store.compact)
+                except Exception as e:
+                    print(
+                        f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                        f"[AI客服] 压缩本地状态库失败: {e}"
+                    )
+
     async def _complaint_channel_still_exists(self, channel_id: int) -> bool:
         """投诉文字频道是否仍存在（get_channel 之外再 fetch，减轻缓存未命中误杀）"""
         if self.bot.get_channel(channel_id) is not None:
@@ -1002,7 +2204,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
         """从子区内本 Bot 早期消息解析投诉频道 ID（新投诉通知 / send_to_admin 头）"""
         header_pat = re.compile(r"\*\*来自 <#(\d+)>")
         notify_pat = re.compile(r"新投诉频道 <#(\d+)>")
-        async for msg in thread.history(limit=50, oldest_first=True):
+        for msg in await self._oldest_messages(thread, 50):
             if msg.author.id != self.bot.user.id:
                 continue
             text = msg.content or ""
@@ -1088,44 +2290,394 @@ class AICustomerService(commands.Cog, name="AI客服"):
                 return
         if not isinstance(admin_parent, (discord.TextChannel, discord.ForumChannel)):
             return
-        guild = admin_parent.guild
-        print(
-            f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-            "[AI客服] 扫描管理频道子区，清理无主映射…",
+        guild = admin_parent.guild
+        print(
+            f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+            "[AI客服] 扫描管理频道子区，清理无主映射…",
+        )
+        n = 0
+        for t in list(admin_parent.threads):
+            try:
+                if await self._maybe_archive_orphan_admin_thread(t, guild):
+                    n += 1
+            except Exception as e:
+                print(
+                    f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                    f"[AI客服] 检查子区 {getattr(t, 'id', '?')} 时出错: {e}",
+                )
+        if n:
+            print(
+                f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                f"[AI客服] 无主投诉子区归档完成，共 {n} 个",
+            )
+
+    def _is_admin(self, member: discord.Member) -> bool:
+        """判断成员是否属于管理组"""
+        if member.guild_permissions.administrator:
+            return True
+        if not self.allowed_role_ids:
+            return False
+        member_role_ids = [role.id for role in member.roles]
+        return any(rid in member_role_ids for rid in self.allowed_role_ids)
+
+    # ── 历史窗口 ──────────────────────────────────────────────
+
+    @staticmethod
+    def _is_window_boundary(turn: Any) -> bool:
+        """窗口只能从普通 user 回合开始，保证 functionCall/functionResponse 不被拆开"""
+        if not isinstance(turn, dict) or turn.get('role') != 'user':
+            return False
+        return not any(
+            isinstance(p, dict) and 'functionResponse' in p
+            for p in turn.get('parts') or []
+        )
+
+    def _fixed_prompt_tokens(self) -> int:
+        """系统提示词与工具声明的估算 token 数（每次请求都会发送，从窗口预算中扣除）"""
+        raw = self._stable_system_prompt_text() + json.dumps(
+            self._build_tools(), ensure_ascii=False,
+        )
+        return estimate_text_tokens(raw, provider_family(self.llm_provider))
+
+    def _history_token_budget(self) -> Optional[int]:
+        """历史回合可用的 token 预算（已扣除系统提示词与工具）；None 表示只按 max_history 裁剪"""
+        if self.history_max_input_tokens <= 0:
+            return None
+        return max(0, self.history_max_input_tokens - self._fixed_prompt_tokens())
+
+    def _history_window_start(
+        self, conv: list, budget: Optional[int] = -1,
+    ) -> tuple[int, int]:
+        """
+        计算历史窗口起点：从最新回合往前累加本地估算 token，不超过 budget
+        （默认取 _history_token_budget）且不超过 max_history 回合。
+        起点对齐到 _is_window_boundary；返回 (起点下标, 窗口估算 token 数)。
+        """
+        n = len(conv)
+        if n == 0:
+            return 0, 0
+        if budget == -1:
+            budget = self._history_token_budget()
+        tokens = [0] * n
+        start = n
+        total = 0
+        for i in range(n - 1, -1, -1):
+            t = estimate_turn_tokens(conv[i], self.llm_provider)
+            if start < n and (
+                n - i > self.max_history
+                or (budget is not None and total + t > budget)
+            ):
+                break
+            tokens[i] = t
+            total += t
+            start = i
+        if start > 0 and not self._is_window_boundary(conv[start]):
+            j = start
+            while j < n and not self._is_window_boundary(conv[j]):
+                j += 1
+            if j < n:
+                start = j
+            else:
+                # 窗口内没有可用起点（末尾全是工具轮）：向前找，宁可超预算也不拆配对
+                j = start - 1
+                while j > 0 and not self._is_window_boundary(conv[j]):
+                    j -= 1
+                start = j
+        total = sum(
+            tokens[i] or estimate_turn_tokens(conv[i], self.llm_provider)
+            for i in range(start, n)
+        )
+        return start, total
+
+    def _trim_history(self, channel_id: int) -> int:
+        """
+        按 token 预算裁剪频道历史，返回历史减少的回合数（只动最新 user 回合之前的部分）。
+        开启 summary 时先换入已完成的滚动摘要，再视窗口大小在后台折叠较早的回合。
+        """
+        conv = self.conversations.get(channel_id)
+        if not conv:
+            self.channel_window_tokens[channel_id] = 0
+            return 0
+        before = len(conv)
+        conv = self._summary_apply_ready(channel_id, conv)
+        head = self._summary_head_len(conv)
+        reserve = sum(estimate_turn_tokens(t, self.llm_provider) for t in conv[:head])
+        budget = self._history_token_budget()
+        if budget is not None:
+            budget = max(0, budget - reserve)
+        body = conv[head:] if head else conv
+        start, total = self._history_window_start(body, budget)
+        if start > 0:
+            conv = conv[:head] + body[start:]
+        self.conversations[channel_id] = conv
+        self.channel_window_tokens[channel_id] = total + reserve
+        if len(conv) != before or start > 0:
+            self._invalidate_conversion_cache(channel_id)
+        if self.summary_enabled:
+            self._summary_maybe_schedule(channel_id, conv, head, total)
+        return before - len(conv)
+
+    # ── 滚动摘要 ──────────────────────────────────────────────
+
+    _SUMMARY_OPEN = '<odyxml:summary>'
+    _SUMMARY_CLOSE = '</odyxml:summary>'
+    _SUMMARY_NOTE = '（以下为本工单较早对话的摘要，原始消息已折叠）'
+    _SUMMARY_ACK = '好的，我已了解以上前情，接下来据此继续处理本工单。'
+
+    _SUMMARY_INSTRUCTION = (
+        '你负责为客服工单压缩对话历史。下面给出「已有摘要」（可能为空）与随后一段较早的对话记录，'
+        '请输出一份合并后的新摘要，供客服继续处理该工单时作为前情。\n'
+        '要求：保留投诉人身份与诉求、涉及的用户/消息/频道 ID 与链接、已查证的事实与证据、'
+        '客服已作出的答复与承诺、管理组的介入与结论、尚未解决的问题；'
+        '省略寒暄与重复内容，不要编造，不要评价，只输出摘要正文。'
+    )
+
+    @classmethod
+    def _is_summary_turn(cls, turn: Any) -> bool:
+        return isinstance(turn, dict) and bool(turn.get('_summary'))
+
+    @classmethod
+    def _summary_turn_text(cls, turn: Any) -> str:
+        if not cls._is_summary_turn(turn):
+            return ''
+        text = ''.join(
+            p.get('text', '') for p in turn.get('parts') or [] if isinstance(p, dict)
+        )
+        for marker in (cls._SUMMARY_OPEN, cls._SUMMARY_NOTE, cls._SUMMARY_CLOSE):
+            text = text.replace(marker, '')
+        return text.strip()
+
+    @classmethod
+    def _summary_head_len(cls, conv: list) -> int:
+        """历史开头的摘要回合数：摘要 user 回合 + 模型确认回合（旧数据可能只有摘要回合）"""
+        n = 0
+        while n < min(2, len(conv)) and cls._is_summary_turn(conv[n]):
+            n += 1
+        return n
+
+    @classmethod
+    def _make_summary_turns(cls, text: str) -> list[dict[str, Any]]:
+        """
+        摘要回合及其后的模型确认回合：保留的历史总是从普通用户消息开始，
+        配上确认回合才能保持 user/model 交替
+        """
+        return [
+            {
+                'role': 'user',
+                'parts': [{
+                    'text': (
+                        f'{cls._SUMMARY_OPEN}\n{cls._SUMMARY_NOTE}\n'
+                        f'{text}\n{cls._SUMMARY_CLOSE}'
+                    ),
+                }],
+                '_summary': True,
+            },
+            {'role': 'model', 'parts': [{'text': cls._SUMMARY_ACK}], '_summary': True},
+        ]
+
+    @staticmethod
+    def _summary_transcript(turns: list) -> str:
+        """把待折叠的 Gemini 形态回合渲染成纯文本记录（附件只保留类型，工具结果截断）"""
+        lines: list[str] = []
+        for turn in turns:
+            if not isinstance(turn, dict):
+                continue
+            speaker = '客服' if turn.get('role') == 'model' else '用户'
+            chunks: list[str] = []
+            for p in turn.get('parts') or []:
+                if not isinstance(p, dict) or p.get('thought'):
+                    continue
+                if p.get('text'):
+                    chunks.append(p['text'])
+                elif 'inlineData' in p:
+                    mime = (p.get('inlineData') or {}).get('mimeType', '')
+                    chunks.append(f'[附件 {mime}]')
+                elif 'functionCall' in p:
+                    fc = p['functionCall'] or {}
+                    args = json.dumps(fc.get('args') or {}, ensure_ascii=False)
+                    chunks.append(f"[调用工具 {fc.get('name', '')} {args[:500]}]")
+                elif 'functionResponse' in p:
+                    fr = p['functionResponse'] or {}
+                    resp = json.dumps(fr.get('response') or {}, ensure_ascii=False)
+                    chunks.append(f"[工具结果 {fr.get('name', '')}] {resp[:2000]}")
+            if chunks:
+                lines.append(f'【{speaker}】' + '\n'.join(chunks))
+        return '\n\n'.join(lines)
+
+    def _summary_maybe_schedule(
+        self, channel_id: int, conv: list, head: int, window_tokens: int,
+    ) -> None:
+        """窗口超过 trigger_tokens 时，把 keep_tokens 之前的回合交给后台任务折叠进摘要"""
+        if window_tokens <= self.summary_trigger_tokens:
+            return
+        task = self._summary_tasks.get(channel_id)
+        if task is not None and not task.done():
+            return
+        if channel_id in self._summary_ready:
+            return
+        if time.monotonic() < self._summary_retry_at.get(channel_id, 0.0):
+            return
+        body = conv[head:]
+        keep_start, _ = self._history_window_start(body, self.summary_keep_tokens)
+        if keep_start <= 0:
+            return
+        previous = self._summary_turn_text(conv[0]) if head else ''
+        self._summary_tasks[channel_id] = asyncio.create_task(
+            self._summary_run(channel_id, previous, body[:keep_start])
         )
-        n = 0
-        for t in list(admin_parent.threads):
-            try:
-                if await self._maybe_archive_orphan_admin_thread(t, guild):
-                    n += 1
-            except Exception as e:
-                print(
-                    f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-                    f"[AI客服] 检查子区 {getattr(t, 'id', '?')} 时出错: {e}",
-                )
-        if n:
+
+    async def _summary_run(self, channel_id: int, previous: str, turns: list) -> None:
+        """后台生成新摘要；完成后只登记结果，由下一次 _trim_history 换入（不打断进行中的回复）"""
+        prompt = (
+            f'【已有摘要】\n{previous or "（无）"}\n\n'
+            f'【待折叠的对话记录】\n{self._summary_transcript(turns)}'
+        )
+        try:
+            async with self._summary_semaphore:
+                text = (await self._summary_complete(prompt)).strip()
+            if not text:
+                raise RuntimeError('摘要为空')
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.summary_stats['failures'] += 1
+            self._summary_retry_at[channel_id] = time.monotonic() + 120
             print(
                 f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-                f"[AI客服] 无主投诉子区归档完成，共 {n} 个",
+                f"[AI客服] 频道 {channel_id} 生成对话摘要失败: {e}"
             )
+            return
+        finally:
+            if self._summary_tasks.get(channel_id) is asyncio.current_task():
+                self._summary_tasks.pop(channel_id, None)
+        if channel_id not in self.conversations:
+            return
+        self.summary_stats['runs'] += 1
+        self._summary_ready[channel_id] = (text, turns[-1])
+
+    def _summary_apply_ready(self, channel_id: int, conv: list) -> list:
+        """把已完成的摘要换入历史：摘要回合（含确认回合）替换掉旧摘要及被折叠的回合"""
+        ready = self._summary_ready.pop(channel_id, None)
+        if ready is None:
+            return conv
+        text, last = ready
+        head = self._summary_head_len(conv)
+        cut = next((i + 1 for i, t in enumerate(conv) if t is last), None)
+        if cut is None:
+            # 被折叠的回合已被硬上限裁掉：只更新摘要本身
+            cut = head
+        folded = cut - head
+        self.summary_stats['turns_folded'] += folded
+        print(
+            f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+            f"[AI客服] 频道 {channel_id} 已将 {folded} 个较早回合折叠进摘要"
+        )
+        return self._make_summary_turns(text) + conv[cut:]
+
+    def _summary_forget(self, channel_id: int) -> None:
+        task = self._summary_tasks.pop(channel_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+        self._summary_ready.pop(channel_id, None)
+        self._summary_retry_at.pop(channel_id, None)
+
+    async def _summary_complete(self, prompt: str) -> str:
+        """用当前 provider 发一次非流式请求生成摘要（summary.model 为空时沿用主模型）"""
+        provider = self.provider
+        return await getattr(self, provider.summary_method)(
+            provider, prompt, self.summary_model or provider.model, self.summary_max_output_tokens,
+        )
 
-    def _is_admin(self, member: discord.Member) -> bool:
-        """判断成员是否属于管理组"""
-        if member.guild_permissions.administrator:
-            return True
-        if not self.allowed_role_ids:
-            return False
-        member_role_ids = [role.id for role in member.roles]
-        return any(rid in member_role_ids for rid in self.allowed_role_ids)
+    async def _summary_complete_gemini(
+        self, provider: GeminiProvider, prompt: str, model: str, max_tokens: int,
+    ) -> str:
+        async with self.session.post(
+            f"{provider.base_url}/v1beta/models/{model}:generateContent?key={provider.api_key}",
+            json={
+                'systemInstruction': {'parts': [{'text': self._SUMMARY_INSTRUCTION}]},
+                'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+                'generationConfig': {'maxOutputTokens': max_tokens},
+            },
+            headers={'Content-Type': 'application/json'},
+            timeout=aiohttp.ClientTimeout(total=120),
+        ) as resp:
+            if resp.status != 200:
+                raise Exception(f'Gemini API 错误 ({resp.status}): {(await resp.text())[:300]}')
+            data = await resp.json()
+        parts = ((data.get('candidates') or [{}])[0].get('content') or {}).get('parts') or []
+        return ''.join(p.get('text', '') for p in parts if not p.get('thought'))
+
+    async def _summary_complete_claude(
+        self, provider: ClaudeMessagesProvider, prompt: str, model: str, max_tokens: int,
+    ) -> str:
+        if not provider.api_key:
+            raise RuntimeError(f'{provider.label} 未配置 API Key')
+        async with self.session.post(
+            f'{provider.base_url}messages',
+            json={
+                'model': model,
+                'max_tokens': max_tokens,
+                'system': self._SUMMARY_INSTRUCTION,
+                'messages': [{'role': 'user', 'content': prompt}],
+            },
+            headers={
+                'x-api-key': provider.api_key,
+                'anthropic-version': '2023-06-01',
+                'content-type': 'application/json',
+            },
+            timeout=aiohttp.ClientTimeout(total=120),
+        ) as resp:
+            if resp.status != 200:
+                raise Exception(f'Claude API 错误 ({resp.status}): {(await resp.text())[:300]}')
+            data = await resp.json()
+        return ''.join(
+            b.get('text', '') for b in data.get('content') or [] if b.get('type') == 'text'
+        )
+
+    async def _summary_complete_responses(
+        self, provider: OpenAIResponsesProvider, prompt: str, model: str, max_tokens: int,
+    ) -> str:
+        if provider.client is None:
+            raise RuntimeError('OpenAI 兼容客户端未就绪')
+        resp = await provider.client.responses.create(
+            model=model,
+            instructions=self._SUMMARY_INSTRUCTION,
+            input=prompt,
+            max_output_tokens=max_tokens,
+        )
+        return getattr(resp, 'output_text', '') or ''
+
+    async def _summary_complete_chat(
+        self, provider: ClaudeOpenAIProvider, prompt: str, model: str, max_tokens: int,
+    ) -> str:
+        if provider.client is None:
+            raise RuntimeError('OpenAI 兼容客户端未就绪')
+        resp = await provider.client.chat.completions.create(
+            model=model,
+            messages=[
+                {'role': 'system', 'content': self._SUMMARY_INSTRUCTION},
+                {'role': 'user', 'content': prompt},
+            ],
+            max_tokens=max_tokens,
+        )
+        return (resp.choices[0].message.content or '') if resp.choices else ''
 
     # ── API 请求构建 ──────────────────────────────────────────
 
-    def _build_system_instruction(self) -> dict:
+    @staticmethod
+    def _build_time_tag() -> str:
         beijing_now = datetime.now(timezone(timedelta(hours=8)))
-        time_tag = f"<time>{beijing_now.strftime('%Y-%m-%d %H:%M:%S')}</time>\n"
-        prompt = time_tag + self.system_prompt
+        return f"<time>{beijing_now.strftime('%Y-%m-%d %H:%M:%S')}</time>"
+
+    def _stable_system_prompt_text(self) -> str:
+        """不含 <time> 的系统提示词（system_prompt + tail_prompt），多轮之间逐字节不变，可作缓存前缀"""
+        prompt = self.system_prompt
         if self.tail_prompt:
             prompt += f"\n\n---\n{self.tail_prompt}"
+        return prompt
+
+    def _build_system_instruction(self) -> dict:
+        prompt = self._build_time_tag() + "\n" + self._stable_system_prompt_text()
         return {"parts": [{"text": prompt}]}
 
     def _build_tools(self) -> list:
@@ -1284,18 +2836,72 @@ class AICustomerService(commands.Cog, name="AI客服"):
             })
         return out
 
-    def _build_claude_system(self) -> str:
-        """Claude system 参数：使用与 Gemini 路径相同的 <time> 前缀 + system_prompt + tail_prompt"""
-        return self._system_prompt_text()
+    def _build_claude_system(self, provider: ClaudeMessagesProvider) -> Union[str, list[dict[str, Any]]]:
+        """
+        Claude system 参数：
+        - 未开启 prompt_cache：与 Gemini 路径相同的 <time> 前缀 + system_prompt + tail_prompt
+        - 开启 prompt_cache：仅稳定部分并打 cache_control 断点，<time> 移到最后一条 user 消息末尾
+        """
+        if not provider.prompt_cache:
+            return self._system_prompt_text()
+        return [{
+            'type': 'text',
+            'text': self._stable_system_prompt_text(),
+            'cache_control': self._claude_cache_control(provider),
+        }]
+
+    def _claude_cache_control(self, provider: ClaudeMessagesProvider) -> dict[str, Any]:
+        cc: dict[str, Any] = {'type': 'ephemeral'}
+        if provider.prompt_cache_ttl == '1h':
+            cc['ttl'] = '1h'
+        return cc
 
-    def _claude_thinking_param(self) -> Optional[dict[str, Any]]:
+    def _claude_apply_prompt_cache(
+        self,
+        provider: ClaudeMessagesProvider,
+        tools: list[dict[str, Any]],
+        messages: list[dict[str, Any]],
+    ) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        """
+        Prompt caching 断点（共 3 个，上限 4）：tools 末项、system（见 _build_claude_system）、
+        最后一条 user 消息的最后一个块；随后追加易变的 <time> 文本块，使断点之前的前缀在
+        同一工单的各轮之间保持逐字节一致。只复制被修改的消息/块，不改动转换缓存中的对象。
+        """
+        cc = self._claude_cache_control(provider)
+        if tools:
+            tools = list(tools)
+            tools[-1] = {**tools[-1], 'cache_control': cc}
+        if not messages or messages[-1].get('role') != 'user':
+            return tools, messages
+        last = messages[-1]
+        content = last.get('content')
+        if isinstance(content, str):
+            blocks: list[dict[str, Any]] = (
+                [{'type': 'text', 'text': content}] if content else []
+            )
+        else:
+            blocks = list(content or [])
+        for i in range(len(blocks) - 1, -1, -1):
+            b = blocks[i]
+            if not isinstance(b, dict):
+                continue
+            if b.get('type') == 'text' and not b.get('text'):
+                continue
+            blocks[i] = {**b, 'cache_control': cc}
+            break
+        blocks.append({'type': 'text', 'text': self._build_time_tag()})
+        messages = list(messages)
+        messages[-1] = {**last, 'content': blocks}
+        return tools, messages
+
+    def _claude_thinking_param(self, provider: ClaudeMessagesProvider) -> Optional[dict[str, Any]]:
         """
         Claude Messages thinking 参数：
         - enabled=false → None
         - type=adaptive (默认) → {"type":"adaptive"} (+可选 display)
         - type=enabled → {"type":"enabled","budget_tokens":N} (+可选 display)
         """
-        t = self.claude_messages_thinking
+        t = provider.thinking
         if not t or not t.get('enabled'):
             return None
         ttype = str(t.get('type', 'adaptive')).strip().lower()
@@ -1335,12 +2941,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
                 chunks.append({'type': 'text', 'text': p['text']})
             elif 'inlineData' in p:
                 mime = p['inlineData'].get('mimeType', 'application/octet-stream')
-                b64 = p['inlineData'].get('data', '')
                 if mime.startswith('image/'):
-                    chunks.append({
-                        'type': 'image_url',
-                        'image_url': {'url': f'data:{mime};base64,{b64}'},
-                    })
+                    chunks.append(self._openai_image_chunk(p['inlineData']))
                 else:
                     chunks.append({
                         'type': 'text',
@@ -1348,21 +2950,30 @@ class AICustomerService(commands.Cog, name="AI客服"):
                     })
         if not chunks:
             return ''
-        if len(chunks) == 1 and chunks[0]['type'] == 'text':
+        if len(chunks) == 1 and isinstance(chunks[0], dict) and chunks[0]['type'] == 'text':
             return chunks[0]['text']
         return chunks
 
-    def _gemini_contents_to_openai_messages(self, contents: list) -> list[dict[str, Any]]:
+    def _gemini_contents_to_openai_messages(
+        self, contents: list, channel_id: Optional[int] = None,
+    ) -> list[dict[str, Any]]:
         """将内存中的 Gemini contents 转为 OpenAI Chat Completions messages（含 system）。"""
         messages: list[dict[str, Any]] = []
         sys_t = self._system_prompt_text()
         if sys_t:
             messages.append({'role': 'system', 'content': sys_t})
+        messages.extend(self._convert_history('openai', contents, channel_id))
+        return messages
 
-        pending_tool_ids: list[str] = []
-        call_seq = 0
+    def _openai_messages_from(
+        self, contents: list, start: int, state: dict[str, Any], messages: list,
+    ) -> None:
+        """从 contents[start] 起增量转换为 OpenAI messages；跨回合的配对状态存于 state。"""
+        pending_tool_ids: list[str] = state.get('pending', [])
+        call_seq = state.get('seq', 0)
 
-        for bi, block in enumerate(contents):
+        for bi in range(start, len(contents)):
+            block = contents[bi]
             if not isinstance(block, dict):
                 continue
             role = block.get('role')
@@ -1443,14 +3054,10 @@ class AICustomerService(commands.Cog, name="AI客服"):
                                 mime = ip['inlineData'].get(
                                     'mimeType', 'application/octet-stream'
                                 )
-                                b64 = ip['inlineData'].get('data', '')
                                 if mime.startswith('image/'):
-                                    oai_content.append({
-                                        'type': 'image_url',
-                                        'image_url': {
-                                            'url': f'data:{mime};base64,{b64}',
-                                        },
-                                    })
+                                    oai_content.append(
+                                        self._openai_image_chunk(ip['inlineData'])
+                                    )
                             messages.append({
                                 'role': 'tool',
                                 'tool_call_id': tid,
@@ -1503,7 +3110,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
                     asst['tool_calls'] = tool_calls_oai
                 messages.append(asst)
 
-        return messages
+        state['pending'] = pending_tool_ids
+        state['seq'] = call_seq
 
     @staticmethod
     def _obj_field(obj: Any, key: str, default: Any = None) -> Any:
@@ -1531,13 +3139,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
                 chunks.append({'type': 'input_text', 'text': p['text']})
             elif 'inlineData' in p:
                 mime = p['inlineData'].get('mimeType', 'application/octet-stream')
-                b64 = p['inlineData'].get('data', '')
                 if mime.startswith('image/'):
-                    chunks.append({
-                        'type': 'input_image',
-                        'image_url': f'data:{mime};base64,{b64}',
-                        'detail': 'auto',
-                    })
+                    chunks.append(self._responses_image_chunk(p['inlineData']))
                 else:
                     chunks.append({
                         'type': 'input_text',
@@ -1545,7 +3148,11 @@ class AICustomerService(commands.Cog, name="AI客服"):
                     })
         if not chunks:
             return ''
-        if len(chunks) == 1 and chunks[0]['type'] == 'input_text':
+        if (
+            len(chunks) == 1
+            and isinstance(chunks[0], dict)
+            and chunks[0]['type'] == 'input_text'
+        ):
             return chunks[0]['text']
         return chunks
 
@@ -1571,28 +3178,29 @@ class AICustomerService(commands.Cog, name="AI客服"):
             out.append({'type': 'input_text', 'text': inline_content})
         return out
 
-    def _openai_responses_model_needs_reasoning_items(self) -> bool:
-        model = str(self.openai_responses_model or '').lower()
-        return (
-            bool(self.openai_responses_reasoning)
-            or model.startswith('gpt-5')
-            or model.startswith(('o1', 'o3', 'o4'))
-            or 'reasoning' in model
-        )
-
     def _gemini_contents_to_responses_input(
         self,
         contents: list,
+        channel_id: Optional[int] = None,
+        reasoning_items: bool = False,
     ) -> list[dict[str, Any]]:
         """
         将内存中的 Gemini contents 转为 Responses API input items。
         Responses 的工具调用/结果是顶层 input item，因此这里保留 call_id 以支持多轮工具循环。
+        reasoning_items：目标是 reasoning 模型（回放 function_call 必须带 reasoning item）。
         """
-        items: list[dict[str, Any]] = []
-        pending_call_ids: list[str] = []
-        call_seq = 0
+        return self._convert_history(
+            'responses', contents, channel_id, variant='reasoning' if reasoning_items else '',
+        )
+
+    def _responses_input_from(
+        self, contents: list, start: int, state: dict[str, Any], items: list,
+    ) -> None:
+        pending_call_ids: list[str] = state.get('pending', [])
+        call_seq = state.get('seq', 0)
 
-        for bi, block in enumerate(contents):
+        for bi in range(start, len(contents)):
+            block = contents[bi]
             if not isinstance(block, dict):
                 continue
             role = block.get('role')
@@ -1702,7 +3310,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
                         items.append({'role': 'assistant', 'content': merged_text})
                     if reasoning_items:
                         items.extend(reasoning_items)
-                    if not reasoning_items and self._openai_responses_model_needs_reasoning_items():
+                    if not reasoning_items and state.get('variant') == 'reasoning':
                         # 旧历史里可能已有 function_call，但当时还没保存 reasoning item。
                         # reasoning 模型会拒绝这种残缺回放；降级成普通 assistant 文本，
                         # 后续 functionResponse 也会按普通 user 上下文写入。
@@ -1725,7 +3333,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
                     if merged_text:
                         items.append({'role': 'assistant', 'content': merged_text})
 
-        return items
+        state['pending'] = pending_call_ids
+        state['seq'] = call_seq
 
     def _gemini_user_parts_to_claude_content(
         self, parts: list,
@@ -1750,12 +3359,12 @@ class AICustomerService(commands.Cog, name="AI客服"):
                     })
         if not chunks:
             return ''
-        if len(chunks) == 1 and chunks[0]['type'] == 'text':
+        if len(chunks) == 1 and isinstance(chunks[0], dict) and chunks[0]['type'] == 'text':
             return chunks[0]['text']
         return chunks
 
     def _gemini_contents_to_claude_messages(
-        self, contents: list,
+        self, contents: list, channel_id: Optional[int] = None,
     ) -> list[dict[str, Any]]:
         """
         将内存中的 Gemini contents 转换为 Claude Messages API 的 messages 列表。
@@ -1767,11 +3376,16 @@ class AICustomerService(commands.Cog, name="AI客服"):
         - 用户 functionResponse 块转 tool_result；fetch_messages 后续紧跟的 inlineData
           图片合并到对应 tool_result.content 数组里。
         """
-        messages: list[dict[str, Any]] = []
-        pending_tool_use_ids: list[str] = []
-        synth_seq = 0
+        return self._convert_history('claude', contents, channel_id)
+
+    def _claude_messages_from(
+        self, contents: list, start: int, state: dict[str, Any], messages: list,
+    ) -> None:
+        pending_tool_use_ids: list[str] = state.get('pending', [])
+        synth_seq = state.get('seq', 0)
 
-        for bi, block in enumerate(contents):
+        for bi in range(start, len(contents)):
+            block = contents[bi]
             if not isinstance(block, dict):
                 continue
             role = block.get('role')
@@ -1927,91 +3541,252 @@ class AICustomerService(commands.Cog, name="AI客服"):
                     rebuilt = [{'type': 'text', 'text': ''}]
                 messages.append({'role': 'assistant', 'content': rebuilt})
 
-        return messages
+        state['pending'] = pending_tool_use_ids
+        state['seq'] = synth_seq
+
+    # ── 历史转换缓存 ──────────────────────────────────────────
+
+    def _convert_history(
+        self, kind: str, contents: list, channel_id: Optional[int], variant: str = '',
+    ) -> list[dict[str, Any]]:
+        """
+        按 provider 把 Gemini 形态历史转换为请求消息，按频道做只追加的记忆化：
+        每个回合只转换一次，后续轮次只转换新追加的回合。
+        历史被裁剪/回滚（首尾回合对象变化）时自动整体重建；返回列表可安全修改。
+        variant 区分同一格式下依赖后端设置的不同转换结果（记入转换状态并单独缓存）。
+        """
+        step = {
+            'openai': self._openai_messages_from,
+            'responses': self._responses_input_from,
+            'claude': self._claude_messages_from,
+        }[kind]
+        if channel_id is None:
+            out: list[dict[str, Any]] = []
+            step(contents, 0, {'variant': variant}, out)
+            return out
+
+        per_channel = self._conversion_cache.setdefault(channel_id, {})
+        key = f'{kind}:{variant}' if variant else kind
+        entry = per_channel.get(key)
+        n = entry['n'] if entry else 0
+        if entry is not None and (
+            n > len(contents)
+            or (n and (contents[0] is not entry['first'] or contents[n - 1] is not entry['last']))
+        ):
+            entry = None
+        if entry is None:
+            entry = {'n': 0, 'out': [], 'state': {'variant': variant}, 'first': None, 'last': None}
+            per_channel[key] = entry
+            self.conversion_stats['rebuilds'] += 1
+        start = entry['n']
+        step(contents, start, entry['state'], entry['out'])
+        self.conversion_stats['turns_converted'] += len(contents) - start
+        self.conversion_stats['turns_reused'] += start
+        entry['n'] = len(contents)
+        entry['first'] = contents[0] if contents else None
+        entry['last'] = contents[-1] if contents else None
+        return list(entry['out'])
+
+    def _invalidate_conversion_cache(self, channel_id: Optional[int] = None) -> None:
+        """历史被裁剪、回滚或 provider 变化时丢弃转换缓存（channel_id=None 表示全部）"""
+        if channel_id is None:
+            self._conversion_cache.clear()
+            self._image_phash_index.clear()
+        else:
+            self._conversion_cache.pop(channel_id, None)
+            # 对话被替换/裁剪：图片哈希索引随之按新对话重建
+            self._image_phash_index.pop(channel_id, None)
 
     # Claude Messages API caps images at 8000x8000 px (2000x2000 if >20 imgs in
     # one request). We clamp at 7680 to stay safely below the hard limit.
     _CLAUDE_IMAGE_MAX_DIM = 7680
+    # Claude 单次请求超过 20 张图时，每张图长边上限降为 2000
+    _CLAUDE_MANY_IMAGES_MAX_DIM = 2000
+    _CLAUDE_MANY_IMAGES_THRESHOLD = 20
 
     @staticmethod
     def _resize_image_for_claude_sync(
         data: bytes, content_type: str, max_dim: int = 7680,
     ) -> tuple[bytes, str]:
-        if not content_type.startswith('image/') or not data:
-            return data, content_type
-        try:
-            from PIL import Image
-            import io
+        return resize_image(data, content_type, max_dim)
 
-            img = Image.open(io.BytesIO(data))
+    def _start_image_pool(self) -> None:
+        """
+        创建图片进程池（images.process_workers 为 0 时不创建）。子进程由 forkserver（不支持时 spawn）启动，
+        不直接 fork 带有事件循环、后台线程与 blob 内存缓存的 bot 进程
+        """
+        if self.image_process_workers <= 0 or self._image_pool is not None:
+            return
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._image_pool = ProcessPoolExecutor(
+            max_workers=self.image_process_workers,
+            mp_context=multiprocessing.get_context(method),
+        )
+        self._image_pool_workers = self.image_process_workers
+
+    def _shutdown_image_pool(self) -> None:
+        if self._image_pool is not None:
+            self._image_pool.shutdown(wait=False, cancel_futures=True)
+            self._image_pool = None
+        self._image_pool_workers = 0
+
+    async def _run_image_job(self, fn, *args):
+        """在图片进程池中执行（images.process_workers 为 0 或进程池损坏时退回线程）"""
+        if self.image_process_workers > 0:
+            # 进程池损坏后在下一次任务时重建
+            self._start_image_pool()
             try:
-                w, h = img.size
-            except Exception:
-                return data, content_type
-            if w <= max_dim and h <= max_dim:
-                return data, content_type
-
-            scale = max_dim / float(max(w, h))
-            new_w = max(1, int(w * scale))
-            new_h = max(1, int(h * scale))
-            img.load()
-            resized = img.resize((new_w, new_h), Image.LANCZOS)
-
-            mime_lower = content_type.lower()
-            if 'webp' in mime_lower:
-                out_fmt, out_mime = 'WEBP', 'image/webp'
-            elif 'png' in mime_lower:
-                out_fmt, out_mime = 'PNG', 'image/png'
-            elif 'gif' in mime_lower:
-                out_fmt, out_mime = 'PNG', 'image/png'
-                if resized.mode == 'P':
-                    resized = resized.convert('RGBA')
-            else:
-                out_fmt, out_mime = 'JPEG', 'image/jpeg'
-                if resized.mode in ('RGBA', 'LA', 'P'):
-                    resized = resized.convert('RGB')
-
-            buf = io.BytesIO()
-            save_kwargs: dict[str, Any] = {}
-            if out_fmt == 'JPEG':
-                save_kwargs['quality'] = 92
-                save_kwargs['optimize'] = True
-            elif out_fmt == 'WEBP':
-                save_kwargs['quality'] = 92
-            resized.save(buf, format=out_fmt, **save_kwargs)
-            return buf.getvalue(), out_mime
-        except Exception:
-            return data, content_type
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._image_pool, fn, *args,
+                )
+            except BrokenProcessPool:
+                self._shutdown_image_pool()
+        return await asyncio.to_thread(fn, *args)
 
-    async def _maybe_resize_image_for_claude(
+    async def _prepare_image(
         self, data: bytes, content_type: str,
-    ) -> tuple[bytes, str]:
+    ) -> tuple[bytes, str, dict[str, Any]]:
+        """
+        入库时一次性规格化图片：主图限制在 Claude 像素上限内，另存多图请求用的 2000px 变体，
+        开启 images.history 时再存各档历史降级图（变体记录字节数，请求时无需读盘或缩放）；
+        开启 images.transcode 时主图与变体再按字节/像素预算转码；开启 images.dedup 时顺带算 dHash。
+        文件头探测到的尺寸已满足所有上限（且在转码预算内）时不缩放；
+        返回 (主图字节, mime, 附加到 inlineData 的字段)。
+        """
+        variant_dims = self._image_variant_dims()
+        size = probe_image_size(data)
+        transcode = self.image_transcode
+        if (
+            size is not None
+            and max(size) <= min(variant_dims)
+            and (
+                transcode is None
+                or (len(data) <= transcode['max_bytes'] and size[0] * size[1] <= transcode['max_pixels'])
+            )
+        ):
+            extra = {'_w': size[0], '_h': size[1]}
+            if self.image_dedup_enabled:
+                try:
+                    phash = await self._run_image_job(image_dhash, data)
+                except Exception:
+                    phash = None
+                if phash:
+                    extra['_phash'] = phash
+            return data, content_type, extra
+        try:
+            result = await self._run_image_job(
+                normalize_image,
+                data,
+                content_type,
+                self._CLAUDE_IMAGE_MAX_DIM,
+                variant_dims,
+                transcode,
+            )
+        except Exception:
+            return data, content_type, {}
+        extra: dict[str, Any] = {}
+        if result['size']:
+            extra['_w'], extra['_h'] = result['size']
+        variants: dict[str, list[Any]] = {}
+        for dim, variant in result['variants'].items():
+            if variant is not None:
+                digest = await asyncio.to_thread(self.blob_store.put, variant[0])
+                variants[str(dim)] = [digest, variant[1], len(variant[0])]
+        if variants:
+            extra['_variants'] = variants
+        if self.image_dedup_enabled and result.get('dhash'):
+            extra['_phash'] = result['dhash']
+        return result['data'], result['mime'], extra
+
+    def _image_variant_dims(self) -> tuple[int, ...]:
+        """入库时生成的缩放变体长边上限：多图请求用的 2000px，开启历史降级时加上各档 dims"""
+        dims = {self._CLAUDE_MANY_IMAGES_MAX_DIM}
+        if self.image_history_enabled:
+            dims.update(d for d in self.image_history_dims if d < self._CLAUDE_IMAGE_MAX_DIM)
+        return tuple(sorted(dims, reverse=True))
+
+    def _channel_phash_index(self, channel_id: int) -> list[tuple[Optional[str], str]]:
+        index = self._image_phash_index.get(channel_id)
+        if index is None:
+            index = []
+            seen: set[str] = set()
+            for turn in self.conversations.get(channel_id) or []:
+                for p in turn.get('parts') or [] if isinstance(turn, dict) else []:
+                    inline = p.get('inlineData') if isinstance(p, dict) else None
+                    if not isinstance(inline, dict) or inline.get('_dup_of'):
+                        continue
+                    digest = inline.get('_blob')
+                    if digest and digest not in seen:
+                        seen.add(digest)
+                        index.append((inline.get('_phash'), digest))
+            self._image_phash_index[channel_id] = index
+        return index
+
+    async def _images_match(self, digest_a: str, digest_b: str) -> bool:
+        """在图片进程池中逐块比较两张已入库图片的像素；读不到 blob 时视为不同"""
         try:
-            return await asyncio.to_thread(
-                self._resize_image_for_claude_sync,
-                data, content_type, self._CLAUDE_IMAGE_MAX_DIM,
+            a, b = await asyncio.gather(
+                asyncio.to_thread(self.blob_store.get, digest_a),
+                asyncio.to_thread(self.blob_store.get, digest_b),
             )
+            return bool(await self._run_image_job(images_match, a, b))
         except Exception:
-            return data, content_type
+            return False
+
+    async def _dedup_image_parts(self, channel_id: Optional[int], parts: list) -> None:
+        """
+        入库时找出新图片在频道内已有的同一张图：blob 摘要相同直接视为同一张；
+        dHash 汉明距离 ≤ max_distance 的只作为候选，再由 images_match 逐块比较像素确认后
+        记入 _dup_of（规范图片的 blob 摘要）。_materialize_request 中同一张图只发送第一张。
+        同一频道并发入库时可能漏掉彼此之间的重复（两张都保留），不会误合并。
+        """
+        if channel_id is None or not self.image_dedup_enabled:
+            return
+        index = self._channel_phash_index(channel_id)
+        for p in parts:
+            inline = p.get('inlineData') if isinstance(p, dict) else None
+            digest = inline.get('_blob') if isinstance(inline, dict) else None
+            if not digest or not str(inline.get('mimeType', '')).startswith('image/'):
+                continue
+            if any(d == digest for _, d in index):
+                continue
+            phash = inline.get('_phash')
+            if phash and not 8 <= bin(int(phash, 16)).count('1') <= 56:
+                # 纯色/几乎无细节的图片哈希区分度太低，只按字节完全相同去重
+                phash = None
+            match = None
+            if phash:
+                for h, d in index:
+                    if (
+                        h
+                        and dhash_distance(h, phash) <= self.image_dedup_max_distance
+                        and await self._images_match(d, digest)
+                    ):
+                        match = d
+                        break
+            if match is None:
+                index.append((phash, digest))
+            else:
+                inline['_dup_of'] = match
 
     def _gemini_inline_to_claude_image_block(
         self, inline_data: dict,
-    ) -> Optional[dict[str, Any]]:
+    ) -> Union[dict[str, Any], InlineRef, None]:
         """Build a Claude image block from a Gemini inlineData dict, downscaling
         the base64 payload if it exceeds Claude's pixel cap. Returns None for
-        non-image inlineData."""
+        non-image inlineData. Blob-backed images yield an InlineRef that is
+        only turned into bytes by _materialize_request."""
         mime = inline_data.get('mimeType', 'application/octet-stream')
+        if not mime.startswith('image/'):
+            return None
+        ref = self._inline_to_ref('claude', inline_data)
+        if ref is not None:
+            return ref
         b64 = inline_data.get('data', '')
-        if not mime.startswith('image/') or not b64:
+        if not b64:
             return None
         try:
-            raw = base64.b64decode(b64)
-            new_raw, new_mime = self._resize_image_for_claude_sync(
-                raw, mime, self._CLAUDE_IMAGE_MAX_DIM,
-            )
-            if new_raw is not raw:
-                b64 = base64.b64encode(new_raw).decode('ascii')
-                mime = new_mime
+            return self._claude_image_block_from_bytes(base64.b64decode(b64), mime)
         except Exception:
             pass
         return {
@@ -2023,17 +3798,530 @@ class AICustomerService(commands.Cog, name="AI客服"):
             },
         }
 
-    async def _download_attachment(self, url: str) -> tuple[bytes, str]:
+    def _claude_image_block_from_bytes(self, raw: bytes, mime: str) -> dict[str, Any]:
+        new_raw, new_mime = self._resize_image_for_claude_sync(
+            raw, mime, self._CLAUDE_IMAGE_MAX_DIM,
+        )
+        return {
+            'type': 'image',
+            'source': {
+                'type': 'base64',
+                'media_type': new_mime,
+                'data': base64.b64encode(new_raw).decode('ascii'),
+            },
+        }
+
+    # ── 附件 blob 引用 ────────────────────────────────────────
+
+    @staticmethod
+    def _inline_to_ref(kind: str, inline_data: dict) -> Optional[InlineRef]:
+        """blob 形式的 inlineData → InlineRef 占位；旧式内嵌 base64 返回 None"""
+        digest = inline_data.get('_blob')
+        if not digest:
+            return None
+        w, h = inline_data.get('_w'), inline_data.get('_h')
+        return InlineRef(
+            kind,
+            digest,
+            inline_data.get('mimeType', 'application/octet-stream'),
+            inline_data.get('_variants'),
+            inline_data.get('_dup_of'),
+            inline_data.get('_size'),
+            (w, h) if w and h else None,
+        )
+
+    def _openai_image_chunk(self, inline_data: dict) -> Union[dict[str, Any], InlineRef]:
+        ref = self._inline_to_ref('openai', inline_data)
+        if ref is not None:
+            return ref
+        mime = inline_data.get('mimeType', 'application/octet-stream')
+        b64 = inline_data.get('data', '')
+        return {
+            'type': 'image_url',
+            'image_url': {'url': f'data:{mime};base64,{b64}'},
+        }
+
+    def _responses_image_chunk(self, inline_data: dict) -> Union[dict[str, Any], InlineRef]:
+        ref = self._inline_to_ref('responses', inline_data)
+        if ref is not None:
+            return ref
+        mime = inline_data.get('mimeType', 'application/octet-stream')
+        b64 = inline_data.get('data', '')
+        return {
+            'type': 'input_image',
+            'image_url': f'data:{mime};base64,{b64}',
+            'detail': 'auto',
+        }
+
+    def _gemini_request_contents(self, history: list) -> list[dict[str, Any]]:
+        """
+        Gemini 请求体 contents：blob 引用换成 InlineRef 占位，
+        并去掉仅供本地使用的 `_` 前缀字段（_claude_blocks、_responses_call_id 等）。
+        """
+        out: list[dict[str, Any]] = []
+        for turn in history:
+            if not isinstance(turn, dict):
+                continue
+            parts: list[Any] = []
+            for p in turn.get('parts') or []:
+                if not isinstance(p, dict):
+                    continue
+                inline = p.get('inlineData')
+                ref = (
+                    self._inline_to_ref('gemini', inline)
+                    if isinstance(inline, dict)
+                    else None
+                )
+                if ref is not None:
+                    parts.append(ref)
+                else:
+                    parts.append({k: v for k, v in p.items() if not k.startswith('_')})
+            new_turn = {
+                k: v for k, v in turn.items() if not k.startswith('_') and k != 'parts'
+            }
+            new_turn['parts'] = parts
+            out.append(new_turn)
+        return out
+
+    def _render_inline_ref(self, ref: InlineRef, many_images: bool = False) -> dict[str, Any]:
+        """
+        InlineRef → 各 provider 的真实附件块（此时才读取 blob 字节）。
+        many_images 时 Claude 系请求改用入库时生成的 2000px 变体。
+        """
+        claude_family = ref.kind == 'claude' or (
+            ref.kind == 'openai' and self.llm_provider == 'claude_openai'
+        )
+        if claude_family and many_images and ref.variants:
+            small = ref.variants.get(str(self._CLAUDE_MANY_IMAGES_MAX_DIM))
+            if small:
+                ref = InlineRef(ref.kind, small[0], small[1])
         try:
-            async with self.session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as resp:
-                if resp.status == 200:
-                    content_type = resp.headers.get('Content-Type', 'application/octet-stream')
-                    data = await resp.read()
-                    return data, content_type
-        except Exception:
-            pass
+            raw = self.blob_store.get(ref.digest)
+        except KeyError:
+            note = f'[附件已失效: {ref.mime}]'
+            if ref.kind == 'gemini':
+                return {'text': note}
+            if ref.kind == 'responses':
+                return {'type': 'input_text', 'text': note}
+            return {'type': 'text', 'text': note}
+        mime = ref.mime
+        if ref.kind == 'claude' and ref.variants is None:
+            # 旧数据没有入库变体：按需缩放并记住结果（新入库的图片已在上限内）
+            variant = self._claude_image_variants.get(ref.digest)
+            if variant is None:
+                new_raw, new_mime = self._resize_image_for_claude_sync(
+                    raw, mime, self._CLAUDE_IMAGE_MAX_DIM,
+                )
+                variant = (
+                    (ref.digest, mime)
+                    if new_raw is raw
+                    else (self.blob_store.put(new_raw), new_mime)
+                )
+                self._claude_image_variants[ref.digest] = variant
+            if variant[0] != ref.digest:
+                try:
+                    raw = self.blob_store.get(variant[0])
+                    mime = variant[1]
+                except KeyError:
+                    self._claude_image_variants.pop(ref.digest, None)
+        b64 = base64.b64encode(raw).decode('ascii')
+        if ref.kind == 'gemini':
+            return {'inlineData': {'mimeType': mime, 'data': b64}}
+        if ref.kind == 'openai':
+            return {
+                'type': 'image_url',
+                'image_url': {'url': f'data:{mime};base64,{b64}'},
+            }
+        if ref.kind == 'responses':
+            return {
+                'type': 'input_image',
+                'image_url': f'data:{mime};base64,{b64}',
+                'detail': 'auto',
+            }
+        return {
+            'type': 'image',
+            'source': {'type': 'base64', 'media_type': mime, 'data': b64},
+        }
+
+    def _materialize_request(
+        self,
+        obj: Any,
+        newer_turns: int = 0,
+        channel_id: Optional[int] = None,
+        image_seen: Optional[dict[str, Any]] = None,
+    ) -> Any:
+        """
+        序列化前把请求结构中的 InlineRef 换成真实附件块（返回新容器，不修改入参）。
+        newer_turns：obj 之后还有多少条用户输入回合（只物化历史前缀时用于计算图片的回合龄）。
+        channel_id：给出时把重复图片的省略量计入该频道的统计。
+        image_seen：跨请求片段的去重状态（Gemini 缓存前缀 + 后续内容），会被原地更新。
+        """
+        refs = list(self._iter_inline_refs_with_age(obj, newer_turns))
+        n_images = sum(1 for _, ref in refs if ref.mime.startswith('image/'))
+        many_images = n_images > self._CLAUDE_MANY_IMAGES_THRESHOLD
+        plan = self._image_history_plan(refs, many_images)
+        if self.image_dedup_enabled and (n_images > 1 or image_seen):
+            plan = self._image_dedup_plan(refs, plan, channel_id, image_seen)
+        return self._materialize(obj, many_images, iter(plan) if plan is not None else None)
+
+    @staticmethod
+    def _copy_image_seen(state: Optional[dict[str, Any]]) -> dict[str, Any]:
+        state = state or {}
+        return {'first': dict(state.get('first') or {}), 'sent': state.get('sent', 0)}
+
+    def _image_dedup_plan(
+        self,
+        refs: list[tuple[int, InlineRef]],
+        plan: Optional[list],
+        channel_id: Optional[int],
+        image_seen: Optional[dict[str, Any]] = None,
+    ) -> list:
+        """
+        同一张图（blob 摘要相同，或入库时确认为近似重复的 _dup_of 相同）只保留请求中第一张实际发送的，
+        后续出现替换为「与第 N 张图片相同」的文字引用（N 为本次请求中发送的图片序号）。
+        较早的回合不受影响，前缀缓存保持稳定。
+        """
+        if plan is None:
+            plan = [ref for _, ref in refs]
+        if image_seen is None:
+            image_seen = {}
+        first_seen: dict[str, int] = image_seen.setdefault('first', {})
+        n_sent = image_seen.get('sent', 0)
+        saved_by_key: dict[str, list[int]] = {}  # 图片 -> [省略张数, 字节, token]
+        family = provider_family(self.llm_provider)
+        for idx, (_, ref) in enumerate(refs):
+            planned = plan[idx]
+            if not ref.mime.startswith('image/') or planned is None:
+                continue
+            key = ref.dup_of or ref.digest
+            number = first_seen.get(key)
+            if number is None:
+                n_sent += 1
+                first_seen[key] = n_sent
+                continue
+            plan[idx] = number
+            if channel_id is not None:
+                # 入库时记录的字节数与尺寸，不读盘、不解码
+                dims = planned.dims or (None, None)
+                saved = saved_by_key.setdefault(key, [0, 0, 0])
+                saved[0] += 1
+                saved[1] += planned.size or 0
+                saved[2] += estimate_image_tokens(family, dims[0], dims[1])
+        image_seen['sent'] = n_sent
+        tally = _IMAGE_REPLY_TALLY.get()
+        if saved_by_key and tally is not None:
+            # 同一回复的多次请求（工具往返、对冲）省略的是同一批图片：每张图取单次请求中的最大值
+            dedup = tally['dedup']
+            for key, entry in saved_by_key.items():
+                if entry[0] > dedup.get(key, (0,))[0]:
+                    dedup[key] = entry
+        return plan
+
+    def _commit_image_tally(self, channel_id: int, tally: dict[str, dict]) -> None:
+        """回复完成：把本次回复的图片统计计入频道/全局统计"""
+        for outcome in tally['history'].values():
+            self.image_history_stats[outcome] += 1
+        if tally['dedup']:
+            stats = self.image_dedup_stats.setdefault(
+                channel_id, {'replies': 0, 'images': 0, 'bytes': 0, 'tokens': 0},
+            )
+            stats['replies'] += 1
+            for images, nbytes, tokens in tally['dedup'].values():
+                stats['images'] += images
+                stats['bytes'] += nbytes
+                stats['tokens'] += tokens
+
+    def _iter_inline_refs_with_age(self, obj: Any, newer_turns: int):
+        """
+        按 _materialize 的遍历顺序产出 (回合龄, InlineRef)；回合 = 最外层列表的元素，
+        回合龄 = 其后还有多少条用户输入回合（工具结果与模型回合不计），同一轮的工具往返不会让历史图片变老。
+        """
+        if isinstance(obj, InlineRef):
+            yield newer_turns, obj
+        elif isinstance(obj, list):
+            ages: list[int] = []
+            age = newer_turns
+            for x in reversed(obj):
+                ages.append(age)
+                if self._is_user_input_turn(x):
+                    age += 1
+            for x, age in zip(obj, reversed(ages)):
+                for ref in self._iter_inline_refs(x):
+                    yield age, ref
+        elif isinstance(obj, dict):
+            for v in obj.values():
+                yield from self._iter_inline_refs_with_age(v, newer_turns)
+
+    @staticmethod
+    def _is_user_input_turn(turn: Any) -> bool:
+        """Gemini / OpenAI / Responses / Claude 形态的回合是否为用户输入（而非工具结果）"""
+        if not isinstance(turn, dict) or turn.get('role') != 'user':
+            return False
+        parts = turn.get('parts')
+        if isinstance(parts, list):
+            return not any(isinstance(p, dict) and 'functionResponse' in p for p in parts)
+        content = turn.get('content')
+        if isinstance(content, list):
+            return not any(isinstance(b, dict) and b.get('type') == 'tool_result' for b in content)
+        return True
+
+    def _image_history_active(self) -> bool:
+        """
+        历史图片降级会改写已经发送过的请求前缀：任一在用实例开启 prompt_cache，
+        或 Gemini 实例使用上下文缓存时不降级，避免前缀缓存失效
+        """
+        if not self.image_history_enabled:
+            return False
+        for provider in self._active_providers():
+            if getattr(provider, 'prompt_cache', False):
+                return False
+            if provider.kind == 'gemini' and self.gemini_context_cache_enabled:
+                return False
+        return True
+
+    def _image_history_stage(self, age: int) -> int:
+        """回合龄 -> 降级档位：0 为原图，1..len(dims) 对应 dims 各档，再往后为文字占位"""
+        if age < self.image_history_full_turns:
+            return 0
+        return 1 + (age - self.image_history_full_turns) // self.image_history_step_turns
+
+    def _image_history_plan(
+        self, refs: list[tuple[int, InlineRef]], many_images: bool,
+    ) -> Optional[list[Optional[InlineRef]]]:
+        """
+        历史图片降级计划（与 refs 一一对应；非图片原样保留，None 表示替换为文字占位）：
+        最近 full_turns 个用户回合内的图片保持原图，之后每 step_turns 个用户回合降一档长边上限，
+        降完所有档位后只保留文字占位（对应的 <image_link> 仍在用户消息文本里）。
+        从最新的图片往前累计字节，超出 max_total_mb 时旧图继续降档或改为占位，
+        保证单次请求的图片总字节有上限（工具往返新增图片时旧图可能因此降档）。
+        只使用入库时生成的降级图与记录的字节数，不读盘、不解码。
+        """
+        if not self._image_history_active():
+            return None
+        plan: list[Optional[InlineRef]] = [ref for _, ref in refs]
+        tally = _IMAGE_REPLY_TALLY.get()
+        budget = self.image_history_max_bytes
+        used = 0
+        dims = self.image_history_dims
+        for idx in range(len(refs) - 1, -1, -1):
+            age, ref = refs[idx]
+            if not ref.mime.startswith('image/'):
+                continue
+            stage = self._image_history_stage(age)
+            chosen: Optional[InlineRef] = None
+            while stage <= len(dims):
+                # 没有该档降级图（开启前入库的旧图片）时沿用原图
+                candidate = ref if stage == 0 else self._aged_image_ref(ref, dims[stage - 1]) or ref
+                size = self._image_ref_size(candidate, many_images)
+                if budget <= 0 or used + size <= budget:
+                    chosen = candidate
+                    used += size
+                    break
+                stage += 1
+            if chosen is not ref and tally is not None:
+                # 同一回复内多次物化（工具往返、对冲、缓存前缀）同一张图只计一次，取最后的结果
+                tally['history'][ref.digest] = 'downscaled' if chosen is not None else 'stubbed'
+            plan[idx] = chosen
+        return plan
+
+    def _image_ref_size(self, ref: InlineRef, many_images: bool) -> int:
+        """请求中该图片的字节数（入库时记录；旧数据未记录时按 0 计）"""
+        if many_images and ref.variants and ref.kind in ('claude', 'openai'):
+            small = ref.variants.get(str(self._CLAUDE_MANY_IMAGES_MAX_DIM))
+            if small:
+                return small[2] if len(small) > 2 else 0
+        return ref.size or 0
+
+    def _aged_image_ref(self, ref: InlineRef, dim: int) -> Optional[InlineRef]:
+        """
+        长边不超过 dim 的降级图片引用：原图已在上限内时就是原图，否则取入库时生成的变体；
+        没有该档变体（旧数据或生成失败）时返回 None
+        """
+        if ref.edge is not None and ref.edge <= dim:
+            return ref
+        variant = (ref.variants or {}).get(str(dim))
+        if not variant:
+            return None
+        dims = None
+        if ref.dims:
+            scale = dim / float(ref.edge)
+            dims = (max(1, round(ref.dims[0] * scale)), max(1, round(ref.dims[1] * scale)))
+        # variants 置为空表：不再走 Claude 旧数据缩放与多图变体替换
+        return InlineRef(
+            ref.kind, variant[0], variant[1], {},
+            size=variant[2] if len(variant) > 2 else None,
+            dims=dims,
+        )
+
+    def _image_duplicate_block(self, ref: InlineRef, number: int) -> dict[str, Any]:
+        note = f'[图片：与本对话中第 {number} 张图片相同，已省略重复内容]'
+        if ref.kind == 'gemini':
+            return {'text': note}
+        if ref.kind == 'responses':
+            return {'type': 'input_text', 'text': note}
+        return {'type': 'text', 'text': note}
+
+    def _image_stub_block(self, ref: InlineRef) -> dict[str, Any]:
+        note = '[较早的图片已省略以控制请求大小；如需查看请使用对应的 image_link]'
+        if ref.kind == 'gemini':
+            return {'text': note}
+        if ref.kind == 'responses':
+            return {'type': 'input_text', 'text': note}
+        return {'type': 'text', 'text': note}
+
+    def _iter_inline_refs(self, obj: Any):
+        if isinstance(obj, InlineRef):
+            yield obj
+        elif isinstance(obj, list):
+            for x in obj:
+                yield from self._iter_inline_refs(x)
+        elif isinstance(obj, dict):
+            for v in obj.values():
+                yield from self._iter_inline_refs(v)
+
+    def _materialize(self, obj: Any, many_images: bool, plan=None) -> Any:
+        if isinstance(obj, InlineRef):
+            if plan is not None:
+                planned = next(plan)
+                if planned is None:
+                    return self._image_stub_block(obj)
+                if isinstance(planned, int):
+                    return self._image_duplicate_block(obj, planned)
+                obj = planned
+            return self._render_inline_ref(obj, many_images)
+        if isinstance(obj, list):
+            return [self._materialize(x, many_images, plan) for x in obj]
+        if isinstance(obj, dict):
+            return {k: self._materialize(v, many_images, plan) for k, v in obj.items()}
+        return obj
+
+    def _channel_download_semaphore(self, channel_id: Optional[int]):
+        if channel_id is None:
+            return contextlib.nullcontext()
+        sem = self._channel_download_semaphores.get(channel_id)
+        if sem is None:
+            sem = asyncio.Semaphore(self.attachment_max_concurrent_per_channel)
+            self._channel_download_semaphores[channel_id] = sem
+        return sem
+
+    async def _download_attachment(
+        self,
+        url: str,
+        *,
+        channel_id: Optional[int] = None,
+        attachment_id: Optional[int] = None,
+        size: Optional[int] = None,
+    ) -> tuple[bytes, str]:
+        """
+        流式下载附件：响应头 Content-Length 已超过 max_attachment_size 时不读正文，
+        读取中累计超限立即中止（抛出 _AttachmentTooLarge）。其他失败返回空字节。
+        受全局与单频道并发上限约束，单文件超时 attachments.download_timeout_seconds。
+        Discord 附件按 ID 走 attachment_cache，命中时不再下载。
+        """
+        cache_key = (
+            self.attachment_cache.key_for(url, attachment_id)
+            if self.attachment_cache_max_bytes > 0
+            else None
+        )
+        if cache_key is None:
+            return await self._download_attachment_uncached(url, channel_id)
+        hit = await asyncio.to_thread(self.attachment_cache.lookup, cache_key, size)
+        if hit is not None:
+            return hit
+        # 同一附件的并发请求（如入库与 fetch_messages 同时进行）共用一次下载
+        task = self._attachment_downloads.get(cache_key)
+        if task is None:
+            task = asyncio.create_task(self._download_attachment_uncached(url, channel_id))
+            self._attachment_downloads[cache_key] = task
+            task.add_done_callback(lambda _t: self._attachment_downloads.pop(cache_key, None))
+        data, content_type = await asyncio.shield(task)
+        if data:
+            await asyncio.to_thread(self.attachment_cache.store, cache_key, data, content_type)
+        return data, content_type
+
+    async def _download_attachment_uncached(
+        self, url: str, channel_id: Optional[int],
+    ) -> tuple[bytes, str]:
+        limit = self.max_attachment_size
+        async with self._channel_download_semaphore(channel_id), self._download_semaphore:
+            try:
+                async with self.session.get(
+                    url, timeout=aiohttp.ClientTimeout(total=self.attachment_download_timeout),
+                ) as resp:
+                    if resp.status == 200:
+                        content_type = resp.headers.get('Content-Type', 'application/octet-stream')
+                        if resp.content_length is not None and resp.content_length > limit:
+                            raise _AttachmentTooLarge(resp.content_length)
+                        buf = bytearray()
+                        async for chunk in resp.content.iter_chunked(64 * 1024):
+                            buf.extend(chunk)
+                            if len(buf) > limit:
+                                raise _AttachmentTooLarge(len(buf))
+                        return bytes(buf), content_type
+            except _AttachmentTooLarge:
+                raise
+            except Exception:
+                pass
         return b'', 'application/octet-stream'
 
+    async def _ingest_attachment(
+        self, attachment: discord.Attachment, channel_id: Optional[int],
+    ) -> tuple[list[dict[str, Any]], Optional[str]]:
+        """下载并转换单个附件，返回 (parts, 图片链接或 None)"""
+        if attachment.size > self.max_attachment_size:
+            return [{
+                "text": f"[文件过大已跳过: {attachment.filename} "
+                        f"({attachment.size / 1024 / 1024:.1f}MB)]"
+            }], None
+
+        try:
+            try:
+                data, content_type = await self._download_attachment(
+                    attachment.url,
+                    channel_id=channel_id,
+                    attachment_id=attachment.id,
+                    size=attachment.size,
+                )
+            except _AttachmentTooLarge as e:
+                return [{
+                    "text": f"[文件过大已跳过: {attachment.filename} "
+                            f"({int(e.args[0]) / 1024 / 1024:.1f}MB)]"
+                }], None
+            if not data:
+                return [{"text": f"[文件下载失败: {attachment.filename}]"}], None
+
+            inline_supported = (
+                content_type.startswith('image/')
+                or content_type in (
+                    'application/pdf', 'text/plain', 'text/csv',
+                    'text/html', 'application/json', 'text/xml',
+                )
+            )
+
+            if inline_supported:
+                extra: dict[str, Any] = {}
+                if content_type.startswith('image/'):
+                    data, content_type, extra = await self._prepare_image(data, content_type)
+                digest = await asyncio.to_thread(self.blob_store.put, data)
+                part = {
+                    "inlineData": {
+                        "mimeType": content_type,
+                        "_blob": digest,
+                        "_size": len(data),
+                        **extra,
+                    }
+                }
+                return [part], attachment.url if content_type.startswith('image/') else None
+            try:
+                text_content = data.decode('utf-8')
+                return [{"text": f"[文件: {attachment.filename}]\n{text_content[:5000]}"}], None
+            except UnicodeDecodeError:
+                return [{
+                    "text": f"[不支持的文件类型: {attachment.filename} ({content_type})]"
+                }], None
+        except Exception as e:
+            return [{"text": f"[文件处理失败: {attachment.filename} - {str(e)[:100]}]"}], None
+
     async def _build_user_message(self, message: discord.Message) -> dict:
         """从 Discord 消息构建 Gemini user message（含文件与图像）"""
         parts = []
@@ -2051,60 +4339,24 @@ class AICustomerService(commands.Cog, name="AI客服"):
         )
         if message.content:
             parts.append({"text": f"{user_tag}\n{message.content}"})
-        else:
-            parts.append({"text": user_tag})
-
-        for i, embed in enumerate(message.embeds):
-            plain = self._embed_to_plain_text(embed)
-            if plain:
-                parts.append({"text": f"[embed {i + 1}]\n{plain}"})
-
-        for attachment in message.attachments:
-            if attachment.size > self.max_attachment_size:
-                parts.append({
-                    "text": f"[文件过大已跳过: {attachment.filename} "
-                            f"({attachment.size / 1024 / 1024:.1f}MB)]"
-                })
-                continue
-
-            try:
-                data, content_type = await self._download_attachment(attachment.url)
-                if not data:
-                    parts.append({"text": f"[文件下载失败: {attachment.filename}]"})
-                    continue
+        else:
+            parts.append({"text": user_tag})
 
-                inline_supported = (
-                    content_type.startswith('image/')
-                    or content_type in (
-                        'application/pdf', 'text/plain', 'text/csv',
-                        'text/html', 'application/json', 'text/xml',
-                    )
-                )
+        for i, embed in enumerate(message.embeds):
+            plain = self._embed_to_plain_text(embed)
+            if plain:
+                parts.append({"text": f"[embed {i + 1}]\n{plain}"})
 
-                if inline_supported:
-                    if content_type.startswith('image/'):
-                        data, content_type = await self._maybe_resize_image_for_claude(
-                            data, content_type,
-                        )
-                    b64_data = base64.b64encode(data).decode('utf-8')
-                    parts.append({
-                        "inlineData": {
-                            "mimeType": content_type,
-                            "data": b64_data
-                        }
-                    })
-                    if content_type.startswith('image/'):
-                        image_links.append(attachment.url)
-                else:
-                    try:
-                        text_content = data.decode('utf-8')
-                        parts.append({"text": f"[文件: {attachment.filename}]\n{text_content[:5000]}"})
-                    except UnicodeDecodeError:
-                        parts.append({
-                            "text": f"[不支持的文件类型: {attachment.filename} ({content_type})]"
-                        })
-            except Exception as e:
-                parts.append({"text": f"[文件处理失败: {attachment.filename} - {str(e)[:100]}]"})
+        # 所有附件并发下载处理，输出顺序与附件顺序一致
+        channel_id = getattr(message.channel, 'id', None)
+        ingested = await asyncio.gather(
+            *(self._ingest_attachment(a, channel_id) for a in message.attachments)
+        )
+        for att_parts, image_link in ingested:
+            parts.extend(att_parts)
+            if image_link:
+                image_links.append(image_link)
+        await self._dedup_image_parts(channel_id, parts)
 
         if image_links:
             link_tags = "\n".join(
@@ -2117,17 +4369,172 @@ class AICustomerService(commands.Cog, name="AI客服"):
 
         return {"role": "user", "parts": parts}
 
-    # ── Gemini API 流式调用 ───────────────────────────────────
+    # ── Gemini 上下文缓存（cachedContents） ──────────────────
+
+    def _gemini_context_cache_key(self, provider: GeminiProvider) -> str:
+        """缓存内容的配置指纹：后端地址、模型、稳定系统提示词与工具声明任一变化即需重建"""
+        raw = json.dumps(
+            [provider.base_url, provider.model, self._stable_system_prompt_text(), self._build_tools()],
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return BlobStore.digest_of(raw.encode('utf-8'))
+
+    def _gemini_cache_prefix_len(self, history: list) -> int:
+        """可冻结的前缀长度：保留末尾若干回合不缓存，且后缀不能以 functionResponse 开头"""
+        n = len(history) - self.gemini_context_cache_keep_tail
+        while n > 0:
+            first = history[n]
+            parts = (first.get('parts') or []) if isinstance(first, dict) else []
+            if not any(isinstance(p, dict) and 'functionResponse' in p for p in parts):
+                break
+            n -= 1
+        return n
+
+    async def _gemini_context_cache_request(
+        self, provider: GeminiProvider, method: str, path: str, body: Optional[dict] = None,
+    ) -> tuple[int, dict[str, Any]]:
+        url = f"{provider.base_url}/v1beta/{path}"
+        sep = '&' if '?' in url else '?'
+        async with self.session.request(
+            method,
+            f"{url}{sep}key={provider.api_key}",
+            json=body,
+            headers={"Content-Type": "application/json"},
+            timeout=aiohttp.ClientTimeout(total=60),
+        ) as resp:
+            text = await resp.text()
+            try:
+                data = json.loads(text) if text else {}
+            except json.JSONDecodeError:
+                data = {'raw': text[:500]}
+            return resp.status, data if isinstance(data, dict) else {}
 
-    async def _call_gemini_stream(self, channel_id: int, bot_message: discord.Message) -> dict:
+    async def _gemini_context_cache_evict(
+        self, channel_id: int, provider_name: Optional[str] = None,
+    ) -> None:
         """
-        调用 Gemini 流式 API 并实时更新 bot 消息。
-        返回中保留 thoughtSignature 以兼容 Gemini 2.5/3 系列模型。
+        删除频道的缓存句柄（provider_name 为 None 时删除所有实例的；频道关闭/前缀失效时调用，
+        失败忽略，服务端 TTL 兜底）
         """
-        history = self.conversations.get(channel_id, [])
+        caches = self._gemini_context_caches.get(channel_id)
+        if not caches:
+            return
+        names = list(caches) if provider_name is None else [provider_name]
+        handles = [caches.pop(name, None) for name in names]
+        if not caches:
+            self._gemini_context_caches.pop(channel_id, None)
+        for handle in handles:
+            if not handle or not handle.get('name'):
+                continue
+            if not self.session or self.session.closed:
+                return
+            try:
+                await self._gemini_context_cache_request(handle['provider'], 'DELETE', handle['name'])
+            except Exception:
+                pass
+
+    async def _gemini_context_cache_prepare(
+        self, provider: GeminiProvider, channel_id: int, history: list,
+    ) -> Optional[dict[str, Any]]:
+        """
+        为频道准备可用的 cachedContents 句柄：包含稳定系统提示词、_build_tools 与冻结的历史前缀。
+        前缀仍有效则按需续期 TTL；前缀被裁剪/回滚、配置变化或未缓存尾部增长过多时重建。
+        返回 None 表示本轮不使用缓存（发送完整请求）。
+        """
+        key = self._gemini_context_cache_key(provider)
+        now = time.monotonic()
+        handle = self._gemini_context_caches.get(channel_id, {}).get(provider.name)
+        if handle is not None:
+            n = handle['prefix_len']
+            intact = (
+                handle.get('name')
+                and handle['key'] == key
+                and n < len(history)
+                and history[0] is handle['first']
+                and history[n - 1] is handle['last']
+                and handle['expire_at'] - now > 30
+            )
+            if not intact:
+                if handle.get('name') or handle['key'] != key:
+                    await self._gemini_context_cache_evict(channel_id, provider.name)
+                    handle = None
+                elif now < handle['retry_after']:
+                    # 上次创建失败（通常是前缀 token 数不足），冷却期内不再尝试
+                    return None
+                else:
+                    handle = None
+            elif len(history) - n < self.gemini_context_cache_keep_tail + self.gemini_context_cache_refresh_growth:
+                if handle['expire_at'] - now < self.gemini_context_cache_ttl / 2:
+                    status, _ = await self._gemini_context_cache_request(
+                        provider,
+                        'PATCH',
+                        f"{handle['name']}?updateMask=ttl",
+                        {'ttl': f'{self.gemini_context_cache_ttl}s'},
+                    )
+                    if status == 200:
+                        handle['expire_at'] = now + self.gemini_context_cache_ttl
+                return handle
+            else:
+                await self._gemini_context_cache_evict(channel_id, provider.name)
+                handle = None
+
+        prefix_len = self._gemini_cache_prefix_len(history)
+        if prefix_len < self.gemini_context_cache_min_turns:
+            return None
+        # 前缀里已发送的图片：后续请求的重复图片引用按此续编序号
+        image_seen: dict[str, Any] = {}
+        body = {
+            'model': f'models/{provider.model}',
+            'systemInstruction': {'parts': [{'text': self._stable_system_prompt_text()}]},
+            'tools': self._build_tools(),
+            'contents': self._materialize_request(
+                self._gemini_request_contents(history[:prefix_len]),
+                newer_turns=sum(1 for t in history[prefix_len:] if self._is_user_input_turn(t)),
+                image_seen=image_seen,
+            ),
+            'ttl': f'{self.gemini_context_cache_ttl}s',
+        }
+        try:
+            status, data = await self._gemini_context_cache_request(
+                provider, 'POST', 'cachedContents', body,
+            )
+        except Exception as e:
+            status, data = 0, {'error': str(e)}
+        if status != 200 or not data.get('name'):
+            print(
+                f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                f"[AI客服] 创建 Gemini 上下文缓存失败 ({status})，本轮发送完整请求: "
+                f"{str(data.get('error', data))[:200]}"
+            )
+            self._gemini_context_caches.setdefault(channel_id, {})[provider.name] = {
+                'name': None,
+                'provider': provider,
+                'key': key,
+                'prefix_len': prefix_len,
+                'first': history[0],
+                'last': history[prefix_len - 1],
+                'expire_at': 0.0,
+                'retry_after': now + 300,
+            }
+            return None
+        handle = {
+            'name': data['name'],
+            'provider': provider,
+            'key': key,
+            'prefix_len': prefix_len,
+            'first': history[0],
+            'last': history[prefix_len - 1],
+            'expire_at': now + self.gemini_context_cache_ttl,
+            'retry_after': 0.0,
+            'image_seen': image_seen,
+        }
+        self._gemini_context_caches.setdefault(channel_id, {})[provider.name] = handle
+        return handle
 
-        request_body = {
-            "contents": history,
+    def _gemini_full_request_body(self, history: list) -> dict[str, Any]:
+        return {
+            "contents": self._gemini_request_contents(history),
             "systemInstruction": self._build_system_instruction(),
             "tools": self._build_tools(),
             "generationConfig": {
@@ -2137,61 +4544,177 @@ class AICustomerService(commands.Cog, name="AI客服"):
             },
         }
 
+    def _gemini_cached_request_body(
+        self, history: list, handle: dict[str, Any],
+    ) -> dict[str, Any]:
+        """使用 cachedContent 时只发送未缓存的后缀；<time> 追加在最后一个回合末尾以保持缓存前缀稳定"""
+        contents = self._gemini_request_contents(history[handle['prefix_len']:])
+        if contents:
+            last = contents[-1]
+            contents[-1] = {
+                **last,
+                'parts': list(last.get('parts') or []) + [{'text': self._build_time_tag()}],
+            }
+        return {
+            "cachedContent": handle['name'],
+            "contents": contents,
+            "generationConfig": {
+                "thinkingConfig": {
+                    "includeThoughts": True,
+                },
+            },
+        }
+
+    # ── 流式消息编辑 ─────────────────────────────────────────
+
+    @staticmethod
+    def _stream_display(text: str) -> str:
+        if len(text) > 2000:
+            return text[:1997] + '...'
+        return text or '…'
+
+    @staticmethod
+    def _stream_started(bot_message: discord.Message) -> None:
+        """
+        收到后端的流式事件（思考、工具调用增量、元数据等任何内容）：
+        对冲/故障切换中的这一路据此认定首个 token 已到达
+        """
+        if isinstance(bot_message, StreamLeg):
+            bot_message.mark_token()
+
+    def _stream_edit(self, bot_message: discord.Message, text: Union[str, list[str]]) -> None:
+        """
+        流式过程中提交当前全文，由 edit_scheduler 合并后按节奏编辑（不等待 Discord）。
+        text 为增量列表时，只在真正发出编辑时拼接。
+        """
+        self._stream_started(bot_message)
+        if isinstance(text, list):
+            self.edit_scheduler.update(bot_message, lambda: self._stream_display(''.join(text)))
+        else:
+            self.edit_scheduler.update(bot_message, self._stream_display(text))
+
+    async def _stream_edit_final(self, bot_message: discord.Message, full_text: str) -> None:
+        """流式结束：立即写入完整文本（覆盖尚未发出的中间编辑）"""
+        await self.edit_scheduler.flush(bot_message, self._stream_display(full_text))
+
+    async def _llm_retry_wait(
+        self,
+        bot_message: discord.Message,
+        status: Optional[int],
+        seconds: float,
+        notice: str,
+    ) -> None:
+        """
+        后端限流/过载后的原地重试：显示 notice 并等待 seconds 秒。
+        故障切换中还有其他实例可用时不等待，抛出 ProviderHTTPError 交给 _call_llm_stream 切换。
+        """
+        if isinstance(bot_message, StreamLeg) and bot_message.can_failover:
+            raise ProviderHTTPError(
+                f'{bot_message.provider.label} 限流/过载 ({status})', status=status or 429,
+            )
+        try:
+            await self.edit_scheduler.flush(bot_message, notice)
+        except discord.HTTPException:
+            pass
+        await asyncio.sleep(seconds)
+
+    # ── Gemini API 流式调用 ───────────────────────────────────
+
+    async def _call_gemini_stream(
+        self,
+        provider: GeminiProvider,
+        channel_id: int,
+        bot_message: discord.Message,
+    ) -> dict:
+        """
+        调用 Gemini 流式 API 并实时更新 bot 消息。
+        返回中保留 thoughtSignature 以兼容 Gemini 2.5/3 系列模型。
+        开启 gemini.context_cache 时，系统提示词、工具与冻结的历史前缀走 cachedContents。
+        """
+        history = self.conversations.get(channel_id, [])
+
+        cache_handle: Optional[dict[str, Any]] = None
+        if self.gemini_context_cache_enabled:
+            try:
+                cache_handle = await self._gemini_context_cache_prepare(provider, channel_id, history)
+            except Exception as e:
+                print(
+                    f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                    f"[AI客服] Gemini 上下文缓存不可用: {e}"
+                )
+                cache_handle = None
+        if cache_handle is not None:
+            request_body = self._gemini_cached_request_body(history, cache_handle)
+        else:
+            request_body = self._gemini_full_request_body(history)
+
         url = (
-            f"{self.proxy_url}/v1beta/models/{self.model}"
-            f":streamGenerateContent?alt=sse&key={self.api_key}"
+            f"{provider.base_url}/v1beta/models/{provider.model}"
+            f":streamGenerateContent?alt=sse&key={provider.api_key}"
         )
 
-        full_text = ""
+        text_chunks: list[str] = []
         tool_call_parts: list[dict] = []
         text_signature: str | None = None
-        last_edit_time = 0.0
-        min_edit_interval = 1.0 / 3
         max_retries = 3
         debug_gemini_thoughts: list[Any] = []
         debug_gemini_usage: Any = None
         debug_gemini_last_meta: dict[str, Any] = {}
 
+        payload = self._materialize_request(
+            request_body,
+            channel_id=channel_id,
+            image_seen=(
+                self._copy_image_seen(cache_handle.get('image_seen'))
+                if cache_handle is not None else None
+            ),
+        )
         for attempt in range(max_retries):
             resp = await self.session.post(
                 url,
-                json=request_body,
+                json=payload,
                 headers={"Content-Type": "application/json"},
                 timeout=aiohttp.ClientTimeout(total=300),
             )
+            if (
+                cache_handle is not None
+                and resp.status in (400, 403, 404)
+                and attempt < max_retries - 1
+            ):
+                # 缓存已过期/被删除等：丢弃句柄，改发完整请求
+                resp.release()
+                await self._gemini_context_cache_evict(channel_id, provider.name)
+                cache_handle = None
+                payload = self._materialize_request(
+                    self._gemini_full_request_body(history), channel_id=channel_id,
+                )
+                continue
             if resp.status in (429, 524):
                 resp.release()
                 retry_after = int(resp.headers.get('Retry-After', 10))
                 if attempt < max_retries - 1:
-                    try:
-                        await bot_message.edit(content=f"⏳ API 限流/过载，{retry_after}秒后重试...")
-                    except discord.HTTPException:
-                        pass
-                    await asyncio.sleep(retry_after)
+                    await self._llm_retry_wait(
+                        bot_message, resp.status, retry_after,
+                        f"⏳ API 限流/过载，{retry_after}秒后重试...",
+                    )
                     continue
             break
 
         async with resp:
             if resp.status != 200:
                 error_text = await resp.text()
-                raise Exception(f"Gemini API 错误 ({resp.status}): {error_text[:500]}")
-
-            while True:
-                line_bytes = await resp.content.readline()
-                if not line_bytes:
-                    break
-
-                line = line_bytes.decode('utf-8').strip()
-                if not line or not line.startswith('data: '):
-                    continue
+                raise ProviderHTTPError(
+                    f"Gemini API 错误 ({resp.status}): {error_text[:500]}", status=resp.status,
+                )
 
-                json_str = line[6:]
-                if json_str == '[DONE]':
+            async for _event, raw in iter_sse(resp.content):
+                self._stream_started(bot_message)
+                if raw == b'[DONE]':
                     break
 
                 try:
-                    data = json.loads(json_str)
-                except json.JSONDecodeError:
+                    data = loads_json(raw)
+                except ValueError:
                     continue
 
                 if 'promptFeedback' in data:
@@ -2233,26 +4756,17 @@ class AICustomerService(commands.Cog, name="AI客服"):
                             fc_part['thoughtSignature'] = part['thoughtSignature']
                         tool_call_parts.append(fc_part)
                     elif 'text' in part:
-                        full_text += part['text']
+                        text_chunks.append(part['text'])
                         if 'thoughtSignature' in part:
                             text_signature = part['thoughtSignature']
-                        now = time.monotonic()
-                        if now - last_edit_time >= min_edit_interval:
-                            try:
-                                display = full_text
-                                if len(display) > 2000:
-                                    display = display[:1997] + "..."
-                                await bot_message.edit(content=display)
-                                last_edit_time = now
-                            except discord.HTTPException:
-                                pass
+                        self._stream_edit(bot_message, text_chunks)
                     elif 'thoughtSignature' in part:
                         text_signature = part['thoughtSignature']
 
+        full_text = ''.join(text_chunks)
         if full_text:
             try:
-                display = full_text[:1997] + "..." if len(full_text) > 2000 else full_text
-                await bot_message.edit(content=display)
+                await self._stream_edit_final(bot_message, full_text)
             except discord.HTTPException:
                 pass
 
@@ -2274,13 +4788,22 @@ class AICustomerService(commands.Cog, name="AI客服"):
 
         if self.debug_stream_full_log:
             self._debug_log_after_stream('gemini', channel_id, {
-                'gemini_model': self.model,
-                'proxy_url': self.proxy_url,
+                'gemini_model': provider.model,
+                'proxy_url': provider.base_url,
                 'response': result,
                 'assistant_visible_text': full_text,
                 'tool_call_parts': tool_call_parts,
                 'thought_parts_raw': debug_gemini_thoughts,
                 'usageMetadata': debug_gemini_usage,
+                'cached_content': (
+                    {
+                        'name': cache_handle['name'],
+                        'prefix_len': cache_handle['prefix_len'],
+                        'suffix_len': len(history) - cache_handle['prefix_len'],
+                    }
+                    if cache_handle is not None
+                    else None
+                ),
                 'last_candidate_meta': debug_gemini_last_meta,
                 'text_signature': text_signature,
             })
@@ -2288,6 +4811,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
 
     async def _call_claude_openai_stream(
         self,
+        provider: ClaudeOpenAIProvider,
         channel_id: int,
         bot_message: discord.Message,
     ) -> dict:
@@ -2296,18 +4820,17 @@ class AICustomerService(commands.Cog, name="AI客服"):
         调用 Claude（chat.completions + tools），流式更新 bot_message。
         对话仍存为 Gemini 形态，请求前转换为 OpenAI messages。
         """
-        if self._openai_client is None:
+        if provider.client is None:
             raise RuntimeError(
                 'OpenAI 兼容客户端未就绪：请设置 provider 为 claude_openai 并配置 API Key，'
                 '且已 pip 安装 openai'
             )
 
         history = self.conversations.get(channel_id, [])
-        messages = self._gemini_contents_to_openai_messages(history)
+        messages = self._gemini_contents_to_openai_messages(history, channel_id)
+        request_messages = self._materialize_request(messages)
         tools = self._build_openai_tools()
 
-        last_edit_time = 0.0
-        min_edit_interval = 1.0 / 3
         max_retries = 3
 
         stream_chunk_count = 0
@@ -2325,20 +4848,21 @@ class AICustomerService(commands.Cog, name="AI客服"):
             claude_usage_final = None
             try:
                 _ckwargs: dict[str, Any] = {
-                    'model': self.claude_openai_model,
-                    'messages': messages,
+                    'model': provider.model,
+                    'messages': request_messages,
                     'tools': tools,
-                    'max_tokens': self.claude_openai_max_tokens,
+                    'max_tokens': provider.max_tokens,
                     'stream': True,
                     'parallel_tool_calls': True,
                 }
-                _extra = self._claude_openai_extra_body()
+                _extra = self._claude_openai_extra_body(provider)
                 if _extra:
                     _ckwargs['extra_body'] = _extra
-                stream = await self._openai_client.chat.completions.create(
+                stream = await provider.client.chat.completions.create(
                     **_ckwargs
                 )
                 async for chunk in stream:
+                    self._stream_started(bot_message)
                     stream_chunk_count += 1
                     if self.debug_stream_full_log:
                         u_obj = getattr(chunk, 'usage', None)
@@ -2383,20 +4907,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
                                 stream_reasoning_parts.append(f'[{attr}]{v!s}')
                     if getattr(delta, 'content', None):
                         full_text += delta.content or ''
-                        now = time.monotonic()
-                        if now - last_edit_time >= min_edit_interval:
-                            try:
-                                display = (
-                                    full_text[:1997] + '...'
-                                    if len(full_text) > 2000
-                                    else full_text
-                                )
-                                await bot_message.edit(
-                                    content=display if display else '…'
-                                )
-                                last_edit_time = now
-                            except discord.HTTPException:
-                                pass
+                        self._stream_edit(bot_message, full_text)
                     tcd = getattr(delta, 'tool_calls', None)
                     if tcd:
                         for tc in tcd:
@@ -2422,24 +4933,16 @@ class AICustomerService(commands.Cog, name="AI客服"):
                 if attempt < max_retries - 1 and (
                     '429' in msg or 'rate' in msg or 'overloaded' in msg
                 ):
-                    try:
-                        await bot_message.edit(
-                            content='⏳ Claude API 限流，数秒后重试...'
-                        )
-                    except discord.HTTPException:
-                        pass
-                    await asyncio.sleep(8)
+                    await self._llm_retry_wait(
+                        bot_message, getattr(e, 'status_code', None), 8,
+                        '⏳ Claude API 限流，数秒后重试...',
+                    )
                     continue
                 raise
 
         if full_text:
             try:
-                disp = (
-                    full_text[:1997] + '...'
-                    if len(full_text) > 2000
-                    else full_text
-                )
-                await bot_message.edit(content=disp)
+                await self._stream_edit_final(bot_message, full_text)
             except discord.HTTPException:
                 pass
 
@@ -2491,8 +4994,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
 
         if self.debug_stream_full_log:
             self._debug_log_after_stream('claude_openai', channel_id, {
-                'model': self.claude_openai_model,
-                'extra_body': self._claude_openai_extra_body(),
+                'model': provider.model,
+                'extra_body': self._claude_openai_extra_body(provider),
                 'finish_reason': finish_reason,
                 'stream_chunk_count': stream_chunk_count,
                 'reasoning_delta_joined': '\n'.join(stream_reasoning_parts),
@@ -2506,6 +5009,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
 
     async def _call_openai_responses_stream(
         self,
+        provider: OpenAIResponsesProvider,
         channel_id: int,
         bot_message: discord.Message,
     ) -> dict:
@@ -2513,18 +5017,19 @@ class AICustomerService(commands.Cog, name="AI客服"):
         调用 OpenAI Responses API（POST /v1/responses），流式更新 bot_message。
         对话仍存为 Gemini 形态，请求前转换为 Responses input items。
         """
-        if self._openai_client is None:
+        if provider.client is None:
             raise RuntimeError(
                 'OpenAI Responses 客户端未就绪：请设置 provider 为 openai_responses '
                 '并配置 ai_customer_service.openai_responses.api_key，且已 pip 安装 openai'
             )
 
         history = self.conversations.get(channel_id, [])
-        input_items = self._gemini_contents_to_responses_input(history)
+        input_items = self._gemini_contents_to_responses_input(
+            history, channel_id, reasoning_items=provider.needs_reasoning_items(),
+        )
+        request_input = self._materialize_request(input_items)
         tools = self._build_responses_tools()
 
-        last_edit_time = 0.0
-        min_edit_interval = 1.0 / 3
         max_retries = 3
 
         full_text = ''
@@ -2585,20 +5090,21 @@ class AICustomerService(commands.Cog, name="AI客服"):
             response_error = None
             try:
                 kwargs: dict[str, Any] = {
-                    'model': self.openai_responses_model,
-                    'input': input_items,
+                    'model': provider.model,
+                    'input': request_input,
                     'instructions': self._system_prompt_text(),
                     'tools': tools,
-                    'max_output_tokens': self.openai_responses_max_output_tokens,
+                    'max_output_tokens': provider.max_output_tokens,
                     'stream': True,
                     'parallel_tool_calls': True,
                     'include': ['reasoning.encrypted_content'],
                 }
-                if self.openai_responses_reasoning:
-                    kwargs['reasoning'] = self.openai_responses_reasoning
+                if provider.reasoning:
+                    kwargs['reasoning'] = provider.reasoning
 
-                stream = await self._openai_client.responses.create(**kwargs)
+                stream = await provider.client.responses.create(**kwargs)
                 async for event in stream:
+                    self._stream_started(bot_message)
                     etype = getattr(event, 'type', '')
                     if self.debug_stream_full_log:
                         stream_debug_events.append(self._plain_obj(event))
@@ -2608,20 +5114,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
                     if etype == 'response.output_text.delta':
                         delta = getattr(event, 'delta', '') or ''
                         full_text += delta
-                        now = time.monotonic()
-                        if now - last_edit_time >= min_edit_interval:
-                            try:
-                                display = (
-                                    full_text[:1997] + '...'
-                                    if len(full_text) > 2000
-                                    else full_text
-                                )
-                                await bot_message.edit(
-                                    content=display if display else '…'
-                                )
-                                last_edit_time = now
-                            except discord.HTTPException:
-                                pass
+                        self._stream_edit(bot_message, full_text)
                         continue
 
                     if etype == 'response.output_text.done':
@@ -2692,24 +5185,16 @@ class AICustomerService(commands.Cog, name="AI客服"):
                     or 'overloaded' in msg
                     or 'temporarily' in msg
                 ):
-                    try:
-                        await bot_message.edit(
-                            content='⏳ OpenAI Responses API 限流/过载，数秒后重试...'
-                        )
-                    except discord.HTTPException:
-                        pass
-                    await asyncio.sleep(8)
+                    await self._llm_retry_wait(
+                        bot_message, getattr(e, 'status_code', None), 8,
+                        '⏳ OpenAI Responses API 限流/过载，数秒后重试...',
+                    )
                     continue
                 raise
 
         if full_text:
             try:
-                disp = (
-                    full_text[:1997] + '...'
-                    if len(full_text) > 2000
-                    else full_text
-                )
-                await bot_message.edit(content=disp)
+                await self._stream_edit_final(bot_message, full_text)
             except discord.HTTPException:
                 pass
 
@@ -2764,9 +5249,9 @@ class AICustomerService(commands.Cog, name="AI客服"):
 
         if self.debug_stream_full_log:
             self._debug_log_after_stream('openai_responses', channel_id, {
-                'model': self.openai_responses_model,
-                'base_url': self.openai_responses_base_url,
-                'reasoning': self.openai_responses_reasoning,
+                'model': provider.model,
+                'base_url': provider.base_url,
+                'reasoning': provider.reasoning,
                 'input_items': input_items,
                 'tools': tools,
                 'tool_calls_merged_raw': dict(tool_acc),
@@ -2779,8 +5264,22 @@ class AICustomerService(commands.Cog, name="AI客服"):
             })
         return result_openai
 
+    @staticmethod
+    def _claude_join_block_chunks(
+        blocks_by_idx: dict[int, dict[str, Any]],
+        block_chunks: dict[tuple[int, str], list[str]],
+        idx: int,
+    ) -> None:
+        """把第 idx 块累积的增量拼接写回块字段"""
+        block = blocks_by_idx.setdefault(idx, {})
+        for field in ('text', 'thinking', 'signature', '_partial_json'):
+            chunks = block_chunks.pop((idx, field), None)
+            if chunks:
+                block[field] = (block.get(field) or '') + ''.join(chunks)
+
     async def _call_claude_messages_stream(
         self,
+        provider: ClaudeMessagesProvider,
         channel_id: int,
         bot_message: discord.Message,
     ) -> dict:
@@ -2792,48 +5291,59 @@ class AICustomerService(commands.Cog, name="AI客服"):
           - https://platform.claude.com/docs/en/build-with-claude/extended-thinking
           - https://platform.claude.com/docs/en/agents-and-tools/tool-use/overview
         """
-        if not self.claude_messages_api_key:
+        if not provider.api_key:
             raise RuntimeError('claude_messages 未配置 API Key')
 
         history = self.conversations.get(channel_id, [])
-        messages = self._gemini_contents_to_claude_messages(history)
+        messages = self._gemini_contents_to_claude_messages(history, channel_id)
         tools = self._build_claude_tools()
+        if provider.prompt_cache:
+            tools, messages = self._claude_apply_prompt_cache(provider, tools, messages)
 
         request_body: dict[str, Any] = {
-            'model': self.claude_messages_model,
-            'max_tokens': self.claude_messages_max_tokens,
+            'model': provider.model,
+            'max_tokens': provider.max_tokens,
             'stream': True,
-            'system': self._build_claude_system(),
+            'system': self._build_claude_system(provider),
             'messages': messages,
             'tools': tools,
         }
-        thinking_param = self._claude_thinking_param()
+        thinking_param = self._claude_thinking_param(provider)
         if thinking_param is not None:
             request_body['thinking'] = thinking_param
 
         headers = {
-            'x-api-key': self.claude_messages_api_key,
+            'x-api-key': provider.api_key,
             'anthropic-version': '2023-06-01',
             'content-type': 'application/json',
             'accept': 'text/event-stream',
         }
-        if self.claude_messages_interleaved_thinking:
-            headers['anthropic-beta'] = 'interleaved-thinking-2025-05-14'
+        betas: list[str] = []
+        if provider.interleaved_thinking:
+            betas.append('interleaved-thinking-2025-05-14')
+        if provider.prompt_cache and provider.prompt_cache_ttl == '1h':
+            betas.append('extended-cache-ttl-2025-04-11')
+        if betas:
+            headers['anthropic-beta'] = ','.join(betas)
 
-        url = f'{self.claude_messages_base_url}messages'
+        url = f'{provider.base_url}messages'
 
-        last_edit_time = 0.0
-        min_edit_interval = 1.0 / 3
         max_retries = 3
+        body_bytes = json.dumps(
+            self._materialize_request(request_body), ensure_ascii=False,
+        ).encode('utf-8')
 
-        full_text = ''
+        text_chunks: list[str] = []
+        block_chunks: dict[tuple[int, str], list[str]] = {}
         blocks_by_idx: dict[int, dict[str, Any]] = {}
         stop_reason: Optional[str] = None
         usage_final: Any = None
         sse_events_dump: list[dict[str, Any]] = []
 
         for attempt in range(max_retries):
-            full_text = ''
+            text_chunks: list[str] = []
+            # (块 index, 字段) -> 增量列表；块结束时拼接写回 blocks_by_idx
+            block_chunks: dict[tuple[int, str], list[str]] = {}
             blocks_by_idx = {}
             stop_reason = None
             usage_final = None
@@ -2841,7 +5351,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
 
             resp = await self.session.post(
                 url,
-                data=json.dumps(request_body, ensure_ascii=False).encode('utf-8'),
+                data=body_bytes,
                 headers=headers,
                 timeout=aiohttp.ClientTimeout(total=600),
             )
@@ -2854,46 +5364,29 @@ class AICustomerService(commands.Cog, name="AI客服"):
                         retry_after = int(resp.headers.get('Retry-After', '8') or 8)
                     except (ValueError, TypeError):
                         retry_after = 8
-                    try:
-                        await bot_message.edit(
-                            content=f'⏳ Claude API 限流/过载（{resp.status}），'
-                                    f'{retry_after}秒后重试...'
-                        )
-                    except discord.HTTPException:
-                        pass
-                    await asyncio.sleep(retry_after)
+                    await self._llm_retry_wait(
+                        bot_message, resp.status, retry_after,
+                        f'⏳ Claude API 限流/过载（{resp.status}），{retry_after}秒后重试...',
+                    )
                     continue
-                raise Exception(
-                    f'Claude Messages API 错误 ({resp.status}): {err_body[:500]}'
+                raise ProviderHTTPError(
+                    f'Claude Messages API 错误 ({resp.status}): {err_body[:500]}',
+                    status=resp.status,
                 )
             if resp.status != 200:
                 err_body = await resp.text()
                 resp.release()
-                raise Exception(
-                    f'Claude Messages API 错误 ({resp.status}): {err_body[:500]}'
+                raise ProviderHTTPError(
+                    f'Claude Messages API 错误 ({resp.status}): {err_body[:500]}',
+                    status=resp.status,
                 )
 
             async with resp:
-                current_event: Optional[str] = None
-                while True:
-                    line_bytes = await resp.content.readline()
-                    if not line_bytes:
-                        break
-                    line = line_bytes.decode('utf-8', errors='replace').rstrip('\r\n')
-                    if not line:
-                        current_event = None
-                        continue
-                    if line.startswith(':'):
-                        continue
-                    if line.startswith('event: '):
-                        current_event = line[7:].strip()
-                        continue
-                    if not line.startswith('data: '):
-                        continue
-                    data_str = line[6:]
+                async for current_event, raw in iter_sse(resp.content):
+                    self._stream_started(bot_message)
                     try:
-                        data = json.loads(data_str)
-                    except json.JSONDecodeError:
+                        data = loads_json(raw)
+                    except ValueError:
                         continue
 
                     if self.debug_stream_full_log:
@@ -2914,8 +5407,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
                     if etype == 'message_start':
                         msg_obj = data.get('message') or {}
                         u = msg_obj.get('usage')
-                        if u is not None:
-                            usage_final = u
+                        if isinstance(u, dict):
+                            usage_final = {**(usage_final or {}), **u}
                         continue
                     if etype == 'content_block_start':
                         idx = data.get('index', 0)
@@ -2939,38 +5432,24 @@ class AICustomerService(commands.Cog, name="AI客服"):
                         block = blocks_by_idx.setdefault(idx, {})
                         if dtype == 'text_delta':
                             t = delta.get('text', '') or ''
-                            block['text'] = (block.get('text') or '') + t
+                            block_chunks.setdefault((idx, 'text'), []).append(t)
                             if block.get('type') == 'text':
-                                full_text += t
-                                now = time.monotonic()
-                                if now - last_edit_time >= min_edit_interval:
-                                    try:
-                                        disp = (
-                                            full_text[:1997] + '...'
-                                            if len(full_text) > 2000
-                                            else full_text
-                                        )
-                                        await bot_message.edit(
-                                            content=disp if disp else '…'
-                                        )
-                                        last_edit_time = now
-                                    except discord.HTTPException:
-                                        pass
+                                text_chunks.append(t)
+                                self._stream_edit(bot_message, text_chunks)
                         elif dtype == 'input_json_delta':
                             pj = delta.get('partial_json', '') or ''
-                            block['_partial_json'] = (
-                                block.get('_partial_json') or ''
-                            ) + pj
+                            block_chunks.setdefault((idx, '_partial_json'), []).append(pj)
                         elif dtype == 'thinking_delta':
                             th = delta.get('thinking', '') or ''
-                            block['thinking'] = (block.get('thinking') or '') + th
+                            block_chunks.setdefault((idx, 'thinking'), []).append(th)
                         elif dtype == 'signature_delta':
                             sig = delta.get('signature', '') or ''
-                            block['signature'] = (block.get('signature') or '') + sig
+                            block_chunks.setdefault((idx, 'signature'), []).append(sig)
                         # citations_delta 等其他类型按需扩展，当前忽略
                         continue
                     if etype == 'content_block_stop':
                         idx = data.get('index', 0)
+                        self._claude_join_block_chunks(blocks_by_idx, block_chunks, idx)
                         block = blocks_by_idx.get(idx)
                         if block and block.get('type') == 'tool_use':
                             raw = block.pop('_partial_json', '') or ''
@@ -2988,8 +5467,12 @@ class AICustomerService(commands.Cog, name="AI客服"):
                         if 'stop_reason' in delta:
                             stop_reason = delta.get('stop_reason')
                         u = data.get('usage')
-                        if u is not None:
-                            usage_final = u
+                        if isinstance(u, dict):
+                            # message_delta 只带累计 output_tokens 等，合并以保留 message_start 的输入/缓存计数
+                            usage_final = {
+                                **(usage_final or {}),
+                                **{k: v for k, v in u.items() if v is not None},
+                            }
                         continue
                     if etype == 'message_stop':
                         break
@@ -2998,18 +5481,16 @@ class AICustomerService(commands.Cog, name="AI客服"):
             break  # 成功，跳出重试循环
 
         # 最终编辑一次确保完整
+        full_text = ''.join(text_chunks)
         if full_text:
             try:
-                disp = (
-                    full_text[:1997] + '...'
-                    if len(full_text) > 2000
-                    else full_text
-                )
-                await bot_message.edit(content=disp)
+                await self._stream_edit_final(bot_message, full_text)
             except discord.HTTPException:
                 pass
 
-        # 按 index 升序整理 _claude_blocks，并清理临时字段
+        # 按 index 升序整理 _claude_blocks（未收到 content_block_stop 的块也拼接增量），并清理临时字段
+        for idx in {i for i, _f in block_chunks}:
+            self._claude_join_block_chunks(blocks_by_idx, block_chunks, idx)
         ordered_blocks: list[dict[str, Any]] = []
         for idx in sorted(blocks_by_idx.keys()):
             b = dict(blocks_by_idx[idx])
@@ -3048,12 +5529,23 @@ class AICustomerService(commands.Cog, name="AI客服"):
 
         if self.debug_stream_full_log:
             self._debug_log_after_stream('claude_messages', channel_id, {
-                'model': self.claude_messages_model,
-                'base_url': self.claude_messages_base_url,
+                'model': provider.model,
+                'base_url': provider.base_url,
                 'thinking': thinking_param,
-                'interleaved_thinking': self.claude_messages_interleaved_thinking,
+                'interleaved_thinking': provider.interleaved_thinking,
                 'stop_reason': stop_reason,
                 'usage_final': usage_final,
+                'prompt_cache': {
+                    'enabled': provider.prompt_cache,
+                    'ttl': provider.prompt_cache_ttl,
+                    'cache_read_input_tokens': (usage_final or {}).get(
+                        'cache_read_input_tokens'
+                    ),
+                    'cache_creation_input_tokens': (usage_final or {}).get(
+                        'cache_creation_input_tokens'
+                    ),
+                    'input_tokens': (usage_final or {}).get('input_tokens'),
+                },
                 'sse_events': sse_events_dump,
                 'ordered_blocks': ordered_blocks,
                 'response': result,
@@ -3067,13 +5559,46 @@ class AICustomerService(commands.Cog, name="AI客服"):
         channel_id: int,
         bot_message: discord.Message,
     ) -> dict:
-        if self.llm_provider == 'claude_openai':
-            return await self._call_claude_openai_stream(channel_id, bot_message)
-        if self.llm_provider == 'openai_responses':
-            return await self._call_openai_responses_stream(channel_id, bot_message)
-        if self.llm_provider == 'claude_messages':
-            return await self._call_claude_messages_stream(channel_id, bot_message)
-        return await self._call_gemini_stream(channel_id, bot_message)
+        """
+        未开启故障切换时直接调用主实例。开启后按 [主实例, 备用实例...] 中未熔断的实例依次尝试：
+        首个 token 超过 hedge_after_seconds 未到达时向下一个实例发出对冲请求，先出内容的一路胜出；
+        429/5xx/超时立即切换到下一个实例（见 utils.llm_failover.StreamRace）。
+        """
+        if not self.failover_enabled or not self.failover_providers:
+            provider = self.provider
+            return await getattr(self, provider.stream_method)(provider, channel_id, bot_message)
+
+        breaker = self.circuit_breaker
+        chain = [
+            p for p in (self.provider, *self.failover_providers)
+            if p.configured() and not breaker.is_open(p.name)
+        ] or [self.provider]
+
+        async def call(provider: LLMProvider, leg: StreamLeg) -> dict:
+            # 各路在独立任务中运行：转换请求时按该路实例的 kind 处理附件与 token 估算
+            _ACTIVE_PROVIDER_KIND.set(provider.kind)
+            return await getattr(self, provider.stream_method)(provider, channel_id, leg)
+
+        race = StreamRace(
+            bot_message, chain, call, breaker,
+            hedge_after=self.failover_hedge_after,
+            on_leg_done=self.edit_scheduler.discard,
+        )
+        stats = self.failover_stats
+        stats['requests'] += 1
+        try:
+            provider, result = await race.run()
+        finally:
+            stats['hedged'] += race.hedged
+            stats['failovers'] += race.failovers
+        if provider is not self.provider:
+            stats['backup_wins'] += 1
+            print(
+                f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                f"[AI客服] 频道 {channel_id} 本轮由备用实例 {provider.label} 回复"
+                + ("（对冲）" if race.hedged else "")
+            )
+        return result
 
     # ── 工具执行 ──────────────────────────────────────────────
 
@@ -3095,9 +5620,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
                         return {"error": "无法访问管理频道"}
             content = f"**来自 <#{channel.id}>：**\n{msg_text}"
             sent = await target.send(content)
-            view = AdminInjectView(self, channel.id, sent.id)
+            view = self._bind_admin_inject_view(channel.id, sent.id)
             await sent.edit(view=view)
-            self.bot.add_view(view, message_id=sent.id)
             return {"result": "消息已发送到管理频道"}
 
         if name == 'exit_conversation':
@@ -3125,65 +5649,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
             if not triples:
                 return {"error": "未解析到有效 Discord 链接（需 discord.com/channels/服务器ID/频道或子区ID/可选消息ID）"}
 
-            sections: list[str] = []
-            collected_msgs: list[discord.Message] = []
-            for gi, (_g_id, ch_id, msg_id) in enumerate(triples, 1):
-                sec_head = f"--- 链接 {gi} (频道/子区 {ch_id}) ---"
-                try:
-                    target_ch = self.bot.get_channel(ch_id)
-                    if not target_ch:
-                        target_ch = await self.bot.fetch_channel(ch_id)
-                except Exception:
-                    sections.append(f"{sec_head}\n错误: 无法访问该频道或子区")
-                    continue
-
-                if msg_id is not None:
-                    try:
-                        body, msgs = await self._fetch_messages_anchored(target_ch, msg_id)
-                        collected_msgs.extend(msgs)
-                        sections.append(f"{sec_head}\n目标消息 {msg_id} 前后上下文:\n{body}")
-                    except Exception as e:
-                        sections.append(f"{sec_head}\n错误: 无法读取该消息或上下文 ({e})")
-                    continue
-
-                if self._is_forum_post_thread(target_ch):
-                    try:
-                        body, msgs = await self._fetch_forum_thread_without_message_id(
-                            target_ch
-                        )
-                        collected_msgs.extend(msgs)
-                        sections.append(
-                            f"{sec_head}\n论坛帖已按「最早25条 + 最近25条」拉取:\n{body}"
-                        )
-                    except Exception as e:
-                        sections.append(f"{sec_head}\n错误: 论坛帖历史读取失败 ({e})")
-                    continue
-
-                if isinstance(target_ch, discord.Thread):
-                    sections.append(
-                        f"{sec_head}\n错误: 该子区非论坛公开帖，请使用带「消息ID」的完整链接"
-                    )
-                    continue
-
-                sections.append(
-                    f"{sec_head}\n错误: 普通文字频道必须提供消息ID，无法在仅频道链接下读取历史"
-                )
-
-            out = '\n\n'.join(sections)
-            max_len = 120_000
-            if len(out) > max_len:
-                out = out[: max_len - 80] + '\n\n...(总输出过长已截断，请减少链接数量或缩短范围)'
-            image_inline_parts, img_skipped = await self._build_fetch_image_inline_gemini_parts(
-                collected_msgs
-            )
-            if img_skipped:
-                out = (
-                    f"{out}\n\n（另有 {img_skipped} 张图片未加入多模态上下文：超过单工具上限或未下载）"
-                )
-            payload: dict[str, Any] = {'messages': out}
-            if image_inline_parts:
-                payload['image_inline_parts'] = image_inline_parts
-            return payload
+            return await self._fetch_links_payload(triples, getattr(channel, 'id', None))
 
         return {"error": f"未知工具: {name}"}
 
@@ -3194,6 +5660,21 @@ class AICustomerService(commands.Cog, name="AI客服"):
         channel: discord.abc.Messageable,
         channel_id: int,
         bot_message: discord.Message,
+    ):
+        """生成一次回复（含工具往返）；回复正常结束后才计入本次的图片统计"""
+        tally: dict[str, dict] = {'dedup': {}, 'history': {}}
+        token = _IMAGE_REPLY_TALLY.set(tally)
+        try:
+            await self._generate_response_rounds(channel, channel_id, bot_message)
+        finally:
+            _IMAGE_REPLY_TALLY.reset(token)
+        self._commit_image_tally(channel_id, tally)
+
+    async def _generate_response_rounds(
+        self,
+        channel: discord.abc.Messageable,
+        channel_id: int,
+        bot_message: discord.Message,
     ):
         max_tool_rounds = 5
 
@@ -3216,9 +5697,11 @@ class AICustomerService(commands.Cog, name="AI客服"):
                         '_responses_reasoning_items'
                     ]
                 self.conversations[channel_id].append(model_turn)
+                self._advance_last_message_id(channel_id, bot_message.id)
                 if len(text) > 2000:
                     for i in range(2000, len(text), 2000):
-                        await channel.send(text[i:i + 2000])
+                        sent = await channel.send(text[i:i + 2000])
+                        self._advance_last_message_id(channel_id, sent.id)
                 break
 
             if result['type'] == 'tool_calls':
@@ -3238,6 +5721,9 @@ class AICustomerService(commands.Cog, name="AI客服"):
                         '_responses_reasoning_items'
                     ]
                 self.conversations[channel_id].append(model_turn)
+                if result.get('text'):
+                    # 这条消息保留为可见回复
+                    self._advance_last_message_id(channel_id, bot_message.id)
 
                 # 逐个执行工具并收集结果
                 func_resp_parts = []
@@ -3292,14 +5778,22 @@ class AICustomerService(commands.Cog, name="AI客服"):
                 if exit_called:
                     final = result.get('text') or '对话已结束，感谢您的使用！'
                     try:
-                        await bot_message.edit(content=final[:2000])
+                        await self.edit_scheduler.flush(bot_message, final[:2000])
                     except discord.HTTPException:
                         pass
                     self.active_channels.discard(channel_id)
                     self.conversations.pop(channel_id, None)
+                    self._invalidate_conversion_cache(channel_id)
+                    self.channel_window_tokens.pop(channel_id, None)
+                    self.channel_last_message_id.pop(channel_id, None)
+                    self._summary_forget(channel_id)
+                    self._store_forget(channel_id, keep_inactive=True)
+                    self.image_dedup_stats.pop(channel_id, None)
+                    await self._gemini_context_cache_evict(channel_id)
                     self.recorded_context_message_ids.pop(channel_id, None)
                     self.channel_complainants.pop(channel_id, None)
                     self.channel_threads.pop(channel_id, None)
+                    self._prune_blob_store()
                     return
 
                 # debug 模式：显示工具调用详情
@@ -3323,7 +5817,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
                     bot_message = await channel.send("💭 处理中...")
                 else:
                     try:
-                        await bot_message.edit(content="💭 处理中...")
+                        await self.edit_scheduler.flush(bot_message, "💭 处理中...")
                     except discord.HTTPException:
                         pass
                 continue
@@ -3343,19 +5837,19 @@ class AICustomerService(commands.Cog, name="AI客服"):
             self.conversations[channel_id] = []
 
         combined_parts = []
-        for msg in messages:
-            user_msg = await self._build_user_message(msg)
+        built = await asyncio.gather(*(self._build_user_message(msg) for msg in messages))
+        for user_msg in built:
             combined_parts.extend(user_msg["parts"])
+        if self.link_prefetch_attach:
+            combined_parts.extend(await self._attach_prefetched_links(channel_id, messages))
 
         # 记录插入点，取消时据此回滚
         rollback_index = len(self.conversations[channel_id])
         self.conversations[channel_id].append({"role": "user", "parts": combined_parts})
+        self._advance_last_message_id(channel_id, max(m.id for m in messages))
 
-        conv = self.conversations[channel_id]
-        if len(conv) > self.max_history:
-            overflow = len(conv) - self.max_history
-            self.conversations[channel_id] = conv[-self.max_history:]
-            rollback_index = max(0, rollback_index - overflow)
+        overflow = self._trim_history(channel_id)
+        rollback_index = max(0, rollback_index - overflow)
 
         bot_message = await channel.send("💭 思考中...")
 
@@ -3371,7 +5865,9 @@ class AICustomerService(commands.Cog, name="AI客服"):
             convos = self.conversations.get(channel_id, [])
             if len(convos) > rollback_index:
                 del convos[rollback_index:]
+                self._invalidate_conversion_cache(channel_id)
             # 再尝试删除未完成的 bot 消息
+            self.edit_scheduler.discard(bot_message)
             try:
                 await bot_message.delete()
             except Exception:
@@ -3387,8 +5883,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
         seen_ids.add(message.id)
         user_msg = await self._build_user_message(message)
         self.conversations[channel_id].append(user_msg)
-        if len(self.conversations[channel_id]) > self.max_history:
-            self.conversations[channel_id] = self.conversations[channel_id][-self.max_history:]
+        self._advance_last_message_id(channel_id, message.id)
+        self._trim_history(channel_id)
 
     async def _seed_existing_bot_messages(
         self,
@@ -3399,7 +5895,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
         """自动开启前，读取频道里已经存在的其他 bot 消息作为上下文，不触发回复。"""
         bot_uid = self.bot.user.id if self.bot.user else None
         seeded = 0
-        async for msg in channel.history(limit=limit, oldest_first=True):
+        for msg in await self._oldest_messages(channel, limit):
             if msg.type not in (discord.MessageType.default, discord.MessageType.reply):
                 continue
             if not msg.author.bot:
@@ -3433,6 +5929,8 @@ class AICustomerService(commands.Cog, name="AI客服"):
         channel = message.channel
         channel_id = channel.id
         respond = self._should_respond(channel_id, message)
+        if respond:
+            self._start_link_prefetch(message.content)
 
         # 正在处理中：所有消息统一入队，避免并发修改对话历史
         if channel_id in self.processing_channels:
@@ -3489,6 +5987,9 @@ class AICustomerService(commands.Cog, name="AI客服"):
     @commands.Cog.listener()
     async def on_ready(self):
         """启动（或重连后首次 ready）时从 Discord 恢复分类内频道的对话与管理子区映射"""
+        # 新的网关会话可能漏掉断线期间的事件：消息缓存与预设变量整体作废
+        self.message_ring.clear()
+        self.preset_variables.invalidate()
         if self._restored_from_discord_once:
             return
         self._restored_from_discord_once = True
@@ -3497,12 +5998,15 @@ class AICustomerService(commands.Cog, name="AI客服"):
             await asyncio.sleep(2)
             await self._restore_auto_reply_state()
             await self._archive_orphan_admin_threads_at_startup()
+            self._prune_blob_store()
 
         asyncio.create_task(_delayed_restore())
 
     @commands.Cog.listener()
     async def on_guild_channel_create(self, channel):
         """检测指定分类下的新频道并启用自动回复"""
+        if self.message_cache_enabled and isinstance(channel, discord.TextChannel):
+            self.message_ring.start(channel.id)
         if not self.auto_reply_enabled:
             return
         if not isinstance(channel, discord.TextChannel):
@@ -3533,11 +6037,12 @@ class AICustomerService(commands.Cog, name="AI客服"):
             )
 
         try:
-            await channel.send(self.greeting_message)
+            greeting = await channel.send(self.greeting_message)
             self.conversations[channel.id].append({
                 "role": "model",
                 "parts": [{"text": self.greeting_message}]
             })
+            self._advance_last_message_id(channel.id, greeting.id)
             print(
                 f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
                 f"[AI客服] 新频道自动回复已启用: #{channel.name}"
@@ -3586,11 +6091,23 @@ class AICustomerService(commands.Cog, name="AI客服"):
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel):
         """频道删除时清理资源；若映射过管理子区则归档关闭"""
+        self.message_ring.drop(channel.id)
         thread = self.channel_threads.pop(channel.id, None)
         self.active_channels.discard(channel.id)
         self.channel_complainants.pop(channel.id, None)
-        self.conversations.pop(channel.id, None)
+        conv = self.conversations.pop(channel.id, None)
         self.recorded_context_message_ids.pop(channel.id, None)
+        self._invalidate_conversion_cache(channel.id)
+        self.channel_window_tokens.pop(channel.id, None)
+        self.channel_last_message_id.pop(channel.id, None)
+        self._summary_forget(channel.id)
+        self._store_forget(channel.id, keep_inactive=False)
+        self.image_dedup_stats.pop(channel.id, None)
+        self._forget_dormant(channel.id)
+        self._channel_download_semaphores.pop(channel.id, None)
+        await self._gemini_context_cache_evict(channel.id)
+        if conv:
+            self._prune_blob_store()
 
         if thread is not None:
             try:
@@ -3613,6 +6130,9 @@ class AICustomerService(commands.Cog, name="AI客服"):
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         """监听活跃频道中的消息；其他 bot 消息只记入上下文，不触发回复"""
+        if self.message_cache_enabled and message.guild is not None:
+            self.message_ring.observe(message)
+        self.preset_variables.on_channel_event(message.channel.id)
         if message.type not in (discord.MessageType.default, discord.MessageType.reply):
             return
         if message.channel.id not in self.active_channels:
@@ -3622,8 +6142,59 @@ class AICustomerService(commands.Cog, name="AI客服"):
         if not self._llm_configured():
             return
 
+        dormant = message.channel.id in self._dormant_channels
+        if not await self._ensure_hydrated(message.channel, before=message.id):
+            # 本条消息留在 Discord 历史里，下次重建时一并读入
+            return
+        if dormant and message.id <= self.channel_last_message_id.get(message.channel.id, 0):
+            # 共享的重建任务由其他触发（如管理指令注入，不带 before）发起：本条消息已随历史读入
+            return
         await self._handle_message(message)
 
+    @commands.Cog.listener()
+    async def on_thread_create(self, thread: discord.Thread):
+        if self.message_cache_enabled:
+            self.message_ring.start(thread.id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        # discord.py 2.4+ 的 payload.message 为编辑后的完整消息；旧版本拿不到时丢弃该频道缓存
+        self.message_ring.update(
+            payload.channel_id, payload.message_id, getattr(payload, 'message', None),
+        )
+        self.preset_variables.on_channel_event(payload.channel_id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self.message_ring.remove(payload.channel_id, (payload.message_id,))
+        self.preset_variables.on_channel_event(payload.channel_id)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        self.message_ring.remove(payload.channel_id, payload.message_ids)
+        self.preset_variables.on_channel_event(payload.channel_id)
+
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction: discord.Interaction):
+        """
+        懒加载时未扫描子区的旧管理消息按钮尚未注册 View：按 custom_id 现场绑定并转交回调，
+        之后的点击由 discord.py 直接分派。
+        """
+        if interaction.type != discord.InteractionType.component:
+            return
+        custom_id = str((interaction.data or {}).get('custom_id', ''))
+        m = re.fullmatch(r'humanoid_ai_(?:inj|pr)_(\d+)_(\d+)(?:_\d+)?', custom_id)
+        if not m:
+            return
+        source_channel_id, admin_message_id = int(m.group(1)), int(m.group(2))
+        if admin_message_id in self._bound_admin_views:
+            return
+        view = self._bind_admin_inject_view(source_channel_id, admin_message_id)
+        for item in view.children:
+            if getattr(item, 'custom_id', None) == custom_id:
+                await item.callback(interaction)
+                return
+
     # ── 斜杠命令 ──────────────────────────────────────────────
 
     @app_commands.command(name="ai客服", description="在当前频道手动开启或关闭AI客服")
@@ -3647,6 +6218,7 @@ class AICustomerService(commands.Cog, name="AI客服"):
                 )
                 return
             self.active_channels.add(channel_id)
+            self._forget_dormant(channel_id)
             ch = interaction.channel
             follow: list[str] = []
             if (
@@ -3693,9 +6265,18 @@ class AICustomerService(commands.Cog, name="AI客服"):
         else:
             self.active_channels.discard(channel_id)
             self.conversations.pop(channel_id, None)
+            self._invalidate_conversion_cache(channel_id)
+            self.channel_window_tokens.pop(channel_id, None)
+            self.channel_last_message_id.pop(channel_id, None)
+            self._summary_forget(channel_id)
+            self._store_forget(channel_id, keep_inactive=True)
+            self.image_dedup_stats.pop(channel_id, None)
+            self._forget_dormant(channel_id)
+            await self._gemini_context_cache_evict(channel_id)
             self.recorded_context_message_ids.pop(channel_id, None)
             self.channel_complainants.pop(channel_id, None)
             self.channel_threads.pop(channel_id, None)
+            self._prune_blob_store()
             await interaction.response.send_message("✅ AI客服已在此频道关闭", ephemeral=True)
             print(
                 f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
@@ -3729,18 +6310,21 @@ class AICustomerService(commands.Cog, name="AI客服"):
                 "role": "user",
                 "parts": [{"text": f"<odyxml:admin>{消息}</odyxml:admin>"}],
             }
-            if channel_id not in self.conversations:
-                self.conversations[channel_id] = []
-            self.conversations[channel_id].append(admin_msg)
-
             await interaction.response.send_message(
                 f"✅ 隐藏指令已注入，正在等待模型回复...\n> {消息}",
                 ephemeral=True,
             )
 
+            if not await self._ensure_hydrated(channel):
+                await interaction.followup.send("❌ 当前频道历史加载失败，请稍后重试", ephemeral=True)
+                return
+            if channel_id not in self.conversations:
+                self.conversations[channel_id] = []
+            self.conversations[channel_id].append(admin_msg)
+
             # 找到最近的投诉人（非 bot、非管理组）并 @ 提醒，再编辑为思考中
             mention_user = None
-            async for msg in channel.history(limit=50):
+            for msg in await self._recent_messages(channel, 50):
                 if not msg.author.bot and isinstance(msg.author, discord.Member) and not self._is_admin(msg.author):
                     mention_user = msg.author
                     break
@@ -3784,6 +6368,103 @@ class AICustomerService(commands.Cog, name="AI客服"):
             self.debug_channels.discard(channel_id)
             await interaction.response.send_message("🐛 调试模式已关闭", ephemeral=True)
 
+    @app_commands.command(name="ai状态", description="查看当前频道AI客服的上下文窗口与缓存状态")
+    async def show_status(self, interaction: discord.Interaction):
+        """仅管理员：当前频道历史窗口 token 估算及各缓存统计"""
+        if not isinstance(interaction.user, discord.Member) or not self._is_admin(interaction.user):
+            await interaction.response.send_message("❌ 你没有权限使用此命令", ephemeral=True)
+            return
+
+        channel_id = interaction.channel.id
+        conv = self.conversations.get(channel_id)
+        lines = [f"**AI客服状态** · provider `{self.provider.label}` · `{self.provider.model}`"]
+        if channel_id in self._dormant_channels:
+            lines.append("当前频道尚未加载（懒加载，首条新消息时重建对话）")
+        elif conv is None:
+            lines.append("当前频道没有对话上下文")
+        else:
+            if channel_id not in self.channel_window_tokens:
+                self.channel_window_tokens[channel_id] = self._history_window_start(conv)[1]
+            budget = self.history_max_input_tokens
+            lines.append(
+                f"历史窗口：{len(conv)} 回合，约 {self.channel_window_tokens[channel_id]} tokens"
+                + (f" / 预算 {budget}" if budget > 0 else "")
+                + f"（另含系统提示词与工具约 {self._fixed_prompt_tokens()} tokens）"
+            )
+        cs = self.conversion_stats
+        lines.append(
+            f"历史转换缓存：复用 {cs['turns_reused']} 回合，新转换 {cs['turns_converted']} 回合，"
+            f"重建 {cs['rebuilds']} 次"
+        )
+        if self.summary_enabled:
+            ss = self.summary_stats
+            lines.append(
+                f"滚动摘要：成功 {ss['runs']} 次，失败 {ss['failures']} 次，已折叠 {ss['turns_folded']} 回合"
+                + ("（当前频道摘要生成中）" if channel_id in self._summary_tasks else "")
+            )
+        if self.image_history_enabled:
+            ih = self.image_history_stats
+            lines.append(
+                f"历史图片降级：缩小 {ih['downscaled']} 次，改为占位 {ih['stubbed']} 次"
+                + ("" if self._image_history_active() else "（前缀缓存开启中，已停用）")
+            )
+        ds = self.image_dedup_stats.get(channel_id)
+        if self.image_dedup_enabled and ds:
+            lines.append(
+                f"重复图片：本工单 {ds['replies']} 次回复共省略 {ds['images']} 张，"
+                f"约 {ds['bytes'] / 1024 / 1024:.1f} MB、{ds['tokens']} tokens"
+            )
+        if self.message_cache_enabled:
+            mr = self.message_ring.stats()
+            lines.append(
+                f"消息缓存：{mr['channels']} 个频道，{mr['messages']}/{mr['capacity']} 条，"
+                f"约 {mr['bytes'] / 1024 / 1024:.1f}/{mr['max_bytes'] / 1024 / 1024:.0f} MB，"
+                f"命中 {mr['hits']}，回退 REST {mr['misses']}"
+            )
+        es = self.edit_scheduler.stats()
+        lines.append(
+            f"流式编辑：{es['streaming']} 条消息流式中，已发出 {es['sent']} 次，"
+            f"合并 {es['coalesced']} 次，限流退避 {es['rate_limited']} 次"
+        )
+        if self.failover_enabled and self.failover_providers:
+            fs = self.failover_stats
+            tripped = self.circuit_breaker.open_remaining()
+            lines.append(
+                f"故障切换：{fs['requests']} 次请求，对冲 {fs['hedged']} 次，切换 {fs['failovers']} 次，"
+                f"备用实例回复 {fs['backup_wins']} 次"
+                + (
+                    "；熔断中 " + "、".join(f"`{n}`（{s:.0f}s）" for n, s in tripped.items())
+                    if tripped else ""
+                )
+            )
+        hs = self.bot.http_transport.stats()
+        lines.append(
+            f"HTTP 连接：新建 {hs['created']}，复用 {hs['reused']}，"
+            f"预热 {hs['warmups']} 次（失败 {hs['warm_failures']}），预热目标 {hs['targets']} 个"
+        )
+        pv = self.preset_variables.stats()
+        lines.append(
+            f"预设变量：{pv['cached']}/{pv['variables']} 个已渲染，命中 {pv['hits']}，渲染 {pv['renders']} 次，"
+            f"失败 {pv['failures']} 次"
+        )
+        if self.link_prefetch_enabled:
+            lp = self.link_prefetch_stats
+            lines.append(
+                f"链接预取：已预取 {lp['started']} 个链接，fetch_messages 命中 {lp['hits']} 次"
+            )
+        ac = self.attachment_cache.stats()
+        lines.append(
+            f"附件下载缓存：{ac['entries']} 条，{ac['bytes'] / 1024 / 1024:.1f}/"
+            f"{ac['max_bytes'] / 1024 / 1024:.0f} MB，命中 {ac['hits']}，"
+            f"未命中 {ac['misses']}，淘汰 {ac['evictions']}"
+        )
+        bs = self.blob_store.stats()
+        lines.append(
+            f"附件 blob 内存：{bs['memory_entries']} 个，"
+            f"{bs['memory_bytes'] / 1024 / 1024:.1f}/{bs['memory_budget'] / 1024 / 1024:.0f} MB"
+        )
+        await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
 
 async def setup(bot):
     """Cog 加载入口"""
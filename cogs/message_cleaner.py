@@ -11,7 +11,6 @@ from typing import Optional
 
 DISCORD_EPOCH = 1420070400000
 import asyncio
-import aiohttp
 from collections import deque
 
 
@@ -73,134 +72,135 @@ class MessageCleaner(commands.Cog, name="一键冲水"):
         if sort_order == "asc" and cutoff_snowflake is not None:
             current_pivot_id = cutoff_snowflake
 
-        async with aiohttp.ClientSession() as session:
-            while not stop_event.is_set():
-                try:
-                    # 构造搜索 URL
-                    url = (
-                        f"https://discord.com/api/v9/guilds/{guild_id}/messages/search"
-                        f"?author_id={author_id}"
-                        f"&sort_by=timestamp"
-                        f"&sort_order={sort_order}"
-                        f"&offset=0"
-                        f"&include_nsfw=true"
-                    )
+        # 共用 Bot 的 HTTP 连接池（不在这里关闭）
+        session = self.bot.http_transport.session
+        while not stop_event.is_set():
+            try:
+                # 构造搜索 URL
+                url = (
+                    f"https://discord.com/api/v9/guilds/{guild_id}/messages/search"
+                    f"?author_id={author_id}"
+                    f"&sort_by=timestamp"
+                    f"&sort_order={sort_order}"
+                    f"&offset=0"
+                    f"&include_nsfw=true"
+                )
 
-                    # 如果指定了频道，添加频道参数
-                    if channel_id:
-                        url += f"&channel_id={channel_id}"
+                # 如果指定了频道，添加频道参数
+                if channel_id:
+                    url += f"&channel_id={channel_id}"
 
-                    if current_pivot_id != -1:
-                        if sort_order == "desc":
-                            url += f"&max_id={current_pivot_id}"
-                        else:
-                            url += f"&min_id={current_pivot_id}"
+                if current_pivot_id != -1:
+                    if sort_order == "desc":
+                        url += f"&max_id={current_pivot_id}"
+                    else:
+                        url += f"&min_id={current_pivot_id}"
 
-                    # desc 模式且有时间截止：限制搜索的最旧边界
-                    if sort_order == "desc" and cutoff_snowflake is not None:
-                        url += f"&min_id={cutoff_snowflake}"
+                # desc 模式且有时间截止：限制搜索的最旧边界
+                if sort_order == "desc" and cutoff_snowflake is not None:
+                    url += f"&min_id={cutoff_snowflake}"
 
-                    # 发送请求
-                    async with session.get(url, headers=headers) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            messages = data.get('messages', [])
+                # 发送请求
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 200:
+                        data = await response.json()
+                        messages = data.get('messages', [])
 
-                            if not messages:
-                                if progress_data.get('searched', 0) >= total_messages:
+                        if not messages:
+                            if progress_data.get('searched', 0) >= total_messages:
+                                progress_data['search_finished'] = True
+                                break
+                            else:
+                                if progress_data.get('search_paused', 0) >= 3:
                                     progress_data['search_finished'] = True
                                     break
+                                progress_data['search_paused'] = progress_data.get('search_paused', 0) + 1
+                                await asyncio.sleep(15)
+                                continue
+
+                        if total_messages == -1:
+                            total_messages = data.get('total_results', 0)
+
+                        # 处理搜索结果
+                        found_count = 0
+                        for message_group in messages:
+                            for message in message_group:
+                                message_id = int(message['id'])
+                                msg_channel_id = int(message['channel_id'])
+
+                                # 更新分页游标
+                                if sort_order == "desc":
+                                    # 跟踪最旧（最小）消息 ID
+                                    if message_id < current_pivot_id or current_pivot_id == -1:
+                                        current_pivot_id = message_id
                                 else:
-                                    if progress_data.get('search_paused', 0) >= 3:
-                                        progress_data['search_finished'] = True
-                                        break
-                                    progress_data['search_paused'] = progress_data.get('search_paused', 0) + 1
-                                    await asyncio.sleep(15)
-                                    continue
+                                    # 跟踪最新（最大）消息 ID
+                                    if message_id > current_pivot_id or current_pivot_id == -1:
+                                        current_pivot_id = message_id
 
-                            if total_messages == -1:
-                                total_messages = data.get('total_results', 0)
-
-                            # 处理搜索结果
-                            found_count = 0
-                            for message_group in messages:
-                                for message in message_group:
-                                    message_id = int(message['id'])
-                                    msg_channel_id = int(message['channel_id'])
-
-                                    # 更新分页游标
-                                    if sort_order == "desc":
-                                        # 跟踪最旧（最小）消息 ID
-                                        if message_id < current_pivot_id or current_pivot_id == -1:
-                                            current_pivot_id = message_id
-                                    else:
-                                        # 跟踪最新（最大）消息 ID
-                                        if message_id > current_pivot_id or current_pivot_id == -1:
-                                            current_pivot_id = message_id
-
-                                    # 检查是否是帖子首楼
-                                    if msg_channel_id == message_id:
-                                        progress_data['skipped_threads'] += 1
-                                        found_count += 1
-                                        continue
-
-                                    # 检查是否被标注
-                                    if message.get('pinned', False):
-                                        progress_data['skipped_pinned'] += 1
-                                        found_count += 1
-                                        continue
-
-                                    # 添加到队列
-                                    message_info = {
-                                        'id': message_id,
-                                        'channel_id': msg_channel_id,
-                                        'content': message.get('content', '')[:50]
-                                    }
-                                    message_queue.append(message_info)
+                                # 检查是否是帖子首楼
+                                if msg_channel_id == message_id:
+                                    progress_data['skipped_threads'] += 1
                                     found_count += 1
+                                    continue
 
-                            search_count += 1
-                            progress_data['searched'] += found_count
-                            progress_data['last_search_time'] = datetime.now()
-
-                            # 搜不到则退出
-                            if found_count == 0:
-                                if progress_data.get('searched', 0) >= total_messages:
-                                    progress_data['search_finished'] = True
-                                    break
-                                else:
-                                    if progress_data.get('search_paused', 0) >= 3:
-                                        progress_data['search_finished'] = True
-                                        break
-                                    progress_data['search_paused'] = progress_data.get('search_paused', 0) + 1
-                                    await asyncio.sleep(15)
+                                # 检查是否被标注
+                                if message.get('pinned', False):
+                                    progress_data['skipped_pinned'] += 1
+                                    found_count += 1
                                     continue
 
-                            # 检查是否达到最大消息数
-                            if progress_data['searched'] >= self.max_messages:
+                                # 添加到队列
+                                message_info = {
+                                    'id': message_id,
+                                    'channel_id': msg_channel_id,
+                                    'content': message.get('content', '')[:50]
+                                }
+                                message_queue.append(message_info)
+                                found_count += 1
+
+                        search_count += 1
+                        progress_data['searched'] += found_count
+                        progress_data['last_search_time'] = datetime.now()
+
+                        # 搜不到则退出
+                        if found_count == 0:
+                            if progress_data.get('searched', 0) >= total_messages:
                                 progress_data['search_finished'] = True
                                 break
+                            else:
+                                if progress_data.get('search_paused', 0) >= 3:
+                                    progress_data['search_finished'] = True
+                                    break
+                                progress_data['search_paused'] = progress_data.get('search_paused', 0) + 1
+                                await asyncio.sleep(15)
+                                continue
 
-                        elif response.status == 429:
-                            retry_after = int(response.headers.get('Retry-After', 10))
-                            progress_data['rate_limited'] = True
-                            await asyncio.sleep(retry_after)
-                            progress_data['rate_limited'] = False
-
-                        elif response.status == 401:
-                            progress_data['error'] = 'User Token 无效，请检查配置'
+                        # 检查是否达到最大消息数
+                        if progress_data['searched'] >= self.max_messages:
+                            progress_data['search_finished'] = True
                             break
 
-                        else:
-                            progress_data['error'] = f'API 错误: {response.status}'
-                            break
+                    elif response.status == 429:
+                        retry_after = int(response.headers.get('Retry-After', 10))
+                        progress_data['rate_limited'] = True
+                        await asyncio.sleep(retry_after)
+                        progress_data['rate_limited'] = False
 
-                    # 等待下一次搜索
-                    await asyncio.sleep(self.search_interval)
+                    elif response.status == 401:
+                        progress_data['error'] = 'User Token 无效，请检查配置'
+                        break
 
-                except Exception as e:
-                    progress_data['error'] = f'搜索错误: {str(e)}'
-                    break
+                    else:
+                        progress_data['error'] = f'API 错误: {response.status}'
+                        break
+
+                # 等待下一次搜索
+                await asyncio.sleep(self.search_interval)
+
+            except Exception as e:
+                progress_data['error'] = f'搜索错误: {str(e)}'
+                break
 
         progress_data['search_finished'] = True
     
@@ -1,5 +1,49 @@
 """工具模块"""
 from .config_loader import ConfigLoader
+from .edit_scheduler import EditScheduler
+from .http_transport import HTTPTransport
+from .attachment_cache import AttachmentCache
+from .blob_store import BlobStore, InlineRef, iter_blob_refs
+from .conversation_store import ConversationStore, dump_turn
+from .llm_providers import (
+    ClaudeMessagesProvider,
+    ClaudeOpenAIProvider,
+    GeminiProvider,
+    LLMProvider,
+    OpenAIResponsesProvider,
+    ProviderHTTPError,
+    create_provider,
+    provider_kinds,
+)
+from .image_variants import (
+    dhash_distance,
+    image_dhash,
+    images_match,
+    normalize_image,
+    probe_image_size,
+    resize_image,
+    transcode_image,
+)
+from .llm_failover import CircuitBreaker, StreamLeg, StreamRace, is_transient_error
+from .message_ring import MessageRing
+from .preset_variables import PresetRenderError, PresetVariable, PresetVariableRegistry
+from .sse import SSEDecoder, iter_sse, loads_json
+from .token_estimator import (
+    estimate_image_tokens,
+    estimate_text_tokens,
+    estimate_turn_tokens,
+    provider_family,
+)
 
-__all__ = ['ConfigLoader']
-
+__all__ = [
+    'ConfigLoader', 'BlobStore', 'InlineRef', 'iter_blob_refs',
+    'ConversationStore', 'dump_turn', 'AttachmentCache', 'MessageRing',
+    'PresetRenderError', 'PresetVariable', 'PresetVariableRegistry', 'EditScheduler', 'HTTPTransport',
+    'SSEDecoder', 'iter_sse', 'loads_json',
+    'LLMProvider', 'GeminiProvider', 'ClaudeOpenAIProvider', 'OpenAIResponsesProvider',
+    'ClaudeMessagesProvider', 'ProviderHTTPError', 'create_provider', 'provider_kinds',
+    'CircuitBreaker', 'StreamLeg', 'StreamRace', 'is_transient_error',
+    'normalize_image', 'probe_image_size', 'resize_image', 'transcode_image',
+    'image_dhash', 'dhash_distance', 'images_match',
+    'estimate_image_tokens', 'estimate_text_tokens', 'estimate_turn_tokens', 'provider_family',
+]
@@ -0,0 +1,144 @@
+"""
+Discord 附件下载缓存
+按附件 ID（+ 大小）索引到 BlobStore 中的原始字节：入库、重启补齐、fetch_messages 拉图共用，
+同一个 CDN 附件只下载一次。字节的内存预算与磁盘落盘由 BlobStore 负责，这里只维护 LRU 索引，
+按索引内附件的总字节数（而非条数）淘汰。
+persist 时记录索引的增删与使用顺序，由调用方取出（drain_changes）写入状态库，重启后 load 回来。
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+from .blob_store import BlobStore
+
+# https://cdn.discordapp.com/attachments/<channel_id>/<attachment_id>/<filename>?ex=...
+_ATTACHMENT_URL_RE = re.compile(
+    r"^https?://(?:cdn|media)\.discordapp\.(?:com|net)/(?:ephemeral-)?attachments/\d+/(\d+)/",
+    re.IGNORECASE,
+)
+
+
+class AttachmentCache:
+    """附件 ID -> (blob 摘要, Content-Type, 字节数) 的线程安全 LRU 索引，总字节数不超过 max_bytes"""
+
+    def __init__(self, blob_store: BlobStore, max_bytes: int = 256 * 1024 * 1024, persist: bool = False):
+        self.blob_store = blob_store
+        self.max_bytes = max(1, int(max_bytes))
+        self.persist = persist
+        self._index: 'OrderedDict[str, tuple[str, str, int]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # persist 时：键 -> (摘要, Content-Type, 字节数, 使用序号)，None 表示已移出索引
+        self._changes: dict[str, Optional[tuple[str, str, int, int]]] = {}
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(url: str, attachment_id: Optional[int] = None) -> Optional[str]:
+        """缓存键：优先用附件 ID；CDN 链接的签名参数会变，只从路径里解析 ID。非附件链接不缓存"""
+        if attachment_id:
+            return str(attachment_id)
+        m = _ATTACHMENT_URL_RE.match(url or '')
+        return m.group(1) if m else None
+
+    def lookup(self, key: str, size: Optional[int] = None) -> Optional[tuple[bytes, str]]:
+        """命中返回 (字节, Content-Type)；大小不符或 blob 已被清理视为未命中"""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None and size is not None and entry[2] != size:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self._touch(key)
+        try:
+            data = self.blob_store.get(entry[0])
+        except KeyError:
+            with self._lock:
+                if self._index.get(key) is entry:
+                    self._drop(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data, entry[1]
+
+    def store(self, key: str, data: bytes, content_type: str) -> None:
+        """记入缓存并按字节预算淘汰最久未用的条目；单个附件超过整个预算时不缓存"""
+        if len(data) > self.max_bytes:
+            return
+        digest = self.blob_store.put(data)
+        with self._lock:
+            if key in self._index:
+                self._drop(key)
+            self._index[key] = (digest, content_type, len(data))
+            self._bytes += len(data)
+            self._touch(key)
+            self._evict()
+
+    def set_max_bytes(self, max_bytes: int) -> None:
+        with self._lock:
+            self.max_bytes = max(1, int(max_bytes))
+            self._evict()
+
+    def digests(self) -> set[str]:
+        """索引中所有附件的 blob 摘要（清理 blob 时视为仍在使用）"""
+        with self._lock:
+            return {entry[0] for entry in self._index.values()}
+
+    def load(self, rows: Iterable[tuple[str, str, str, int, int]]) -> None:
+        """载入持久化的索引 [(键, 摘要, Content-Type, 字节数, 使用序号)]，按使用序号从旧到新"""
+        with self._lock:
+            for key, digest, content_type, size, used in sorted(rows, key=lambda r: r[4]):
+                if key in self._index:
+                    continue
+                self._index[key] = (digest, content_type, int(size))
+                self._bytes += int(size)
+                self._clock = max(self._clock, int(used))
+            self._evict()
+
+    def drain_changes(self) -> list[tuple]:
+        """
+        取出自上次以来的索引变化，作为状态库写操作：
+        ('attachment', 键, 摘要, Content-Type, 字节数, 使用序号) / ('drop_attachment', 键)
+        """
+        with self._lock:
+            changes, self._changes = self._changes, {}
+        return [
+            ('attachment', key, *entry) if entry is not None else ('drop_attachment', key)
+            for key, entry in changes.items()
+        ]
+
+    def _touch(self, key: str) -> None:
+        # 须持有 _lock
+        if self.persist:
+            self._clock += 1
+            self._changes[key] = (*self._index[key], self._clock)
+
+    def _drop(self, key: str) -> None:
+        # 须持有 _lock
+        self._bytes -= self._index.pop(key)[2]
+        if self.persist:
+            self._changes[key] = None
+
+    def _evict(self) -> None:
+        # 须持有 _lock
+        while self._bytes > self.max_bytes and self._index:
+            self._drop(next(iter(self._index)))
+            self.evictions += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._index),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
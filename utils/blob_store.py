@@ -0,0 +1,173 @@
+"""
+附件内容寻址存储
+按 sha256 存放附件字节：内存中保留一份按字节预算淘汰的 LRU，磁盘（data/ 下）保存全量。
+对话历史只保存摘要引用，请求序列化时再取回字节。
+"""
+import base64
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+
+class InlineRef:
+    """
+    请求体中的附件占位符：由各 provider 转换器生成，
+    序列化前由 AICustomerService._materialize_request 替换为真正的 base64 块。
+    """
+
+    __slots__ = ('kind', 'digest', 'mime', 'variants', 'dup_of', 'size', 'dims')
+
+    def __init__(
+        self,
+        kind: str,
+        digest: str,
+        mime: str,
+        variants: Optional[dict] = None,
+        dup_of: Optional[str] = None,
+        size: Optional[int] = None,
+        dims: Optional[tuple[int, int]] = None,
+    ):
+        self.kind = kind
+        self.digest = digest
+        self.mime = mime
+        self.variants = variants  # 入库时生成的缩放变体 {'2000': [摘要, mime, 字节数]}
+        self.dup_of = dup_of  # 频道内确认为同一张图的规范图片 blob 摘要
+        self.size = size  # blob 字节数（入库时记录；旧数据为 None）
+        self.dims = dims  # 图片 (宽, 高) 像素（入库时记录；旧数据为 None）
+
+    @property
+    def edge(self) -> Optional[int]:
+        """图片长边像素；未记录尺寸时为 None"""
+        return max(self.dims) if self.dims else None
+
+    def __repr__(self) -> str:
+        return f'<InlineRef {self.kind} {self.mime} {self.digest[:12]}>'
+
+
+class BlobStore:
+    """内容寻址的附件存储（线程安全，可在 asyncio.to_thread 中调用 put）"""
+
+    def __init__(self, root: str = 'data/blobs', memory_budget: int = 64 * 1024 * 1024):
+        self.root = Path(root)
+        self.memory_budget = max(0, int(memory_budget))
+        self._mem: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest_of(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def _path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def _remember(self, digest: str, data: bytes) -> None:
+        """放入内存 LRU（调用方持锁）；超出预算时淘汰最久未用的条目（磁盘上仍保留）"""
+        if digest in self._mem:
+            self._mem.move_to_end(digest)
+            return
+        if len(data) > self.memory_budget:
+            return
+        self._mem[digest] = data
+        self._mem_bytes += len(data)
+        while self._mem_bytes > self.memory_budget and self._mem:
+            _, old = self._mem.popitem(last=False)
+            self._mem_bytes -= len(old)
+
+    def put(self, data: bytes) -> str:
+        """写入字节并返回摘要；相同内容只落盘一次"""
+        digest = self.digest_of(data)
+        path = self._path(digest)
+        if path.exists():
+            # 刷新 mtime，避免刚被重新引用的旧文件在 prune 宽限期内被删
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f'{digest}.{os.getpid()}.{threading.get_ident()}.tmp')
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        with self._lock:
+            self._remember(digest, data)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        """按摘要取回字节；不存在时抛出 KeyError"""
+        with self._lock:
+            data = self._mem.get(digest)
+            if data is not None:
+                self._mem.move_to_end(digest)
+                return data
+        try:
+            data = self._path(digest).read_bytes()
+        except OSError:
+            raise KeyError(digest)
+        with self._lock:
+            self._remember(digest, data)
+        return data
+
+    def get_b64(self, digest: str) -> str:
+        return base64.b64encode(self.get(digest)).decode('ascii')
+
+    def has(self, digest: str) -> bool:
+        with self._lock:
+            if digest in self._mem:
+                return True
+        return self._path(digest).exists()
+
+    def prune(self, live: Iterable[str], grace_seconds: float = 600.0) -> int:
+        """
+        删除不在 live 集合中的 blob（内存与磁盘），返回删除的磁盘文件数。
+        grace_seconds 内写入的文件不删：下载完成到写入对话之间存在短暂窗口。
+        """
+        keep = set(live)
+        cutoff = time.time() - grace_seconds
+        with self._lock:
+            for digest in [d for d in self._mem if d not in keep]:
+                self._mem_bytes -= len(self._mem.pop(digest))
+        removed = 0
+        if not self.root.exists():
+            return 0
+        for sub in self.root.iterdir():
+            if not sub.is_dir():
+                continue
+            for f in sub.iterdir():
+                if f.name in keep or f.name.endswith('.tmp'):
+                    continue
+                try:
+                    if f.stat().st_mtime > cutoff:
+                        continue
+                    f.unlink()
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                'memory_entries': len(self._mem),
+                'memory_bytes': self._mem_bytes,
+                'memory_budget': self.memory_budget,
+            }
+
+
+def iter_blob_refs(turns: Iterable[Any]) -> Iterable[str]:
+    """遍历 Gemini 形态对话中引用到的 blob 摘要（含图片缩放变体）"""
+    for turn in turns:
+        if not isinstance(turn, dict):
+            continue
+        for p in turn.get('parts') or []:
+            if isinstance(p, dict):
+                inline: Optional[dict] = p.get('inlineData')
+                if isinstance(inline, dict) and inline.get('_blob'):
+                    yield inline['_blob']
+                    for variant in (inline.get('_variants') or {}).values():
+                        if variant:
+                            yield variant[0]
@@ -0,0 +1,188 @@
+"""
+对话状态持久化（SQLite WAL）
+保存每个投诉频道的对话回合、投诉人、管理子区映射、启用状态、最后处理的消息 ID
+以及挂有「发送指令」按钮的管理消息 ID。重启后直接回放本地状态，只需向 Discord 补齐更新的消息。
+附件下载缓存的索引（附件 ID -> blob 摘要）也存在这里，重启后补拉历史时同样能命中。
+所有方法都是同步阻塞的，调用方应放在 asyncio.to_thread 中执行。
+"""
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id      INTEGER PRIMARY KEY,
+    complainant_id  INTEGER,
+    thread_id       INTEGER,
+    active          INTEGER NOT NULL DEFAULT 1,
+    last_message_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS turns (
+    channel_id INTEGER NOT NULL,
+    seq        INTEGER NOT NULL,
+    turn       TEXT    NOT NULL,
+    PRIMARY KEY (channel_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS admin_messages (
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (channel_id, message_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS attachments (
+    attachment_key TEXT    PRIMARY KEY,
+    digest         TEXT    NOT NULL,
+    content_type   TEXT    NOT NULL,
+    size           INTEGER NOT NULL,
+    used           INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# 回合中不落盘的本地字段（可随时重新计算）
+_VOLATILE_KEYS = ('_tok',)
+
+
+def dump_turn(turn: dict) -> str:
+    """序列化单个 Gemini 形态回合；应在事件循环线程调用，避免与回合上的缓存写入并发"""
+    if any(k in turn for k in _VOLATILE_KEYS):
+        turn = {k: v for k, v in turn.items() if k not in _VOLATILE_KEYS}
+    return json.dumps(turn, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class ConversationStore:
+    """
+    单文件 SQLite（WAL 模式）状态库。写入以操作批次提交，一批一个事务：
+      ('meta', channel_id, complainant_id, thread_id, active, last_message_id)
+      ('insert', channel_id, seq, turn_json)
+      ('drop_before', channel_id, seq) / ('drop_after', channel_id, seq)
+      ('clear_turns', channel_id)
+      ('admin_message', channel_id, message_id)
+      ('delete_channel', channel_id)
+      ('attachment', key, digest, content_type, size, used) / ('drop_attachment', key)
+    """
+
+    def __init__(self, path: str = 'data/conversations.sqlite3'):
+        self.path = Path(path)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            conn.commit()
+            self._conn = conn
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            finally:
+                self._conn.close()
+                self._conn = None
+
+    def load_all(self) -> dict[int, dict[str, Any]]:
+        """读出全部频道状态：{channel_id: {complainant_id, thread_id, active, last_message_id, turns, seqs, admin_message_ids}}"""
+        self.open()
+        out: dict[int, dict[str, Any]] = {}
+        with self._lock:
+            for cid, comp, tid, active, last in self._conn.execute(
+                'SELECT channel_id, complainant_id, thread_id, active, last_message_id FROM channels'
+            ):
+                out[cid] = {
+                    'complainant_id': comp,
+                    'thread_id': tid,
+                    'active': bool(active),
+                    'last_message_id': last,
+                    'turns': [],
+                    'seqs': [],
+                    'admin_message_ids': [],
+                }
+            for cid, seq, raw in self._conn.execute(
+                'SELECT channel_id, seq, turn FROM turns ORDER BY channel_id, seq'
+            ):
+                entry = out.get(cid)
+                if entry is None:
+                    continue
+                try:
+                    entry['turns'].append(json.loads(raw))
+                except json.JSONDecodeError:
+                    continue
+                entry['seqs'].append(seq)
+            for cid, mid in self._conn.execute(
+                'SELECT channel_id, message_id FROM admin_messages ORDER BY message_id'
+            ):
+                entry = out.get(cid)
+                if entry is not None:
+                    entry['admin_message_ids'].append(mid)
+        return out
+
+    def apply(self, ops: Iterable[tuple]) -> None:
+        """在一个事务内执行一批写操作"""
+        self.open()
+        with self._lock:
+            conn = self._conn
+            with conn:
+                for op in ops:
+                    kind = op[0]
+                    if kind == 'insert':
+                        conn.execute(
+                            'INSERT OR REPLACE INTO turns (channel_id, seq, turn) VALUES (?, ?, ?)',
+                            op[1:],
+                        )
+                    elif kind == 'meta':
+                        conn.execute(
+                            'INSERT INTO channels '
+                            '(channel_id, complainant_id, thread_id, active, last_message_id) '
+                            'VALUES (?, ?, ?, ?, ?) ON CONFLICT(channel_id) DO UPDATE SET '
+                            'complainant_id=excluded.complainant_id, thread_id=excluded.thread_id, '
+                            'active=excluded.active, last_message_id=excluded.last_message_id',
+                            (op[1], op[2], op[3], int(bool(op[4])), op[5]),
+                        )
+                    elif kind == 'drop_before':
+                        conn.execute('DELETE FROM turns WHERE channel_id = ? AND seq < ?', op[1:])
+                    elif kind == 'drop_after':
+                        conn.execute('DELETE FROM turns WHERE channel_id = ? AND seq > ?', op[1:])
+                    elif kind == 'clear_turns':
+                        conn.execute('DELETE FROM turns WHERE channel_id = ?', op[1:])
+                    elif kind == 'admin_message':
+                        conn.execute(
+                            'INSERT OR IGNORE INTO admin_messages (channel_id, message_id) VALUES (?, ?)',
+                            op[1:],
+                        )
+                    elif kind == 'delete_channel':
+                        for table in ('turns', 'admin_messages', 'channels'):
+                            conn.execute(f'DELETE FROM {table} WHERE channel_id = ?', op[1:])
+                    elif kind == 'attachment':
+                        conn.execute(
+                            'INSERT OR REPLACE INTO attachments '
+                            '(attachment_key, digest, content_type, size, used) VALUES (?, ?, ?, ?, ?)',
+                            op[1:],
+                        )
+                    elif kind == 'drop_attachment':
+                        conn.execute('DELETE FROM attachments WHERE attachment_key = ?', op[1:])
+                    else:
+                        raise ValueError(f'未知的存储操作: {kind}')
+
+    def load_attachments(self) -> list[tuple[str, str, str, int, int]]:
+        """读出附件缓存索引 [(键, 摘要, Content-Type, 字节数, 使用序号)]，按使用序号从旧到新"""
+        self.open()
+        with self._lock:
+            return list(self._conn.execute(
+                'SELECT attachment_key, digest, content_type, size, used FROM attachments ORDER BY used'
+            ))
+
+    def compact(self) -> None:
+        """合并 WAL 回主库并回收空闲页"""
+        self.open()
+        with self._lock:
+            self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self._conn.execute('VACUUM')
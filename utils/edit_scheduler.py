@@ -0,0 +1,169 @@
+"""
+流式回复的消息编辑合并器
+各后端的流式循环只调用 update() 提交「当前全文」（不等待 Discord），由后台任务按节奏发出编辑：
+每条消息只保留最新文本；同一消息同时最多一个编辑在途；所有频道共享每秒编辑数预算，
+并发流式的频道越多，每条消息的间隔越长；观察到限流（429 或 discord.py 内部等待导致的慢响应）时该消息间隔加倍，
+之后随正常响应逐步恢复。最终结果用 flush() 立即写入，保证不会被更早的编辑覆盖。
+只应在事件循环线程中使用。
+"""
+import asyncio
+import contextlib
+import time
+from typing import Any, Callable, Optional, Union
+
+import discord
+
+
+class _EditState:
+    __slots__ = ('message', 'text', 'last_edit', 'interval', 'task')
+
+    def __init__(self, message: Any, interval: float):
+        self.message = message
+        # 待发送的最新文本（或发送时才拼接的回调）；None 表示没有待发送内容
+        self.text: Union[str, Callable[[], str], None] = None
+        self.last_edit = 0.0
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None  # 在途的编辑
+
+
+class EditScheduler:
+    def __init__(
+        self,
+        edits_per_second: float = 5.0,
+        min_interval: float = 1.0 / 3,
+        max_interval: float = 5.0,
+        slow_edit_seconds: float = 1.5,
+    ):
+        self.edits_per_second = max(0.1, float(edits_per_second))
+        self.min_interval = max(0.0, float(min_interval))
+        self.max_interval = max(self.min_interval, float(max_interval))
+        self.slow_edit_seconds = slow_edit_seconds  # 单次编辑超过该耗时视为被限流
+        self._states: dict[int, _EditState] = {}
+        self._tokens = self.edits_per_second
+        self._refilled_at = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+
+    # ── 提交 ──────────────────────────────────────────
+
+    def update(self, message: Any, text: Union[str, Callable[[], str]]) -> None:
+        """
+        提交消息的最新全文（不阻塞）；尚未发出的旧文本被覆盖。
+        text 可以是回调：真正发出编辑时才调用，流式循环不必每个增量都拼接全文。
+        """
+        s = self._states.get(message.id)
+        if s is None:
+            s = _EditState(message, self.min_interval)
+            self._states[message.id] = s
+        elif s.text is not None:
+            self.coalesced += 1
+        s.message = message
+        s.text = text
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run())
+
+    async def flush(self, message: Any, text: str) -> None:
+        """立即写入最终文本：丢弃待发送内容并等待在途编辑结束，编辑失败时向调用方抛出"""
+        s = self._states.get(message.id)
+        if s is not None:
+            s.text = None
+            if s.task is not None:
+                with contextlib.suppress(Exception):
+                    await asyncio.shield(s.task)
+        self._take_token(force=True)
+        await self._edit(message, text, s)
+
+    def discard(self, message: Any) -> None:
+        """消息即将删除：丢弃待发送内容"""
+        s = self._states.pop(message.id, None)
+        if s is not None:
+            s.text = None
+
+    # ── 调度 ──────────────────────────────────────────
+
+    def _take_token(self, force: bool = False) -> bool:
+        now = time.monotonic()
+        self._tokens = min(
+            self.edits_per_second,
+            self._tokens + (now - self._refilled_at) * self.edits_per_second,
+        )
+        self._refilled_at = now
+        if self._tokens >= 1 or force:
+            # 最终编辑不等预算，但欠账最多一秒的量
+            self._tokens = max(-self.edits_per_second, self._tokens - 1)
+            return True
+        return False
+
+    def _interval(self, s: _EditState, active: int) -> float:
+        # 全局预算按正在流式的消息数均分
+        return max(s.interval, active / self.edits_per_second)
+
+    async def _edit(self, message: Any, text: str, s: Optional[_EditState]) -> None:
+        started = time.monotonic()
+        limited = False
+        try:
+            await message.edit(content=text)
+            self.sent += 1
+        except discord.HTTPException as e:
+            limited = getattr(e, 'status', None) == 429
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            if s is not None:
+                s.last_edit = time.monotonic()
+                if limited or elapsed >= self.slow_edit_seconds:
+                    self.rate_limited += 1
+                    s.interval = min(self.max_interval, max(s.interval, self.min_interval) * 2)
+                else:
+                    s.interval = max(self.min_interval, s.interval * 0.8)
+
+    async def _dispatch(self, s: _EditState, text: str) -> None:
+        try:
+            await self._edit(s.message, text, s)
+        except discord.HTTPException:
+            pass
+        finally:
+            s.task = None
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while self._states:
+            now = time.monotonic()
+            pending = [s for s in self._states.values() if s.text is not None]
+            active = max(1, len(pending))
+            wait = 10.0
+            for s in sorted(pending, key=lambda s: s.last_edit):
+                if s.task is not None:
+                    continue
+                due = s.last_edit + self._interval(s, active)
+                if due > now:
+                    wait = min(wait, due - now)
+                    continue
+                if not self._take_token():
+                    wait = min(wait, (1 - self._tokens) / self.edits_per_second)
+                    break
+                text, s.text = s.text, None
+                if callable(text):
+                    text = text()
+                s.task = asyncio.ensure_future(self._dispatch(s, text))
+            # 空闲超过 10 秒的消息不再跟踪（流式已结束或出错）
+            for mid in [
+                mid for mid, s in self._states.items()
+                if s.text is None and s.task is None and now - s.last_edit > 10
+            ]:
+                self._states.pop(mid, None)
+            self._wakeup.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.01, wait))
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'streaming': sum(1 for s in self._states.values() if s.text is not None or s.task),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'rate_limited': self.rate_limited,
+        }
@@ -0,0 +1,182 @@
+"""
+Bot 全局共用的出站 HTTP 传输层
+所有 Cog 共用一个 aiohttp.ClientSession（按主机限制连接数、缓存 DNS、长 keep-alive），
+openai SDK 的各个客户端共用一个 httpx 连接池（openai 包按需导入）。
+登记的预热目标（如 LLM 后端地址）在登记时先建立连接（TCP + TLS），
+之后空闲超过 keep_warm_interval 时在后台向其根路径发一次 GET 续上连接，安静一段时间后的第一次回复不必重新握手。
+只应在事件循环线程中使用。
+"""
+import asyncio
+import time
+from typing import Any, Iterable, Optional
+
+import aiohttp
+from yarl import URL
+
+
+class HTTPTransport:
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 16,
+        dns_cache_ttl: float = 300,
+        keepalive_timeout: float = 75,
+        keep_warm_interval: float = 45,
+        warm_connections: int = 2,
+    ):
+        self.limit = max(1, int(limit))
+        self.limit_per_host = max(1, int(limit_per_host))
+        self.dns_cache_ttl = max(0.0, float(dns_cache_ttl))
+        self.keepalive_timeout = max(1.0, float(keepalive_timeout))
+        self.keep_warm_interval = max(0.0, float(keep_warm_interval))  # 0 表示不做空闲预热
+        self.warm_connections = max(1, int(warm_connections))
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._httpx_client: Any = None
+        # 登记方 -> {(origin, 'aiohttp' | 'httpx')}
+        self._warm_targets: dict[str, set[tuple[str, str]]] = {}
+        self._last_used: dict[tuple[str, str], float] = {}  # (origin, client) -> monotonic 最近一次请求结束
+        self._warm_task: Optional[asyncio.Task] = None
+        self._warming: dict[tuple[str, str], asyncio.Task] = {}
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.warmups = 0
+        self.warm_failures = 0
+
+    # ── 客户端 ──────────────────────────────────────────
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """共用的 aiohttp 会话（首次访问时创建；调用方不要关闭它）"""
+        if self._session is None or self._session.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_request_end.append(self._on_aiohttp_request_end)
+            trace.on_connection_create_end.append(self._on_connection_created)
+            trace.on_connection_reuseconn.append(self._on_connection_reused)
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                use_dns_cache=self.dns_cache_ttl > 0,
+                ttl_dns_cache=int(self.dns_cache_ttl) or None,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, trace_configs=[trace])
+        return self._session
+
+    def httpx_client(self) -> Any:
+        """openai SDK 共用的 httpx 连接池（AsyncOpenAI(http_client=...)）；未安装 openai 时抛 ImportError"""
+        if self._httpx_client is None or self._httpx_client.is_closed:
+            import httpx
+            from openai import DefaultAsyncHttpxClient
+
+            self._httpx_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.limit,
+                    max_keepalive_connections=self.limit_per_host,
+                    keepalive_expiry=self.keepalive_timeout,
+                ),
+                event_hooks={'response': [self._on_httpx_response]},
+            )
+        return self._httpx_client
+
+    async def close(self) -> None:
+        if self._warm_task is not None:
+            self._warm_task.cancel()
+            self._warm_task = None
+        for task in self._warming.values():
+            task.cancel()
+        self._warming.clear()
+        if self._httpx_client is not None:
+            await self._httpx_client.aclose()
+            self._httpx_client = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    # ── 统计 ──────────────────────────────────────────
+
+    @staticmethod
+    def _origin(url: Any) -> str:
+        u = URL(str(url))
+        return str(u.origin()) if u.is_absolute() else ''
+
+    async def _on_aiohttp_request_end(self, _session, _ctx, params) -> None:
+        self._last_used[(self._origin(params.url), 'aiohttp')] = time.monotonic()
+
+    async def _on_connection_created(self, _session, _ctx, _params) -> None:
+        self.connections_created += 1
+
+    async def _on_connection_reused(self, _session, _ctx, _params) -> None:
+        self.connections_reused += 1
+
+    async def _on_httpx_response(self, response: Any) -> None:
+        self._last_used[(self._origin(response.request.url), 'httpx')] = time.monotonic()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'created': self.connections_created,
+            'reused': self.connections_reused,
+            'warmups': self.warmups,
+            'warm_failures': self.warm_failures,
+            'targets': len(set().union(*self._warm_targets.values())) if self._warm_targets else 0,
+        }
+
+    # ── 预热 ──────────────────────────────────────────
+
+    def set_warm_targets(self, owner: str, targets: Iterable[tuple[str, str]]) -> None:
+        """
+        登记 owner 需要保持连接的地址 [(url, 'aiohttp' | 'httpx')]（覆盖该 owner 之前的登记）；
+        新登记的地址立即在后台预热
+        """
+        new = {(self._origin(url), client) for url, client in targets if self._origin(url)}
+        known = set().union(*self._warm_targets.values()) if self._warm_targets else set()
+        if new:
+            self._warm_targets[owner] = new
+        else:
+            self._warm_targets.pop(owner, None)
+        for target in new - known:
+            self._warm_soon(target)
+        if self._warm_targets and self.keep_warm_interval > 0 and (
+            self._warm_task is None or self._warm_task.done()
+        ):
+            self._warm_task = asyncio.ensure_future(self._keep_warm_loop())
+
+    def _warm_soon(self, target: tuple[str, str]) -> None:
+        task = self._warming.get(target)
+        if task is None or task.done():
+            task = asyncio.ensure_future(self._warm(target))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._warming[target] = task
+
+    async def _warm(self, target: tuple[str, str]) -> None:
+        """
+        对 origin 根路径并发发出 warm_connections 个 GET（通常是很小的 404）：连接建立后留在连接池中。
+        不用 HEAD：部分服务端的 HEAD 响应不带 Content-Length，客户端无法复用该连接
+        """
+        origin, client = target
+        timeout = 10
+
+        async def one() -> None:
+            if client == 'httpx':
+                resp = await self.httpx_client().get(origin, timeout=timeout)
+                await resp.aclose()
+            else:
+                async with self.session.get(
+                    origin, allow_redirects=False, timeout=aiohttp.ClientTimeout(total=timeout),
+                ) as resp:
+                    await resp.read()
+
+        results = await asyncio.gather(*(one() for _ in range(self.warm_connections)), return_exceptions=True)
+        if any(isinstance(r, BaseException) for r in results):
+            self.warm_failures += 1
+        else:
+            self.warmups += 1
+        # 失败也记一次，避免对不可达的地址每轮重试
+        self._last_used[target] = time.monotonic()
+
+    async def _keep_warm_loop(self) -> None:
+        while self._warm_targets and self.keep_warm_interval > 0:
+            await asyncio.sleep(max(1.0, self.keep_warm_interval / 3))
+            now = time.monotonic()
+            for target in set().union(*self._warm_targets.values()):
+                if now - self._last_used.get(target, 0.0) >= self.keep_warm_interval:
+                    self._warm_soon(target)
@@ -0,0 +1,359 @@
+"""
+图片尺寸探测、多规格变体、按字节预算转码与感知哈希
+probe_image_size 只解析文件头（PNG/GIF/JPEG/WEBP/BMP），不做完整解码；
+normalize_image 在进程池中执行：一次解码，按各 provider 像素上限生成缩放变体，
+可选地按 transcode_image 的字节/像素预算重新编码（WebP/JPEG/调色板 PNG），并顺带计算 dHash；
+image_dhash 供无需缩放的小图单独计算 dHash（同样应放在进程池中）；
+dHash 只用于筛选候选，是否同一张图由 images_match 逐块比较像素确认（同样应放在进程池中）。
+"""
+import io
+import math
+import struct
+from typing import Any, Optional
+
+
+def probe_image_size(data: bytes) -> Optional[tuple[int, int]]:
+    """从文件头读取 (宽, 高)；无法识别时返回 None"""
+    if len(data) < 26:
+        return None
+    head = data[:32]
+    if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+        w, h = struct.unpack('>II', head[16:24])
+        return w, h
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        w, h = struct.unpack('<HH', head[6:10])
+        return w, h
+    if head.startswith(b'BM'):
+        w, h = struct.unpack('<ii', head[18:26])
+        return w, abs(h)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return _probe_webp(data)
+    if head[:2] == b'\xff\xd8':
+        return _probe_jpeg(data)
+    return None
+
+
+def _probe_webp(data: bytes) -> Optional[tuple[int, int]]:
+    chunk = data[12:16]
+    if chunk == b'VP8X' and len(data) >= 30:
+        w = int.from_bytes(data[24:27], 'little') + 1
+        h = int.from_bytes(data[27:30], 'little') + 1
+        return w, h
+    if chunk == b'VP8L' and len(data) >= 25:
+        b = data[21:25]
+        w = 1 + (((b[1] & 0x3F) << 8) | b[0])
+        h = 1 + (((b[3] & 0x0F) << 10) | (b[2] << 2) | ((b[1] & 0xC0) >> 6))
+        return w, h
+    if chunk == b'VP8 ' and len(data) >= 30:
+        w, h = struct.unpack('<HH', data[26:30])
+        return w & 0x3FFF, h & 0x3FFF
+    return None
+
+
+def _probe_jpeg(data: bytes) -> Optional[tuple[int, int]]:
+    i = 2
+    n = len(data)
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            i += 2 if marker != 0xFF else 1
+            continue
+        seg_len = struct.unpack('>H', data[i + 2:i + 4])[0]
+        # SOF0..SOF15，排除 DHT(C4)/JPG(C8)/DAC(CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            h, w = struct.unpack('>HH', data[i + 5:i + 9])
+            return w, h
+        i += 2 + seg_len
+    return None
+
+
+def _encode(img: Any, content_type: str) -> tuple[bytes, str]:
+    mime_lower = content_type.lower()
+    if 'webp' in mime_lower:
+        out_fmt, out_mime = 'WEBP', 'image/webp'
+    elif 'png' in mime_lower:
+        out_fmt, out_mime = 'PNG', 'image/png'
+    elif 'gif' in mime_lower:
+        out_fmt, out_mime = 'PNG', 'image/png'
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+    else:
+        out_fmt, out_mime = 'JPEG', 'image/jpeg'
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGB')
+
+    buf = io.BytesIO()
+    save_kwargs: dict[str, Any] = {}
+    if out_fmt == 'JPEG':
+        save_kwargs['quality'] = 92
+        save_kwargs['optimize'] = True
+    elif out_fmt == 'WEBP':
+        save_kwargs['quality'] = 92
+    img.save(buf, format=out_fmt, **save_kwargs)
+    return buf.getvalue(), out_mime
+
+
+def resize_image(data: bytes, content_type: str, max_dim: int) -> tuple[bytes, str]:
+    """长边超过 max_dim 时 LANCZOS 缩放并按原格式重新编码；无需缩放或失败时原样返回"""
+    if not content_type.startswith('image/') or not data:
+        return data, content_type
+    size = probe_image_size(data)
+    if size is not None and size[0] <= max_dim and size[1] <= max_dim:
+        return data, content_type
+    try:
+        from PIL import Image
+
+        img = Image.open(io.BytesIO(data))
+        w, h = img.size
+        if w <= max_dim and h <= max_dim:
+            return data, content_type
+        scale = max_dim / float(max(w, h))
+        img.load()
+        resized = img.resize(
+            (max(1, int(w * scale)), max(1, int(h * scale))), Image.LANCZOS,
+        )
+        return _encode(resized, content_type)
+    except Exception:
+        return data, content_type
+
+
+def _dhash(img: Any) -> str:
+    """64 位差值哈希（9x8 灰度缩略图相邻像素比较），返回 16 位十六进制"""
+    from PIL import Image
+
+    px = img.convert('L').resize((9, 8), Image.LANCZOS, reducing_gap=2.0).tobytes()
+    bits = 0
+    for row in range(8):
+        base = row * 9
+        for col in range(8):
+            bits = (bits << 1) | (px[base + col] > px[base + col + 1])
+    return f'{bits:016x}'
+
+
+def image_dhash(data: bytes) -> Optional[str]:
+    """计算图片的 dHash；无法解码时返回 None"""
+    try:
+        from PIL import Image
+
+        img = Image.open(io.BytesIO(data))
+        if img.format == 'JPEG':
+            # JPEG 可按 1/8 比例解码，哈希只需要极小的缩略图
+            img.draft('L', (64, 64))
+        return _dhash(img)
+    except Exception:
+        return None
+
+
+def dhash_distance(a: str, b: str) -> int:
+    """两个 dHash 的汉明距离"""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def images_match(a: bytes, b: bytes, max_tile_diff: float = 16.0, tile: int = 8) -> bool:
+    """
+    两张图是否为同一张（允许重新编码/轻度缩放）：宽高比一致，缩放到较小一张的原始尺寸（长边最多 2048）后把亮度差
+    按 tile×tile 像素分块取平均，每一块的平均差都不超过 max_tile_diff（0–255）。
+    按原始分辨率比较，布局相同、只改了一个字的截图在变化处的块上差异也很明显，不会被合并；判断偏保守，拿不准时返回 False。
+    无法解码时返回 False。
+    """
+    try:
+        from PIL import Image, ImageChops
+
+        imgs = []
+        for data in (a, b):
+            img = Image.open(io.BytesIO(data))
+            if img.format == 'JPEG':
+                img.draft('L', (2048, 2048))
+            imgs.append(_flatten_alpha(img).convert('L'))
+        (wa, ha), (wb, hb) = imgs[0].size, imgs[1].size
+        if abs(wa / ha - wb / hb) > 0.02 * (wa / ha):
+            return False
+        # 比较尺寸：不放大较小的一张，长边最多 2048
+        scale = min(1.0, 2048 / max(wa, ha), wb / wa)
+        size = (max(tile, int(wa * scale)), max(tile, int(ha * scale)))
+        pa, pb = (img.resize(size, Image.BOX) for img in imgs)
+        grid = (max(1, size[0] // tile), max(1, size[1] // tile))
+        tiles = ImageChops.difference(pa, pb).resize(grid, Image.BOX)
+        return max(tiles.tobytes()) <= max_tile_diff
+    except Exception:
+        return False
+
+
+def _luma_psnr(a: Any, b: Any) -> float:
+    """两张同尺寸图片亮度通道的 PSNR（dB），用作文字可读性的下限指标"""
+    from PIL import ImageChops, ImageStat
+
+    diff = ImageChops.difference(a.convert('L'), b.convert('L'))
+    rms = ImageStat.Stat(diff).rms[0]
+    if rms <= 0:
+        return 99.0
+    return 20 * math.log10(255.0 / rms)
+
+
+def _flatten_alpha(img: Any) -> Any:
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        from PIL import Image
+
+        rgba = img.convert('RGBA')
+        bg = Image.new('RGB', rgba.size, (255, 255, 255))
+        bg.paste(rgba, mask=rgba.split()[-1])
+        return bg
+    return img.convert('RGB') if img.mode != 'RGB' else img
+
+
+def _is_ui_like(img: Any, max_colors: int) -> bool:
+    """界面截图通常颜色很少：在缩略图上统计颜色数"""
+    thumb = img.convert('RGB')
+    thumb.thumbnail((256, 256))
+    return thumb.getcolors(maxcolors=max_colors) is not None
+
+
+def transcode_image(
+    img: Any,
+    content_type: str,
+    original: Optional[bytes],
+    *,
+    max_bytes: int,
+    max_pixels: int,
+    min_psnr: float,
+    palette_colors: int = 256,
+    webp: bool = True,
+) -> tuple[bytes, str, dict[str, Any]]:
+    """
+    按预算重新编码已解码的图片：先把像素数压到 max_pixels 内，再依次尝试
+    调色板 PNG（仅颜色很少的界面截图）、WebP/JPEG 多档质量，取第一个既不超过 max_bytes
+    又满足亮度 PSNR ≥ min_psnr 的结果；都超预算时取满足 PSNR 的最小者。
+    original 为原始字节：结果不比原图小且原图像素在预算内时保留原图。
+    返回 (字节, mime, 信息)；信息含 format / quality / psnr。
+    """
+    from PIL import Image
+
+    w, h = img.size
+    if w * h > max_pixels:
+        scale = math.sqrt(max_pixels / float(w * h))
+        img = img.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.LANCZOS)
+        original = None
+    has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+    reference = img.convert('RGBA' if has_alpha else 'RGB')
+    # PSNR 在铺白底后比较：透明像素下的 RGB 不可见，JPEG 会铺白底、WebP 会丢弃这部分颜色
+    flat_reference = _flatten_alpha(reference)
+
+    candidates: list[tuple[str, Optional[int]]] = []
+    if palette_colors > 1 and _is_ui_like(reference, palette_colors):
+        candidates.append(('PNG8', None))
+    lossy = 'WEBP' if webp else 'JPEG'
+    for q in (90, 82, 74, 66, 58, 50):
+        candidates.append((lossy, q))
+
+    best: Optional[tuple[bytes, str, dict[str, Any]]] = None
+    for fmt, quality in candidates:
+        buf = io.BytesIO()
+        if fmt == 'PNG8':
+            quantized = reference.quantize(
+                colors=palette_colors,
+                method=Image.Quantize.FASTOCTREE if has_alpha else Image.Quantize.MEDIANCUT,
+            )
+            quantized.save(buf, format='PNG', optimize=True)
+            mime = 'image/png'
+            decoded = quantized
+        elif fmt == 'WEBP':
+            reference.save(buf, format='WEBP', quality=quality, method=4)
+            mime = 'image/webp'
+            decoded = None
+        else:
+            _flatten_alpha(reference).save(
+                buf, format='JPEG', quality=quality, optimize=True, progressive=True,
+            )
+            mime = 'image/jpeg'
+            decoded = None
+        raw = buf.getvalue()
+        if decoded is None:
+            decoded = Image.open(io.BytesIO(raw))
+        psnr = _luma_psnr(flat_reference, _flatten_alpha(decoded))
+        if psnr < min_psnr:
+            # 质量只会越来越低：有损档位一旦不达标即停止
+            if fmt == 'PNG8':
+                continue
+            break
+        info = {'format': fmt, 'quality': quality, 'psnr': round(psnr, 2)}
+        if best is None or len(raw) < len(best[0]):
+            best = (raw, mime, info)
+        if len(raw) <= max_bytes:
+            break
+
+    if best is None or (original is not None and len(best[0]) >= len(original)):
+        if original is not None:
+            return original, content_type, {'format': 'original', 'quality': None, 'psnr': 99.0}
+        return _encode(img, content_type) + ({'format': 'reencoded', 'quality': None, 'psnr': 99.0},)
+    return best
+
+
+def normalize_image(
+    data: bytes,
+    content_type: str,
+    max_dim: int,
+    variant_dims: tuple[int, ...] = (),
+    transcode: Optional[dict[str, Any]] = None,
+) -> dict[str, Any]:
+    """
+    入库时的一次性图片处理（供 ProcessPoolExecutor 调用，参数与返回值均可 pickle）：
+    主图限制在 max_dim 内；variant_dims 中每个更小的上限各生成一个变体（原图已满足则为 None）。
+    transcode 给出时（transcode_image 的关键字参数），主图与变体都按字节/像素预算重新编码。
+    返回 {'data', 'mime', 'size': (w, h) | None, 'variants': {dim: (bytes, mime) | None},
+          'dhash': 原图 dHash | None（未解码时为 None）}
+    """
+    out: dict[str, Any] = {
+        'data': data,
+        'mime': content_type,
+        'size': probe_image_size(data),
+        'variants': {dim: None for dim in variant_dims},
+        'dhash': None,
+    }
+    if not content_type.startswith('image/') or not data:
+        return out
+    size = out['size']
+    limits = [max_dim, *variant_dims]
+    within_budget = transcode is None or (
+        len(data) <= transcode['max_bytes']
+        and (size is None or size[0] * size[1] <= transcode['max_pixels'])
+    )
+    if size is not None and max(size) <= min(limits) and within_budget:
+        return out
+    try:
+        from PIL import Image
+
+        img = Image.open(io.BytesIO(data))
+        w, h = img.size
+        out['size'] = (w, h)
+        img.load()
+        out['dhash'] = _dhash(img)
+        if max(w, h) <= min(limits) and within_budget:
+            return out
+        resized = max(w, h) > max_dim
+        if resized:
+            scale = max_dim / float(max(w, h))
+            img = img.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.LANCZOS)
+        if transcode is not None:
+            out['data'], out['mime'], _ = transcode_image(
+                img, content_type, None if resized else data, **transcode,
+            )
+            out['size'] = probe_image_size(out['data']) or img.size
+        elif resized:
+            out['data'], out['mime'] = _encode(img, content_type)
+            out['size'] = img.size
+        for dim in variant_dims:
+            cw, ch = img.size
+            if max(cw, ch) <= dim:
+                continue
+            scale = dim / float(max(cw, ch))
+            small = img.resize((max(1, int(cw * scale)), max(1, int(ch * scale))), Image.LANCZOS)
+            if transcode is not None:
+                out['variants'][dim] = transcode_image(small, content_type, None, **transcode)[:2]
+            else:
+                out['variants'][dim] = _encode(small, content_type)
+    except Exception:
+        pass
+    return out
@@ -0,0 +1,248 @@
+"""
+LLM 后端故障切换：熔断器与对冲请求
+StreamRace 按优先级依次使用多个后端实例：首个流式事件超过 hedge_after 秒仍未到达时再向下一个实例并发一路请求，
+先产出 token（或先完成）的一路胜出，其余各路取消；某路 429/5xx/超时失败且还有备用实例时立即切换，
+不在原地等待 Retry-After。CircuitBreaker 记录各实例连续失败次数，达到阈值后熔断 cooldown 秒，
+期间路由绕开该实例；到期后放行一次试探请求，成功即恢复。
+只应在事件循环线程中使用。
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+import aiohttp
+
+# 视为实例暂时不可用（应切换并计入熔断）的 HTTP 状态码；其余 5xx 同样处理
+_TRANSIENT_STATUS = frozenset({408, 409, 425, 429})
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """限流、过载、5xx、超时与连接错误：换一个实例可能成功；400 等请求本身的问题不切换"""
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError, aiohttp.ClientConnectionError)):
+        return True
+    status = getattr(exc, 'status', None)
+    if not isinstance(status, int):
+        status = getattr(exc, 'status_code', None)  # openai SDK 的 APIStatusError
+    if isinstance(status, int):
+        return status in _TRANSIENT_STATUS or status >= 500
+    if type(exc).__name__ in ('APIConnectionError', 'APITimeoutError'):
+        return True
+    msg = str(exc).lower()
+    return any(k in msg for k in ('rate limit', 'overloaded', 'temporarily'))
+
+
+class _BreakerState:
+    __slots__ = ('failures', 'open_until', 'probing')
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 60.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = max(0.0, float(cooldown))
+        self._states: dict[str, _BreakerState] = {}
+        self.trips = 0
+
+    def _state(self, name: str) -> _BreakerState:
+        s = self._states.get(name)
+        if s is None:
+            s = self._states[name] = _BreakerState()
+        return s
+
+    def is_open(self, name: str) -> bool:
+        s = self._states.get(name)
+        if s is None or s.failures < self.failure_threshold:
+            return False
+        # 冷却结束后只放行一个试探请求
+        return time.monotonic() < s.open_until or s.probing
+
+    def acquire(self, name: str) -> None:
+        """即将向该实例发请求；处于半开状态时占用试探名额"""
+        s = self._state(name)
+        if s.failures >= self.failure_threshold:
+            s.probing = True
+
+    def record_success(self, name: str) -> None:
+        s = self._state(name)
+        s.failures = 0
+        s.probing = False
+
+    def record_failure(self, name: str) -> None:
+        s = self._state(name)
+        s.failures += 1
+        s.probing = False
+        if s.failures >= self.failure_threshold:
+            if s.failures == self.failure_threshold:
+                self.trips += 1
+            s.open_until = time.monotonic() + self.cooldown
+
+    def release(self, name: str) -> None:
+        """请求被取消、没有结论：归还试探名额"""
+        self._state(name).probing = False
+
+    def open_remaining(self) -> dict[str, float]:
+        """熔断中的实例 -> 剩余冷却秒数"""
+        now = time.monotonic()
+        return {
+            name: max(0.0, s.open_until - now)
+            for name, s in self._states.items()
+            if s.failures >= self.failure_threshold and (now < s.open_until or s.probing)
+        }
+
+
+class StreamLeg:
+    """
+    一路请求：代替 bot 消息交给后端的流式实现。
+    id 与真实消息不同，各路在 EditScheduler 中互不覆盖；只有胜出的一路（或尚未分出胜负时）的编辑会写到消息上。
+    """
+
+    def __init__(self, race: 'StreamRace', message: Any, provider: Any):
+        self._race = race
+        self.message = message
+        self.provider = provider
+        self.id = -id(self)
+        self.started_at = time.monotonic()
+
+    @property
+    def can_failover(self) -> bool:
+        """失败时还有其他实例可用：后端不必原地等待重试"""
+        return self._race.has_alternative(self)
+
+    def mark_token(self) -> None:
+        """收到首个流式事件（文本、思考、工具调用增量均可）"""
+        self._race.claim(self)
+
+    async def edit(self, **kwargs) -> Any:
+        race = self._race
+        if race.closed or race.winner not in (None, self):
+            return None
+        return await self.message.edit(**kwargs)
+
+
+class StreamRace:
+    """
+    providers 按优先级排列；call(provider, leg) 发起一路流式请求并返回结果。
+    run() 返回 (胜出实例, 结果)；全部失败时抛出最后一路的异常。
+    """
+
+    def __init__(
+        self,
+        message: Any,
+        providers: list[Any],
+        call: Callable[[Any, StreamLeg], Awaitable[Any]],
+        breaker: CircuitBreaker,
+        hedge_after: float = 0.0,
+        on_leg_done: Optional[Callable[[StreamLeg], None]] = None,
+    ):
+        self.message = message
+        self.providers = providers
+        self.call = call
+        self.breaker = breaker
+        self.hedge_after = hedge_after
+        self.on_leg_done = on_leg_done
+        self.winner: Optional[StreamLeg] = None
+        self.closed = False
+        self.hedged = False  # 是否发出过对冲请求
+        self.failovers = 0  # 因失败而切换的次数
+        self._next = 0
+        self._legs: dict[asyncio.Task, StreamLeg] = {}  # 进行中的各路
+        self._launched: list[StreamLeg] = []
+        self._cancelled: set[asyncio.Task] = set()
+        self._claimed = asyncio.Event()
+
+    def has_alternative(self, leg: StreamLeg) -> bool:
+        return self._next < len(self.providers) or any(other is not leg for other in self._legs.values())
+
+    def claim(self, leg: StreamLeg) -> None:
+        if self.winner is None:
+            self.winner = leg
+            self._claimed.set()
+
+    def _launch(self) -> StreamLeg:
+        provider = self.providers[self._next]
+        self._next += 1
+        leg = StreamLeg(self, self.message, provider)
+        self._launched.append(leg)
+        self.breaker.acquire(provider.name)
+        self._legs[asyncio.ensure_future(self.call(provider, leg))] = leg
+        return leg
+
+    def _cancel_losers(self) -> None:
+        for task, leg in self._legs.items():
+            if leg is self.winner or task.done() or task in self._cancelled:
+                continue
+            task.cancel()
+            self._cancelled.add(task)
+            # 比胜者先出发却更慢：计为一次失败（持续偏慢的实例也会被熔断）
+            if leg.started_at <= self.winner.started_at:
+                self.breaker.record_failure(leg.provider.name)
+            else:
+                self.breaker.release(leg.provider.name)
+
+    async def run(self) -> tuple[Any, Any]:
+        last = self._launch()
+        claimed = asyncio.ensure_future(self._claimed.wait())
+        error: Optional[BaseException] = None
+        try:
+            while self._legs:
+                timeout = None
+                if self.winner is None and self.hedge_after > 0 and self._next < len(self.providers):
+                    timeout = max(0.0, last.started_at + self.hedge_after - time.monotonic())
+                waiting = set(self._legs)
+                if not claimed.done():
+                    waiting.add(claimed)
+                done, _ = await asyncio.wait(
+                    waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    # 首个 token 超时：对冲
+                    self.hedged = True
+                    last = self._launch()
+                    continue
+                if claimed in done and self.winner is not None:
+                    self._cancel_losers()
+                for task in done:
+                    leg = self._legs.pop(task, None)
+                    if leg is None:
+                        continue
+                    if task.cancelled():
+                        continue
+                    exc = task.exception()
+                    name = leg.provider.name
+                    if exc is None:
+                        if self.winner not in (None, leg):
+                            self.breaker.release(name)
+                            continue
+                        self.winner = leg
+                        self.breaker.record_success(name)
+                        self._cancel_losers()
+                        return leg.provider, task.result()
+                    error = exc
+                    transient = is_transient_error(exc)
+                    if transient:
+                        self.breaker.record_failure(name)
+                    else:
+                        self.breaker.release(name)
+                    if self.winner is leg:
+                        # 已经输出了内容，不再切换
+                        raise exc
+                    if not self._legs and transient and self._next < len(self.providers):
+                        self.failovers += 1
+                        last = self._launch()
+            raise error or RuntimeError('没有可用的 LLM 后端实例')
+        finally:
+            self.closed = True
+            claimed.cancel()
+            pending = list(self._legs)
+            for task in pending:
+                if task.cancel():
+                    self.breaker.release(self._legs[task].provider.name)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            if self.on_leg_done is not None:
+                for leg in self._launched:
+                    self.on_leg_done(leg)
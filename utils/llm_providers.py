@@ -0,0 +1,187 @@
+"""
+LLM 后端注册表
+每种后端（kind）声明：配置段与字段、请求转换 + 流式解析的实现（cog 上的方法名，签名 (provider, channel_id, bot_message)）、
+摘要请求的实现，以及客户端生命周期（start/close）。
+配置里可以在内置的单实例配置段（gemini / claude_openai / ...）之外，用 providers 定义多个命名实例
+（同一 kind 不同 key/模型/地址），供路由与故障切换使用。实例只解析配置，被选中后才 start()：
+openai SDK 只在选中 OpenAI 兼容类实例时才导入并创建客户端，客户端使用 HTTPTransport 共用的 httpx 连接池。
+"""
+from typing import Any, Optional
+
+
+class ProviderHTTPError(Exception):
+    """后端返回的错误响应；status 供故障切换判断是否换实例（见 utils.llm_failover）"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class LLMProvider:
+    kind = ''
+    section = ''  # 内置实例读取的配置段 ai_customer_service.<section>
+    default_base_url = ''
+    default_model = ''
+    stream_method = ''  # cog 上的流式实现
+    summary_method = ''  # cog 上的摘要实现，签名 (provider, prompt, model, max_tokens) -> str
+    http_client = 'aiohttp'  # 请求走哪个连接池（HTTPTransport 预热时使用）
+
+    def __init__(self, name: str, conf: dict[str, Any]):
+        self.name = name
+        self.conf = dict(conf)  # 配置重载时相同配置的实例直接沿用（不重建客户端）
+        self.api_key = str(conf.get('api_key', '') or '')
+        self.base_url = str(conf.get('base_url', '') or self.default_base_url).rstrip('/') + '/'
+        self.model = str(conf.get('model', '') or self.default_model)
+        self.started = False
+
+    @property
+    def label(self) -> str:
+        return self.kind if self.name == self.kind else f'{self.name}({self.kind})'
+
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def same_config(self, other: 'LLMProvider') -> bool:
+        return type(self) is type(other) and self.name == other.name and self.conf == other.conf
+
+    async def start(self, transport: Any = None) -> None:
+        """被选中时调用：导入 SDK、创建客户端；transport 为 HTTPTransport（可选）"""
+        self.started = True
+
+    async def close(self) -> None:
+        self.started = False
+
+
+class _OpenAIClientProvider(LLMProvider):
+    """使用 openai SDK（AsyncOpenAI）的后端：SDK 在 start() 时才导入"""
+
+    http_client = 'httpx'
+
+    def __init__(self, name: str, conf: dict[str, Any]):
+        super().__init__(name, conf)
+        self.client: Any = None
+        self.start_error: Optional[str] = None
+        self._shared_pool = False
+
+    async def start(self, transport: Any = None) -> None:
+        if self.client is not None or not self.api_key:
+            return
+        try:
+            from openai import AsyncOpenAI
+
+            http_client = transport.httpx_client() if transport is not None else None
+        except ImportError as e:
+            self.start_error = f'未安装 openai 包: {e}'
+            return
+        kwargs: dict[str, Any] = {}
+        if http_client is not None:
+            kwargs['http_client'] = http_client
+        self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, **kwargs)
+        self._shared_pool = http_client is not None
+        self.start_error = None
+        self.started = True
+
+    async def close(self) -> None:
+        if self.client is not None:
+            # 共用连接池由 HTTPTransport 关闭；AsyncOpenAI.close() 会关闭传入的 http_client
+            if not self._shared_pool:
+                try:
+                    await self.client.close()
+                except Exception:
+                    pass
+            self.client = None
+        self.started = False
+
+
+_REGISTRY: dict[str, type[LLMProvider]] = {}
+
+
+def register_provider(cls: type[LLMProvider]) -> type[LLMProvider]:
+    _REGISTRY[cls.kind] = cls
+    return cls
+
+
+def provider_kinds() -> tuple[str, ...]:
+    return tuple(_REGISTRY)
+
+
+def create_provider(kind: str, name: str, conf: dict[str, Any]) -> LLMProvider:
+    """按 kind 创建实例；未知 kind 抛 KeyError"""
+    return _REGISTRY[kind](name, conf or {})
+
+
+@register_provider
+class GeminiProvider(LLMProvider):
+    kind = 'gemini'
+    section = 'gemini'
+    default_base_url = 'https://generativelanguage.googleapis.com'
+    default_model = 'gemini-2.0-flash'
+    stream_method = '_call_gemini_stream'
+    summary_method = '_summary_complete_gemini'
+
+    def __init__(self, name: str, conf: dict[str, Any]):
+        # 兼容旧配置：gemini 段用 proxy_url 作为地址
+        conf = {**conf, 'base_url': conf.get('base_url') or conf.get('proxy_url')}
+        super().__init__(name, conf)
+        self.base_url = self.base_url.rstrip('/')
+
+
+@register_provider
+class ClaudeOpenAIProvider(_OpenAIClientProvider):
+    kind = 'claude_openai'
+    section = 'claude_openai'
+    default_base_url = 'https://api.anthropic.com/v1/'
+    default_model = 'claude-sonnet-4-20250514'
+    stream_method = '_call_claude_openai_stream'
+    summary_method = '_summary_complete_chat'
+
+    def __init__(self, name: str, conf: dict[str, Any]):
+        super().__init__(name, conf)
+        self.max_tokens = int(conf.get('max_tokens', 8192))
+        raw = conf.get('thinking')
+        self.thinking: Optional[dict[str, Any]] = dict(raw) if isinstance(raw, dict) else None
+
+
+@register_provider
+class OpenAIResponsesProvider(_OpenAIClientProvider):
+    kind = 'openai_responses'
+    section = 'openai_responses'
+    default_base_url = 'https://api.openai.com/v1/'
+    default_model = 'gpt-4.1'
+    stream_method = '_call_openai_responses_stream'
+    summary_method = '_summary_complete_responses'
+
+    def __init__(self, name: str, conf: dict[str, Any]):
+        super().__init__(name, conf)
+        self.max_output_tokens = int(conf.get('max_output_tokens', 8192))
+        raw = conf.get('reasoning')
+        self.reasoning: Optional[dict[str, Any]] = dict(raw) if isinstance(raw, dict) else None
+
+    def needs_reasoning_items(self) -> bool:
+        """reasoning 模型回放 function_call 时必须带上对应的 reasoning item"""
+        model = self.model.lower()
+        return (
+            bool(self.reasoning)
+            or model.startswith('gpt-5')
+            or model.startswith(('o1', 'o3', 'o4'))
+            or 'reasoning' in model
+        )
+
+
+@register_provider
+class ClaudeMessagesProvider(LLMProvider):
+    kind = 'claude_messages'
+    section = 'claude_messages'
+    default_base_url = 'https://api.anthropic.com/v1/'
+    default_model = 'claude-opus-4-7'
+    stream_method = '_call_claude_messages_stream'
+    summary_method = '_summary_complete_claude'
+
+    def __init__(self, name: str, conf: dict[str, Any]):
+        super().__init__(name, conf)
+        self.max_tokens = int(conf.get('max_tokens', 8192))
+        self.interleaved_thinking = bool(conf.get('interleaved_thinking', False))
+        self.prompt_cache = bool(conf.get('prompt_cache', False))
+        self.prompt_cache_ttl = str(conf.get('prompt_cache_ttl', '5m')).strip().lower()
+        raw = conf.get('thinking')
+        self.thinking: Optional[dict[str, Any]] = dict(raw) if isinstance(raw, dict) else None
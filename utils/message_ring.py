@@ -0,0 +1,278 @@
+"""
+网关事件维护的频道消息环形缓存
+每个频道只保留最近的若干条消息（按 ID 升序），并记录「覆盖下界」floor：
+ID ≥ floor 的消息都在缓存中（删除的消息同步移除），读者据此判断能否免去 REST history() 调用。
+缓存完整的 discord.Message：重建对话与 fetch_messages 需要附件对象（下载）、嵌入、引用与作者的
+Member 身份组（管理员判断），精简记录无法替代。这些对象在 discord.py 自身的消息缓存淘汰后仍由这里持有，
+因此除条数（per_channel × max_channels）外还按估算字节数 max_bytes 限制：作者、频道等对象与
+discord.py 的缓存共享，只计消息本身、正文、附件与嵌入。
+只应在事件循环线程中使用。
+"""
+import bisect
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+# 单条消息的估算内存：Message 对象本身（slots、时间戳、引用、标志等）/ 每个附件 / 每个嵌入
+_MESSAGE_OVERHEAD = 1536
+_ATTACHMENT_OVERHEAD = 512
+_EMBED_OVERHEAD = 1024
+
+
+def estimate_message_bytes(message: Any) -> int:
+    """消息对象的粗略内存占用（字符按 2 字节计）；作者、频道等与 discord.py 缓存共享的对象不计"""
+    size = _MESSAGE_OVERHEAD + 2 * len(getattr(message, 'content', None) or '')
+    for a in getattr(message, 'attachments', None) or ():
+        size += _ATTACHMENT_OVERHEAD + 2 * (len(a.url or '') + len(a.filename or ''))
+    for e in getattr(message, 'embeds', None) or ():
+        size += _EMBED_OVERHEAD + 2 * (len(e.title or '') + len(e.description or ''))
+        size += sum(2 * (len(f.name or '') + len(f.value or '')) for f in e.fields)
+    return size
+
+
+class _ChannelRing:
+    __slots__ = ('ids', 'msgs', 'sizes', 'floor', 'from_start')
+
+    def __init__(self, floor: int, from_start: bool):
+        self.ids: list[int] = []
+        self.msgs: list[Any] = []
+        self.sizes: list[int] = []  # 与 msgs 对应的估算字节数
+        self.floor = floor  # ID ≥ floor 的消息均已缓存
+        self.from_start = from_start  # floor 之前没有任何消息（覆盖到频道开头）
+
+
+class MessageRing:
+    """频道 ID -> 最近消息的有界缓存；读取方法在无法保证完整时返回 None，由调用方回退 REST"""
+
+    def __init__(self, per_channel: int = 100, max_channels: int = 100, max_bytes: int = 32 * 1024 * 1024):
+        self.per_channel = max(1, int(per_channel))
+        self.max_channels = max(1, int(max_channels))
+        self.max_bytes = max(1, int(max_bytes))
+        self._rings: 'OrderedDict[int, _ChannelRing]' = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # 因字节上限淘汰的消息数
+
+    # ── 维护 ──────────────────────────────────────────
+
+    def _ring(self, channel_id: int, floor: int, from_start: bool) -> _ChannelRing:
+        ring = self._rings.get(channel_id)
+        if ring is None:
+            ring = _ChannelRing(floor, from_start)
+            self._rings[channel_id] = ring
+            while len(self._rings) > self.max_channels:
+                self._bytes -= sum(self._rings.popitem(last=False)[1].sizes)
+        else:
+            self._rings.move_to_end(channel_id)
+        return ring
+
+    def _insert(self, ring: _ChannelRing, message: Any) -> None:
+        mid = message.id
+        size = estimate_message_bytes(message)
+        if ring.ids and mid > ring.ids[-1]:
+            ring.ids.append(mid)
+            ring.msgs.append(message)
+            ring.sizes.append(size)
+        else:
+            i = bisect.bisect_left(ring.ids, mid)
+            if i < len(ring.ids) and ring.ids[i] == mid:
+                self._replace(ring, i, message, size)
+                return
+            ring.ids.insert(i, mid)
+            ring.msgs.insert(i, message)
+            ring.sizes.insert(i, size)
+        self._bytes += size
+        overflow = len(ring.ids) - self.per_channel
+        if overflow > 0:
+            self._drop_oldest(ring, overflow)
+
+    def _replace(self, ring: _ChannelRing, i: int, message: Any, size: Optional[int] = None) -> None:
+        if size is None:
+            size = estimate_message_bytes(message)
+        self._bytes += size - ring.sizes[i]
+        ring.msgs[i] = message
+        ring.sizes[i] = size
+
+    def _drop_oldest(self, ring: _ChannelRing, n: int) -> None:
+        """丢弃最早的 n 条（n 小于现有条数），覆盖下界随之上移"""
+        self._bytes -= sum(ring.sizes[:n])
+        del ring.ids[:n]
+        del ring.msgs[:n]
+        del ring.sizes[:n]
+        ring.floor = ring.ids[0]
+        ring.from_start = False
+
+    def _enforce_bytes(self, channel_id: int) -> None:
+        """超出字节上限：先整体淘汰最久未用的其他频道，只剩当前频道时丢弃其最早的消息"""
+        while self._bytes > self.max_bytes and len(self._rings) > 1:
+            oldest = next(iter(self._rings))
+            if oldest == channel_id:
+                self._rings.move_to_end(channel_id)
+                continue
+            ring = self._rings.pop(oldest)
+            self._bytes -= sum(ring.sizes)
+            self.evictions += len(ring.ids)
+        ring = self._rings.get(channel_id)
+        if ring is None or self._bytes <= self.max_bytes:
+            return
+        n = 0
+        excess = self._bytes - self.max_bytes
+        while n < len(ring.sizes) - 1 and excess > 0:
+            excess -= ring.sizes[n]
+            n += 1
+        if n:
+            self._drop_oldest(ring, n)
+            self.evictions += n
+
+    def start(self, channel_id: int) -> None:
+        """频道/子区刚创建：缓存即完整历史（创建事件可能晚于首条消息到达，已有内容保留）"""
+        ring = self._ring(channel_id, channel_id, True)
+        ring.floor = min(ring.floor, channel_id)
+        ring.from_start = True
+
+    def observe(self, message: Any) -> None:
+        """on_message：新消息入缓存；首次见到的频道从这条消息开始覆盖"""
+        channel_id = message.channel.id
+        # 论坛帖首条消息的 ID 与帖子 ID 相同：此时覆盖到开头
+        ring = self._ring(channel_id, message.id, message.id <= channel_id)
+        if message.id < ring.floor:
+            return
+        self._insert(ring, message)
+        self._enforce_bytes(channel_id)
+
+    def update(self, channel_id: int, message_id: int, message: Optional[Any]) -> None:
+        """消息编辑：替换为新对象；拿不到新对象时丢弃该频道缓存（宁可回退 REST）"""
+        ring = self._rings.get(channel_id)
+        if ring is None:
+            return
+        i = bisect.bisect_left(ring.ids, message_id)
+        if i >= len(ring.ids) or ring.ids[i] != message_id:
+            return
+        if message is None:
+            self.drop(channel_id)
+        else:
+            self._replace(ring, i, message)
+            self._enforce_bytes(channel_id)
+
+    def remove(self, channel_id: int, message_ids: Iterable[int]) -> None:
+        ring = self._rings.get(channel_id)
+        if ring is None:
+            return
+        for mid in message_ids:
+            i = bisect.bisect_left(ring.ids, mid)
+            if i < len(ring.ids) and ring.ids[i] == mid:
+                self._bytes -= ring.sizes[i]
+                del ring.ids[i]
+                del ring.msgs[i]
+                del ring.sizes[i]
+
+    def drop(self, channel_id: int) -> None:
+        ring = self._rings.pop(channel_id, None)
+        if ring is not None:
+            self._bytes -= sum(ring.sizes)
+
+    def clear(self) -> None:
+        """网关会话重建（可能漏掉事件）时整体作废"""
+        self._rings.clear()
+        self._bytes = 0
+
+    def set_max_bytes(self, max_bytes: int) -> None:
+        self.max_bytes = max(1, int(max_bytes))
+        while self._bytes > self.max_bytes and self._rings:
+            ring = self._rings.popitem(last=False)[1]
+            self._bytes -= sum(ring.sizes)
+            self.evictions += len(ring.ids)
+
+    def backfill(self, channel_id: int, messages: list[Any], exhausted: bool = False) -> None:
+        """
+        用 REST 读到的「最新 N 条」补齐缓存（messages 须是截至当前的连续一段，顺序不限）；
+        exhausted 表示已读到频道开头。
+        """
+        if not messages and not exhausted:
+            return
+        # 两段都延续到当前：并集仍是连续的，下界取两者较小值
+        floor = min(m.id for m in messages) if messages else channel_id
+        ring = self._ring(channel_id, floor, exhausted)
+        ring.floor = min(ring.floor, floor)
+        ring.from_start = ring.from_start or exhausted
+        for m in sorted(messages, key=lambda m: m.id):
+            self._insert(ring, m)
+        self._enforce_bytes(channel_id)
+
+    # ── 读取 ──────────────────────────────────────────
+
+    def _get(self, channel_id: int) -> Optional[_ChannelRing]:
+        ring = self._rings.get(channel_id)
+        if ring is None:
+            self.misses += 1
+        return ring
+
+    def latest(self, channel_id: int, limit: int) -> Optional[list[Any]]:
+        """最近 limit 条（新→旧）；缓存不足以保证完整时返回 None"""
+        ring = self._get(channel_id)
+        if ring is None:
+            return None
+        if len(ring.msgs) < limit and not ring.from_start:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return ring.msgs[-limit:][::-1]
+
+    def oldest(self, channel_id: int, limit: int) -> Optional[list[Any]]:
+        """最早 limit 条（旧→新）；只有覆盖到频道开头时可用"""
+        ring = self._get(channel_id)
+        if ring is None:
+            return None
+        if not ring.from_start:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return ring.msgs[:limit]
+
+    def since(self, channel_id: int, after_id: Optional[int]) -> Optional[list[Any]]:
+        """ID 大于 after_id 的全部消息（旧→新）；after_id 为 None 表示整个频道"""
+        ring = self._get(channel_id)
+        if ring is None:
+            return None
+        covered = ring.from_start if after_id is None else (ring.from_start or ring.floor <= after_id)
+        if not covered:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if after_id is None:
+            return list(ring.msgs)
+        return ring.msgs[bisect.bisect_right(ring.ids, after_id):]
+
+    def window(
+        self, channel_id: int, anchor_id: int, span: int,
+    ) -> Optional[tuple[Optional[list[Any]], int]]:
+        """
+        目标消息前后各 span 条（旧→新）。返回 (窗口, 前文缺口条数)：
+        目标在覆盖范围内但不存在（已删除）时窗口为 None；目标早于覆盖下界时返回 None。
+        前文缺口需调用方用 REST history(before=窗口首条) 补齐。
+        """
+        ring = self._get(channel_id)
+        if ring is None:
+            return None
+        if anchor_id < ring.floor:
+            self.misses += 1
+            return None
+        self.hits += 1
+        i = bisect.bisect_left(ring.ids, anchor_id)
+        if i >= len(ring.ids) or ring.ids[i] != anchor_id:
+            return None, 0
+        start = max(0, i - span)
+        missing = 0 if ring.from_start else span - (i - start)
+        return ring.msgs[start:i + span + 1], missing
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'channels': len(self._rings),
+            'messages': sum(len(r.ids) for r in self._rings.values()),
+            'capacity': self.per_channel * self.max_channels,
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
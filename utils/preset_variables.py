@@ -0,0 +1,144 @@
+"""
+管理预设中的 %变量% 渲染与缓存
+每个变量声明自己的渲染协程与「哪些频道的消息事件会使其失效」；渲染结果缓存到失效或超过 max_age 为止。
+被使用过的变量在失效后于后台重新渲染（短暂防抖合并连续事件），点击预设按钮时通常直接取到现成结果。
+渲染失败时 render 抛出 PresetRenderError：其文字只用于本次展开，不入缓存，下次取值重新渲染。
+只应在事件循环线程中使用。
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+
+class PresetRenderError(Exception):
+    """变量暂时无法渲染（频道不可访问等）；str(异常) 为展开到模板中的提示文字"""
+
+
+class PresetVariable:
+    """模板变量 %name%：render 渲染正文；watches(channel_id) 为真时该频道的消息新增/编辑/删除使缓存失效"""
+
+    __slots__ = ('name', 'render', 'watches', 'max_age')
+
+    def __init__(
+        self,
+        name: str,
+        render: Callable[[], Awaitable[str]],
+        watches: Optional[Callable[[int], bool]] = None,
+        max_age: Optional[float] = None,
+    ):
+        self.name = name
+        self.render = render
+        self.watches = watches or (lambda _channel_id: False)
+        self.max_age = max_age  # 兜底：网关漏事件时最多过期这么久；None 表示只靠事件失效
+
+
+class PresetVariableRegistry:
+    def __init__(self, refresh_delay: float = 1.0):
+        self.refresh_delay = refresh_delay
+        self._vars: dict[str, PresetVariable] = {}
+        self._values: dict[str, tuple[str, float]] = {}  # 名称 -> (渲染结果, monotonic 渲染时刻)
+        self._generation: dict[str, int] = {}  # 每次失效 +1，渲染期间失效的结果不入缓存
+        self._renders: dict[str, asyncio.Task] = {}
+        self._refreshes: dict[str, asyncio.Task] = {}
+        self._used: set[str] = set()
+        self.hits = 0
+        self.renders = 0
+        self.failures = 0
+
+    def register(self, var: PresetVariable) -> None:
+        self._vars[var.name] = var
+        self.invalidate(var.name)
+
+    def _cached(self, name: str) -> Optional[str]:
+        entry = self._values.get(name)
+        if entry is None:
+            return None
+        max_age = self._vars[name].max_age
+        if max_age is not None and time.monotonic() - entry[1] > max_age:
+            self._values.pop(name, None)
+            return None
+        return entry[0]
+
+    async def _render(self, name: str) -> tuple[str, bool, bool]:
+        """返回 (结果, 是否已入缓存, 是否渲染失败)"""
+        gen = self._generation.get(name, 0)
+        self.renders += 1
+        try:
+            value = await self._vars[name].render()
+        except PresetRenderError as e:
+            self.failures += 1
+            return str(e), False, True
+        stored = gen == self._generation.get(name, 0)
+        if stored:
+            self._values[name] = (value, time.monotonic())
+        return value, stored, False
+
+    async def get(self, name: str) -> str:
+        """取变量值：有缓存直接返回，否则渲染（并发调用共用同一次渲染）"""
+        self._used.add(name)
+        value = self._cached(name)
+        if value is not None:
+            self.hits += 1
+            return value
+        for _ in range(3):
+            task = self._renders.get(name)
+            if task is None or task.done():
+                task = asyncio.ensure_future(self._render(name))
+                self._renders[name] = task
+            value, stored, failed = await asyncio.shield(task)
+            if stored or failed:
+                return value
+        # 渲染期间持续有事件：返回最后一次结果，不入缓存
+        return value
+
+    async def expand(self, template: str) -> str:
+        names = [n for n in self._vars if f"%{n}%" in template]
+        if not names:
+            return template
+        values = await asyncio.gather(*(self.get(n) for n in names))
+        out = template
+        for n, v in zip(names, values):
+            out = out.replace(f"%{n}%", v)
+        return out
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """作废指定变量（None 为全部）；用过的变量在后台重新渲染"""
+        for n in ([name] if name is not None else list(self._vars)):
+            self._generation[n] = self._generation.get(n, 0) + 1
+            self._values.pop(n, None)
+            if n in self._used:
+                self._schedule_refresh(n)
+
+    def on_channel_event(self, channel_id: int) -> None:
+        """某频道有消息新增/编辑/删除"""
+        for var in self._vars.values():
+            if var.watches(channel_id):
+                self.invalidate(var.name)
+
+    def _schedule_refresh(self, name: str) -> None:
+        if name in self._refreshes:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        async def refresh():
+            try:
+                await asyncio.sleep(self.refresh_delay)
+            finally:
+                self._refreshes.pop(name, None)
+            await self.get(name)
+
+        task = loop.create_task(refresh())
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._refreshes[name] = task
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'variables': len(self._vars),
+            'cached': sum(1 for n in self._vars if n in self._values),
+            'hits': self.hits,
+            'renders': self.renders,
+            'failures': self.failures,
+        }
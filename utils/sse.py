@@ -0,0 +1,99 @@
+"""
+增量 SSE（text/event-stream）解析
+按块读取响应体，在 bytearray 缓冲中按行切分，每次 feed 只整理一次缓冲；支持多行 data:、event: 事件名、
+注释行与 \\r\\n / \\n 行尾。事件数据保持为 bytes，交给 loads_json 直接解析（装有 orjson 时使用 orjson）。
+"""
+import json
+from typing import Any, AsyncIterator, Optional
+
+try:
+    import orjson as _orjson
+except ImportError:  # 可选依赖：未安装时退回标准库
+    _orjson = None
+
+
+def loads_json(data: bytes) -> Any:
+    """解析 JSON（bytes）；格式错误抛 ValueError（json.JSONDecodeError / orjson.JSONDecodeError 均是其子类）"""
+    if _orjson is not None:
+        return _orjson.loads(data)
+    return json.loads(data)
+
+
+class SSEDecoder:
+    """feed(块) -> [(事件名 | None, data 字节)]；一个事件在遇到空行时产出"""
+
+    __slots__ = ('_buf', '_event', '_data')
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._event: Optional[str] = None
+        self._data: list[bytes] = []
+
+    def feed(self, chunk: bytes) -> list[tuple[Optional[str], bytes]]:
+        buf = self._buf
+        buf += chunk
+        events: list[tuple[Optional[str], bytes]] = []
+        view = memoryview(buf)
+        pos = 0
+        try:
+            while True:
+                nl = buf.find(b'\n', pos)
+                if nl < 0:
+                    break
+                end = nl - 1 if nl > pos and buf[nl - 1] == 0x0D else nl
+                self._line(view, pos, end, events)
+                pos = nl + 1
+        finally:
+            view.release()
+        if pos:
+            del buf[:pos]
+        return events
+
+    def close(self) -> list[tuple[Optional[str], bytes]]:
+        """流结束：未以空行结尾的最后一个事件也产出"""
+        events: list[tuple[Optional[str], bytes]] = []
+        if self._buf:
+            view = memoryview(self._buf)
+            try:
+                end = len(self._buf) - (1 if self._buf.endswith(b'\r') else 0)
+                self._line(view, 0, end, events)
+            finally:
+                view.release()
+            self._buf.clear()
+        self._line(memoryview(b''), 0, 0, events)
+        return events
+
+    def _line(self, view: memoryview, start: int, end: int, events: list) -> None:
+        if start == end:
+            # 空行：派发事件
+            if self._data:
+                data = self._data[0] if len(self._data) == 1 else b'\n'.join(self._data)
+                events.append((self._event, data))
+            self._event = None
+            self._data = []
+            return
+        first = view[start]
+        if first == 0x3A:  # ':' 注释 / 心跳
+            return
+        if first == 0x64 and view[start:start + 5] == b'data:':
+            vs = start + 5
+            if vs < end and view[vs] == 0x20:
+                vs += 1
+            self._data.append(bytes(view[vs:end]))
+            return
+        if first == 0x65 and view[start:start + 6] == b'event:':
+            vs = start + 6
+            if vs < end and view[vs] == 0x20:
+                vs += 1
+            self._event = bytes(view[vs:end]).decode('utf-8', errors='replace')
+        # id: / retry: 等字段不需要
+
+
+async def iter_sse(content: Any) -> AsyncIterator[tuple[Optional[str], bytes]]:
+    """按块读取 aiohttp 响应体（resp.content）并逐个产出 SSE 事件"""
+    decoder = SSEDecoder()
+    async for chunk in content.iter_any():
+        for ev in decoder.feed(chunk):
+            yield ev
+    for ev in decoder.close():
+        yield ev
@@ -0,0 +1,115 @@
+"""
+本地 token 估算（不走网络）
+按 provider 族粗略估算 Gemini 形态对话回合的输入 token 数，用于历史窗口裁剪。
+估算偏保守：宁可多算，避免实际请求超出预算。
+"""
+import json
+import math
+from typing import Any, Optional
+
+# provider -> 估算族
+_FAMILY = {
+    'gemini': 'gemini',
+    'claude_openai': 'claude',
+    'claude_messages': 'claude',
+    'openai_responses': 'openai',
+}
+
+# 每 token 的窄字符数（ASCII/拉丁）与每个宽字符（CJK 等多字节字符）的 token 数
+_TEXT_RATIO = {
+    'gemini': (4.0, 0.8),
+    'claude': (3.5, 1.2),
+    'openai': (4.0, 0.9),
+}
+
+# 无尺寸信息时的单图估算（按 1920x1080 截图量级）
+_DEFAULT_IMAGE_TOKENS = {
+    'gemini': 1032,
+    'claude': 1600,
+    'openai': 1105,
+}
+
+# 每个回合的结构开销（role、分隔符等）
+_TURN_OVERHEAD = 4
+
+# 回合内缓存估算结果的字段（以 _ 开头，不会被发送给 API）
+_CACHE_KEY = '_tok'
+
+
+def provider_family(provider: str) -> str:
+    return _FAMILY.get(provider, 'gemini')
+
+
+def estimate_text_tokens(text: str, family: str) -> int:
+    if not text:
+        return 0
+    narrow_per_token, wide_cost = _TEXT_RATIO.get(family, _TEXT_RATIO['gemini'])
+    n_chars = len(text)
+    # UTF-8 下 CJK 多为 3 字节：用编码长度在 C 层估出宽字符数，避免逐字符遍历
+    wide = min(n_chars, (len(text.encode('utf-8', errors='replace')) - n_chars) // 2)
+    narrow = n_chars - wide
+    return int(math.ceil(narrow / narrow_per_token + wide * wide_cost))
+
+
+def estimate_image_tokens(
+    family: str, width: Optional[int] = None, height: Optional[int] = None,
+) -> int:
+    if not width or not height:
+        return _DEFAULT_IMAGE_TOKENS.get(family, 1032)
+    if family == 'claude':
+        # 长边超过 1568 时服务端先缩放，约 w*h/750
+        scale = min(1.0, 1568 / float(max(width, height)))
+        return max(1, int(width * scale * height * scale / 750))
+    if family == 'openai':
+        # high detail：先缩到 2048 内、短边 768，再按 512 切块
+        scale = min(1.0, 2048 / float(max(width, height)))
+        w, h = width * scale, height * scale
+        scale = min(1.0, 768 / float(min(w, h)))
+        w, h = w * scale, h * scale
+        return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
+    # gemini：两边都不超过 384 计 258，否则按 768 切块每块 258
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+
+
+def _estimate_part(part: dict, family: str) -> int:
+    if 'text' in part:
+        return estimate_text_tokens(part.get('text') or '', family)
+    if 'inlineData' in part:
+        inline = part['inlineData'] or {}
+        mime = str(inline.get('mimeType', ''))
+        if mime.startswith('image/'):
+            return estimate_image_tokens(family, inline.get('_w'), inline.get('_h'))
+        size = inline.get('_size')
+        if size is None:
+            size = len(inline.get('data') or '') * 3 // 4
+        # PDF/文本附件：按字节粗估
+        return max(258, int(size) // 4)
+    for key in ('functionCall', 'functionResponse'):
+        if key in part:
+            try:
+                raw = json.dumps(part[key], ensure_ascii=False)
+            except (TypeError, ValueError):
+                raw = str(part[key])
+            return estimate_text_tokens(raw, family) + _TURN_OVERHEAD
+    return 0
+
+
+def estimate_turn_tokens(turn: Any, provider: str) -> int:
+    """估算单个 Gemini 形态回合的 token 数；结果按族缓存在回合的 _tok 字段里"""
+    if not isinstance(turn, dict):
+        return 0
+    family = provider_family(provider)
+    cached = turn.get(_CACHE_KEY)
+    if isinstance(cached, dict) and family in cached:
+        return cached[family]
+    total = _TURN_OVERHEAD
+    for p in turn.get('parts') or []:
+        if isinstance(p, dict):
+            total += _estimate_part(p, family)
+    if not isinstance(cached, dict):
+        cached = {}
+        turn[_CACHE_KEY] = cached
+    cached[family] = total
+    return total